@@ -0,0 +1,169 @@
+# Copyright 2022 CVS Health and/or one of its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+from sqlalchemy import create_engine
+
+from coldstart.dialects import get_dialect
+from coldstart.parse import get_queries_from_domains
+from coldstart.query import (
+    run_query,
+    multi_query,
+    stage_leftmost_table,
+    template_queries,
+    collect_captured_metadata,
+    prep_join_query,
+    prep_join_schema,
+    drop_tables,
+)
+
+
+# SQLite joins at most 64 tables
+MAX_JOIN = {"sqlite": 63}
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("coldstart benchmarks")
+    group.addoption(
+        "--bench-queries",
+        default="10,100",
+        help="Comma-separated query bank sizes, up to 10000",
+    )
+    group.addoption(
+        "--bench-rows",
+        default="1000,10000",
+        help="Comma-separated leftmost table row counts, up to 10000000",
+    )
+    group.addoption(
+        "--bench-dialect",
+        default="sqlite",
+        help="Local engine to benchmark on: sqlite or duckdb",
+    )
+
+
+def pytest_generate_tests(metafunc):
+    if "scale" in metafunc.fixturenames:
+        config = metafunc.config
+        queries = [int(q) for q in config.getoption("--bench-queries").split(",")]
+        rows = [int(r) for r in config.getoption("--bench-rows").split(",")]
+        scales = [(q, r) for q in queries for r in rows]
+        metafunc.parametrize(
+            "scale",
+            scales,
+            ids=[f"{q}q-{r}r" for q, r in scales],
+            indirect=True,
+            scope="module",
+        )
+
+
+@pytest.fixture(scope="module")
+def scale(request):
+    return request.param
+
+
+def write_bank(query_dir, dialect, n_queries):
+    """Writes a synthetic query bank of n_queries files"""
+    query_dir.mkdir(parents=True, exist_ok=True)
+    for i in range(n_queries):
+        query_dir.joinpath(f"benchQuery{i}.sql").write_text(
+            f"-- DIALECT: {dialect}\n"
+            "-- ENTITY: team_id\n"
+            f"-- DOMAIN: domain{i % 10}\n"
+            "SELECT\n"
+            "    LMT.idx,\n"
+            f"    LMT.y * {i} AS f_int,\n"
+            f"    LMT.y * {i} + 0.5 AS f_float,\n"
+            f"    CASE WHEN LMT.y = 1 THEN 'yes' ELSE 'no' END AS f_str\n"
+            "FROM\n"
+            "    {LEFTMOST_TABLE} AS LMT\n"
+        )
+
+
+@pytest.fixture(scope="module")
+def warehouse(scale, tmp_path_factory, request):
+    """Builds a local warehouse and runs every phase once
+
+    Each phase's inputs are kept so benchmarks can time the phases
+    separately.
+    """
+    n_queries, n_rows = scale
+    dialect = request.config.getoption("--bench-dialect")
+    if dialect == "duckdb":
+        pytest.importorskip("duckdb_engine")
+    tmp_path = tmp_path_factory.mktemp(f"bench_{n_queries}_{n_rows}")
+
+    # Start engine
+    adapter = get_dialect(dialect)
+    db_spec = {"database": str(tmp_path.joinpath(f"bench.{dialect}"))}
+    engine_kwargs = adapter.engine_kwargs(db_spec)
+    engine_kwargs.update(adapter.pool_kwargs(db_spec, 8))
+    engine = create_engine(adapter.url(db_spec), **engine_kwargs)
+
+    # Generate leftmost table
+    if dialect == "duckdb":
+        sql = f"""
+        CREATE TABLE teams AS
+        SELECT 't' || CAST(range AS VARCHAR) AS team_id, range % 2 AS y
+        FROM range({n_rows})
+        """
+    else:
+        sql = f"""
+        CREATE TABLE teams AS
+        WITH RECURSIVE seq(n) AS (
+            SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n < {n_rows - 1}
+        )
+        SELECT 't' || n AS team_id, n % 2 AS y
+        FROM seq
+        """
+    run_query(engine, sql, return_df=False)
+
+    # Write query bank
+    query_dir = tmp_path.joinpath("bank")
+    write_bank(query_dir, dialect, n_queries)
+    domains = [f"domain{i}" for i in range(min(n_queries, 10))]
+
+    # Run phases
+    schema = "main"
+    staged_table, staged_tuple = stage_leftmost_table(
+        engine, schema, "teams", "team_id", "2020-01-01", "2020-12-31", dialect=adapter
+    )
+    query_dict = get_queries_from_domains(dialect, "team_id", domains, query_dir)
+    table_dict, query_tuples = template_queries(engine, schema, staged_table, query_dict, dialect=adapter)
+    results = multi_query(query_tuples) + [staged_tuple]
+    table_dict["leftMostTable"] = staged_table
+    table_df = collect_captured_metadata(results)
+    join_sql, final_table = prep_join_query(schema, table_df, "main.features", dialect=adapter)
+    column_types = prep_join_schema(table_df)
+    joined = n_queries <= MAX_JOIN.get(dialect, n_queries)
+    if joined:
+        run_query(engine, join_sql, return_df=False)
+
+    yield {
+        "engine": engine,
+        "adapter": adapter,
+        "schema": schema,
+        "query_dir": query_dir,
+        "domains": domains,
+        "staged_table": staged_table,
+        "query_dict": query_dict,
+        "results": results,
+        "table_list": list(table_dict.values()),
+        "table_df": table_df,
+        "final_table": final_table if joined else None,
+        "column_types": column_types,
+    }
+
+    # Clean up
+    drop_tables(engine, list(table_dict.values()), dialect=adapter)
+    engine.dispose()
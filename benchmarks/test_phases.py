@@ -0,0 +1,115 @@
+# Copyright 2022 CVS Health and/or one of its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from coldstart.parse import get_queries_from_domains
+from coldstart.query import (
+    run_query,
+    multi_query,
+    template_queries,
+    collect_captured_metadata,
+    collect_metadata,
+    prep_join_query,
+    drop_tables,
+    attempt_downcast,
+)
+
+
+def test_parsing(benchmark, warehouse):
+    
+    w = warehouse
+    
+    query_dict = benchmark(
+        get_queries_from_domains, w["adapter"].name, "team_id", w["domains"], w["query_dir"]
+    )
+    assert len(query_dict) == len(w["query_dict"])
+
+
+def test_templating(benchmark, warehouse):
+    
+    w = warehouse
+    
+    table_dict, query_tuples = benchmark(
+        template_queries, w["engine"], w["schema"], w["staged_table"], w["query_dict"], dialect=w["adapter"]
+    )
+    assert len(query_tuples) == len(w["query_dict"])
+
+
+def test_multi_query(benchmark, warehouse):
+    
+    w = warehouse
+    created = []
+    
+    def setup():
+        drop_tables(w["engine"], created, dialect=w["adapter"])
+        table_dict, query_tuples = template_queries(
+            w["engine"], w["schema"], w["staged_table"], w["query_dict"], dialect=w["adapter"]
+        )
+        created[:] = list(table_dict.values())
+        return (query_tuples,), {}
+    
+    results = benchmark.pedantic(multi_query, setup=setup, rounds=3, iterations=1)
+    drop_tables(w["engine"], created, dialect=w["adapter"])
+    assert all(r[1] == "SUCCESS" for r in results)
+
+
+def test_captured_metadata(benchmark, warehouse):
+    
+    table_df = benchmark(collect_captured_metadata, warehouse["results"])
+    assert len(table_df) == len(warehouse["table_df"])
+
+
+def test_collect_metadata(benchmark, warehouse):
+    
+    w = warehouse
+    
+    table_df = benchmark(collect_metadata, w["engine"], w["schema"], w["table_list"], dialect=w["adapter"])
+    assert len(table_df) == len(w["table_df"])
+
+
+def test_prep_join_query(benchmark, warehouse):
+    
+    w = warehouse
+    
+    join_sql, final_table = benchmark(
+        prep_join_query, w["schema"], w["table_df"], "main.features", dialect=w["adapter"]
+    )
+    assert final_table == "main.features"
+
+
+def test_fetch(benchmark, warehouse):
+    
+    w = warehouse
+    if w["final_table"] is None:
+        pytest.skip(f"{w['adapter'].name} cannot join this many tables; use --bench-dialect duckdb")
+    
+    df = benchmark(
+        run_query, w["engine"], f"SELECT * FROM {w['final_table']}", column_types=w["column_types"], dialect=w["adapter"]
+    )
+    assert len(df) > 0
+
+
+def test_attempt_downcast(benchmark, warehouse):
+    
+    w = warehouse
+    if w["final_table"] is None:
+        pytest.skip(f"{w['adapter'].name} cannot join this many tables; use --bench-dialect duckdb")
+    df = run_query(w["engine"], f"SELECT * FROM {w['final_table']}", column_types=w["column_types"])
+    
+    def setup():
+        return (df.copy(),), {"float_tolerance": 1e-6}
+    
+    result = benchmark.pedantic(attempt_downcast, setup=setup, rounds=3, iterations=1)
+    assert len(result) == len(df)
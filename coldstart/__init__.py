@@ -12,8 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from coldstart.build import FeatureFactory
-
 __all__ = [
     "FeatureFactory",
-]
\ No newline at end of file
+]
+
+
+def __getattr__(name):
+    # Import the public API on first access so `import coldstart` stays light
+    if name == "FeatureFactory":
+        from coldstart.build import FeatureFactory
+        return FeatureFactory
+    raise AttributeError(f"module 'coldstart' has no attribute '{name}'")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
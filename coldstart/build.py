@@ -12,12 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import sys
+import secrets
+import threading
 import warnings
-import pandas as pd
 from random import shuffle
-from tqdm.auto import tqdm
-from sqlalchemy import create_engine
+from functools import partial
+from contextlib import ExitStack
+from contextvars import copy_context
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from pathlib import Path
 
 from coldstart.parse import (
     list_dialects,
@@ -25,27 +31,113 @@ from coldstart.parse import (
     list_domains,
     list_queries,
     get_queries_from_domains,
-    get_queries
-)
-from coldstart.query import (
-    run_query,
-    multi_query,
-    stage_leftmost_table,
-    freeze_queries,
-    template_queries,
-    collect_metadata,
-    prep_join_query,
-    drop_tables,
-    attempt_downcast
+    get_queries,
+    resolve_features,
+    load_manifest
 )
+from coldstart.dialects import get_dialect
+from coldstart.trace import Tracer
+
+# pandas, NumPy, SQLAlchemy and tqdm are imported when an engine starts or
+# a dataframe is built, so listing the query bank stays fast
+
+
+class RunHandle(object):
+
+    """Handle of a run started by FeatureFactory.run_async
+
+    The run writes its results to its own FeatureFactory, which shares the
+    engine of the one that started it. The handle can be polled, waited on
+    from any thread with result, awaited in asyncio or cancelled.
+
+    Args:
+        factory (FeatureFactory): FeatureFactory of the run
+        control (RunControl): Timeouts and cancellation of the run
+    """
+
+    def __init__(self, factory, control):
+
+        self.factory = factory
+        self.control = control
+        self.future = Future()
+
+    def cancel(self):
+        """Cancels the run
+
+        A run not started yet never starts. A started run cancels its
+        running queries through the driver, skips the rest and raises
+        RunCancelled.
+
+        Returns:
+            bool: Whether the run was still pending or running
+        """
+        if self.future.cancel():
+            return True
+        if self.future.done():
+            return False
+        self.control.cancel()
+        return True
+
+    def done(self):
+        """Returns whether the run finished"""
+        return self.future.done()
+
+    def result(self, timeout=None):
+        """Waits for the run
+
+        Args:
+            timeout (float): Seconds to wait. If None, waits until the run
+                finishes. Defaults to None.
+
+        Raises:
+            TimeoutError: Error for runs not finished within timeout
+
+        Returns:
+            FeatureFactory: FeatureFactory of the run, e.g. for get_dataframe
+                and report. Errors raised by run are raised again.
+        """
+        return self.future.result(timeout=timeout)
+
+    def exception(self, timeout=None):
+        """Waits for the run and returns the error it raised, if any"""
+        return self.future.exception(timeout=timeout)
+
+    def progress(self):
+        """Returns the progress of the run
+
+        Returns:
+            dict: status (PENDING, RUNNING, CANCELLED, SUCCESS or FAILURE),
+                phase last completed and percent complete
+        """
+        progress = dict(getattr(self.factory, "progress", None) or {"phase": None, "percent": 0})
+        if self.future.cancelled():
+            status = "CANCELLED"
+        elif not self.future.done():
+            status = "RUNNING" if self.future.running() else "PENDING"
+        elif self.future.exception() is not None:
+            status = "FAILURE"
+        else:
+            status = self.factory.report()["status"]
+        return {"status": status, **progress}
+
+    def __await__(self):
+        import asyncio
+        return asyncio.wrap_future(self.future).__await__()
 
 
 class FeatureFactory(object):
     
-    """Coldstart's main class"""
+    """Coldstart's main class
+
+    Args:
+        tracer (Tracer): Receives spans for each phase of run and each
+            query. Accepts coldstart.trace tracers or an OpenTelemetry
+            tracer. If None, tracing is a no-op. Defaults to None.
+    """
     
-    def __init__(self):
+    def __init__(self, tracer=None):
         
+        self.tracer = tracer or Tracer()
         self.list_dialects = list_dialects
         self.list_entities = list_entities
         self.list_domains = list_domains
@@ -56,7 +148,19 @@ class FeatureFactory(object):
         """Starts SQLAlchemy engine
 
         Args:
-            db_spec (dict): Used as the config for create_engine
+            db_spec (dict): Used as the config for create_engine. The
+                dialect selects a dialect adapter (bigquery, sqlite, duckdb
+                or postgresql) that builds the URL from the remaining keys,
+                e.g. project_id for BigQuery, database for SQLite and
+                DuckDB, or host, port, user, password and database for
+                Postgres. A url key overrides URL building. With duckdb,
+                a sources key mapping table names to local Parquet/CSV
+                files lets queries run in-process against those files.
+                The connection pool is sized to max_workers (the number of
+                concurrent queries) unless pool_size, max_overflow,
+                pool_pre_ping or pool_recycle are given.
+                A prebuilt engine, e.g. Simulator().engine, can be passed
+                as engine.
 
         Raises:
             ValueError: Error for missing dialect
@@ -64,8 +168,12 @@ class FeatureFactory(object):
             ValueError: Error for missing project_id
             ValueError: Error for unsupported database
             ValueError: Error for failed engine creation
+            ValueError: Error for unsupported local sources
         """    
-        
+        import tempfile
+        from sqlalchemy import create_engine
+        from coldstart.query import default_workers
+
         # Primary value checks
         if "dialect" not in db_spec or db_spec["dialect"] is None:
             raise ValueError("dialect needs to be specified in the db_spec.")
@@ -86,18 +194,321 @@ class FeatureFactory(object):
         if "project_id" in db_spec:
             self.project_id = db_spec["project_id"]
         
+        # Back throwaway databases with a directory removed by stop_engine
+        self.adapter = get_dialect(self.dialect)
+        self.scratch_dir = None
+        if db_spec.get("engine") is None and self.adapter.scratch_database(db_spec):
+            self.scratch_dir = tempfile.mkdtemp(prefix="coldstart_")
+            db_spec = dict(db_spec, database=str(Path(self.scratch_dir).joinpath(f"coldstart.{self.dialect}")))
+        
         # Create url
-        # TODO: Add more databases
-        if self.dialect == "bigquery":
-            db_url = f"{self.dialect}:///?ProjectId='{self.project_id}'"
-        else:
-            raise ValueError("This database is not currently supported")
+        db_url = self.adapter.url(db_spec)
+        
+        # Size connection pool for the query workers
+        self.max_workers = db_spec.get("max_workers") or default_workers()
+        engine_kwargs = self.adapter.engine_kwargs(db_spec)
+        engine_kwargs.update(self.adapter.pool_kwargs(db_spec, self.max_workers))
         
         # Create engine
-        try:
-            self.engine = create_engine(db_url)
-        except:
-            raise ValueError("Engine not created. Check values in db_spec")
+        if db_spec.get("engine") is not None:
+            self.engine = db_spec["engine"]
+        else:
+            try:
+                self.engine = create_engine(db_url, **engine_kwargs)
+            except:
+                raise ValueError("Engine not created. Check values in db_spec")
+            self.adapter.configure_engine(self.engine)
+        
+        # Map source tables to local files
+        if db_spec.get("sources") is not None:
+            self.adapter.register_sources(self.engine, db_spec["sources"])
+
+
+    def collect_queries(
+        self,
+        entity_id=None,
+        domains=None,
+        queries=None,
+        features=None,
+        manifest=None,
+        query_dir=None,
+    ):
+        """Collects the feature queries a run would execute
+
+        Args:
+            entity_id (str): Entity of interest for feature queries.
+                Defaults to None.
+            domains (list): Domains of interest for feature queries.
+                Defaults to None.
+            queries (list): Queries of interest for feature queries.
+                Defaults to None.
+            features (list): Features of interest as fully qualified
+                `query_column` names or patterns. Defaults to None.
+            manifest (str): Frozen production manifest, or export_dir
+                containing one, supplying queries and features.
+                Defaults to None.
+            query_dir (str): Target directory containing feature queries.
+                If None, coldstart/query_bank is used. Defaults to None.
+
+        Raises:
+            ValueError: Error for missing domains, queries and features
+
+        Returns:
+            dict, list, str: Dictionary of queries to template, features of
+                interest as `query_column` patterns, query directory
+        """
+
+        # Load manifest
+        if manifest is not None:
+            manifest_dict = load_manifest(manifest)
+            if queries is None:
+                queries = manifest_dict.get("queries")
+            if features is None:
+                features = manifest_dict.get("features")
+            if query_dir is None:
+                query_dir = manifest if Path(manifest).is_dir() else Path(manifest).parent
+
+        # Check domains and queries
+        if domains is not None and queries is not None:
+            warnings.warn("domains will be ignored since queries were specified")
+        if domains is None and queries is None and features is None:
+            raise ValueError("domains, queries, features or manifest needs to be specified.")
+
+        # Collect queries needed for features
+        if features is not None:
+            candidates = queries
+            if candidates is None:
+                candidates = list_queries(
+                    dialect=self.dialect,
+                    entity_id=entity_id,
+                    domains=domains,
+                    query_dir=query_dir
+                )
+            resolved = resolve_features(features, candidates)
+            queries = list(resolved.keys())
+
+            # Qualify query patterns, e.g. teamGameStats, with their columns
+            features = [f"{q}_{c}" for q, columns in resolved.items() for c in columns]
+
+        # Collect queries to run
+        if queries is not None:
+            query_dict = get_queries(
+                dialect=self.dialect, 
+                entity_id=entity_id, 
+                queries=queries, 
+                query_dir=query_dir
+            )
+        else:
+            query_dict = get_queries_from_domains(
+                dialect=self.dialect,
+                entity_id=entity_id,
+                domains=domains,
+                query_dir=query_dir
+            )
+        return query_dict, features, query_dir
+
+
+    def plan(
+        self,
+        leftmost_table=None,
+        entity_id=None,
+        domains=None,
+        queries=None,
+        features=None,
+        manifest=None,
+        date_range=None,
+        query_dir=None,
+        max_workers=None,
+    ):
+        """Dry runs the queries a run would execute without creating tables
+
+        Each feature query is templated against the staging SELECT instead
+        of a staged table. BigQuery reports the bytes each query would
+        process; other engines only validate queries with EXPLAIN.
+
+        Args:
+            leftmost_table (str): Left-most table used for constraining
+                feature queries. Defaults to None.
+            entity_id (str): Entity of interest for feature queries.
+                Defaults to None.
+            domains (list): Domains of interest for feature queries.
+                Defaults to None.
+            queries (list): Queries of interest for feature queries.
+                Defaults to None.
+            features (list): Features of interest as fully qualified
+                `query_column` names or patterns. Defaults to None.
+            manifest (str): Frozen production manifest, or export_dir
+                containing one, supplying queries and features.
+                Defaults to None.
+            date_range (list): min_date and max_date used for constraining
+                feature queries. Defaults to None.
+            query_dir (str): Target directory containing feature queries.
+                If None, coldstart/query_bank is used. Defaults to None.
+            max_workers (int): Number of concurrent dry runs. If None, the
+                max_workers the engine's pool was sized for is used.
+                Defaults to None.
+
+        Raises:
+            ValueError: Error for missing engine
+
+        Returns:
+            DataFrame: query_name, query_status, bytes_processed and error
+                for the staging query and each feature query
+        """
+        import pandas as pd
+        from tqdm.contrib.concurrent import thread_map
+        from coldstart.query import prep_stage_sql
+
+        # Check for engine
+        if hasattr(self, "engine") == False:
+            raise ValueError("`start_engine` needs to be called before `plan`.")
+
+        # Template queries against the staging query
+        dt1, dt2 = date_range if date_range is not None else (None, None)
+        stage_sql = prep_stage_sql(leftmost_table, entity_id, dt1, dt2, dialect=self.adapter)
+        query_dict, _, _ = self.collect_queries(
+            entity_id=entity_id,
+            domains=domains,
+            queries=queries,
+            features=features,
+            manifest=manifest,
+            query_dir=query_dir
+        )
+        plans = [("leftMostTable", stage_sql)] + [
+            (k, v["SQL"].format(LEFTMOST_TABLE=f"({stage_sql})"))
+            for k, v in query_dict.items()
+        ]
+
+        # Dry run queries
+        def estimate(plan):
+            query_name, sql = plan
+            try:
+                with self.engine.connect() as connection:
+                    stats = self.adapter.dry_run(connection, sql)
+                return {"query_name": query_name, "query_status": "SUCCESS", **stats, "error": None}
+            except Exception as e:
+                return {"query_name": query_name, "query_status": "FAILURE", "error": str(e)}
+
+        rows = thread_map(
+            estimate,
+            plans,
+            max_workers=max_workers or self.max_workers,
+            miniters=1,
+            total=len(plans),
+            desc="Plan Progress"
+        )
+        cols = ["query_name", "query_status", "bytes_processed", "error"]
+        return pd.DataFrame(rows).reindex(columns=cols)
+
+
+    def lookup(
+        self,
+        entity_ids,
+        date_range,
+        entity_id=None,
+        features=None,
+        queries=None,
+        domains=None,
+        manifest=None,
+        query_dir=None,
+        max_workers=None,
+        stop_on_error=False,
+    ):
+        """Looks up features for a handful of entities without creating tables
+
+        The entity ids are inlined as values in place of a leftmost table,
+        each feature query runs as a plain SELECT in parallel and the small
+        results are joined in memory.
+
+        Args:
+            entity_ids (list): Entity ids to look up
+            date_range (list): min_date and max_date used for constraining
+                feature queries
+            entity_id (str): Entity of interest for feature queries.
+                Defaults to None.
+            features (list): Features of interest as fully qualified
+                `query_column` names or patterns. Defaults to None.
+            queries (list): Queries of interest for feature queries.
+                Defaults to None.
+            domains (list): Domains of interest for feature queries.
+                Defaults to None.
+            manifest (str): Frozen production manifest, or export_dir
+                containing one, supplying queries and features.
+                Defaults to None.
+            query_dir (str): Target directory containing feature queries.
+                If None, coldstart/query_bank is used. Defaults to None.
+            max_workers (int): Number of concurrent queries. If None, the
+                max_workers the engine's pool was sized for is used.
+                Defaults to None.
+            stop_on_error (bool): Will raise if any one query fails.
+                Otherwise its columns are left out. Defaults to False.
+
+        Raises:
+            ValueError: Error for missing engine
+            ValueError: Error for missing entity_ids
+            ValueError: Error for errored queries
+
+        Returns:
+            DataFrame: idx, entity_id, min_date, max_date and one column
+                per feature, one row per entity id
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from coldstart.query import run_query, prep_lookup_sql, match_features
+
+        # Check values
+        if hasattr(self, "engine") == False:
+            raise ValueError("`start_engine` needs to be called before `lookup`.")
+        if entity_ids is None or len(entity_ids) == 0:
+            raise ValueError("entity_ids cannot be empty.")
+
+        # Template queries against the inlined entity ids
+        stage_sql = prep_lookup_sql(
+            entity_id,
+            entity_ids,
+            date_range[0],
+            date_range[1],
+            dialect=self.adapter
+        )
+        query_dict, features, _ = self.collect_queries(
+            entity_id=entity_id,
+            domains=domains,
+            queries=queries,
+            features=features,
+            manifest=manifest,
+            query_dir=query_dir
+        )
+        plans = [("leftMostTable", stage_sql)] + [
+            (k, v["SQL"].format(LEFTMOST_TABLE=f"({stage_sql})"))
+            for k, v in query_dict.items()
+        ]
+
+        # Fetch queries
+        def fetch(plan):
+            query_name, sql = plan
+            try:
+                return run_query(engine=self.engine, sql=sql, return_df=True, dialect=self.adapter)
+            except Exception as e:
+                print(f'{query_name} FAILED: ', e)
+                return e
+
+        with ThreadPoolExecutor(max_workers=max_workers or self.max_workers) as executor:
+            frames = list(executor.map(fetch, plans))
+
+        # Check for failures
+        failed = [name for (name, _), df in zip(plans, frames) if isinstance(df, Exception)]
+        if isinstance(frames[0], Exception) or (stop_on_error is True and len(failed) > 0):
+            raise ValueError(f"One or many queries errord: {', '.join(failed)}.")
+
+        # Join features
+        df = frames[0].drop(columns=["y"]).set_index("idx")
+        for (query_name, _), feature_df in zip(plans[1:], frames[1:]):
+            if isinstance(feature_df, Exception):
+                continue
+            feature_df = feature_df.set_index("idx")
+            feature_df.columns = [f"{query_name}_{c}" for c in feature_df.columns]
+            keep = [c for c in feature_df.columns if match_features(c, features)]
+            df = df.join(feature_df[keep], how="left")
+        return df.reset_index()
 
 
     def run(
@@ -107,16 +518,35 @@ class FeatureFactory(object):
         entity_id=None,
         domains=None,
         queries=None,
+        features=None,
+        manifest=None,
         date_range=None,
         query_dir=None,
         export_dir=None,
         drop_intermedieate_tables=True,
+        table_ttl=None,
+        temp_tables=False,
         return_df=True,
         compute_df=True,
         stop_on_error=False,
         downcast=False,
+        float_tolerance=None,
         batching=False,
         batch_size=None,
+        max_workers=None,
+        n_partitions=None,
+        partition_by=None,
+        output_format=None,
+        output_dir=None,
+        export_intermediate=False,
+        incremental=False,
+        shared=None,
+        run_id=None,
+        state_dir=None,
+        limiter=None,
+        query_timeout=None,
+        timeout=None,
+        control=None,
     ):
         """Used for running FeatureFactory
 
@@ -131,6 +561,14 @@ class FeatureFactory(object):
                 Defaults to None.
             queries (list): Queries of interest for feature queries.
                 Defaults to None.
+            features (list): Features of interest as fully qualified
+                `query_column` names or patterns, e.g. `testQuery1_*`. Only
+                the queries needed for them are run and only matching
+                columns are joined. Defaults to None.
+            manifest (str): Frozen production manifest, or export_dir
+                containing one, supplying queries and features. If
+                query_dir is None, the manifest's directory is used.
+                Defaults to None.
             date_range (list): min_date and max_date used for constraining
                 feature queries. Defaults to None.
             query_dir (str): Target directory containing feature queries.
@@ -139,28 +577,162 @@ class FeatureFactory(object):
                 Defaults to None.
             drop_intermedieate_tables (bool): Used for removing intermediate
                 query results. Defaults to True.
+            table_ttl (int): Hours until intermediate tables expire
+                engine-side, so they are cleaned up even if the run does not
+                finish. Defaults to None.
+            temp_tables (bool): Used for creating the staged and intermediate
+                tables as session-scoped temporary tables on one shared
+                connection (or BigQuery session). They vanish when the run
+                ends, so the drop phase is skipped. Statements in a session
+                run one at a time. Defaults to False.
             return_df (bool): Used for returning a dataframe. Defaults to True.
             compute_df (bool): Used for computing a dataframe. If False,
-                a Dask dataframe will be returned as opposed to Pandas.
+                a lazy Dask dataframe will be returned as opposed to Pandas.
                 Defaults to True.
             stop_on_error (bool): Will halt FeatureFactory if any one query
-                fails. Defaults to False.
+                fails. Queries still running are cancelled and queries not
+                started yet are skipped as soon as one fails.
+                Defaults to False.
             downcast (bool): Will attempt dataframe dtype downcasting.
                 Defaults to False.
+            float_tolerance (float): Maximum relative error allowed when
+                downcasting floats to float32. If None, floats are not
+                downcasted. Defaults to None.
             batching (bool): Used for dividing feature queries into batches.
                 Defaults to False.
             batch_size (int): Corresponding batch size if batching is True.
                 Defaults to None.
+            max_workers (int): Number of concurrent queries. If None, the
+                max_workers the engine's pool was sized for is used.
+                Defaults to None.
+            n_partitions (int): Number of partitions for the Dask dataframe
+                if compute_df is False. If None, the number of CPUs is used.
+                Defaults to None.
+            partition_by (str): Either "hash" for splitting partitions on a
+                hash of idx or "range" for splitting on idx row ranges. If
+                None, "hash" is used where the dialect supports it and
+                "range" otherwise. Defaults to None.
+            output_format (str): If "parquet", the final table is written to
+                partitioned Parquet files under output_dir and read lazily by
+                get_dataframe. Defaults to None.
+            output_dir (str): Destination directory for Parquet files.
+                Defaults to None.
+            export_intermediate (bool): Used for also writing intermediate
+                query results to Parquet files. Defaults to False.
+            incremental (bool): If feature_table exists, only leftmost rows
+                whose idx is missing from it are staged and queried, and
+                their features are inserted into it. Feature columns it
+                lacks are added and are null for earlier rows; columns the
+                new rows lack are left null. The columns are added before
+                the rows are inserted and are not rolled back, so a failed
+                insert leaves feature_table with the new, empty columns.
+                Defaults to False.
+            shared (SharedQueries): Shared with concurrent runs, e.g. by
+                FeatureService. Identical staging and feature queries
+                execute once and their tables are reused, query workers are
+                limited across runs, and tables are dropped once no run
+                holds them. Defaults to None.
+            run_id (str): Identifies the run's manifest in state_dir. If a
+                manifest with this id exists, its staged table and the
+                tables of queries whose templated SQL is unchanged are
+                reused. If None, a new id is generated and stored as
+                run_id. Defaults to None.
+            state_dir (str): Directory the run manifest is written to as
+                run_id.json. It records the staged table and, per query,
+                the hash of its templated SQL, its table and its status,
+                so an interrupted or failed run can be continued with
+                resume. Intermediate tables of failed runs are kept.
+                Defaults to None.
+            limiter (Semaphore): Shared with overlapping runs, e.g. by
+                run_async, to limit their query workers together. Ignored
+                if shared is given. Defaults to None.
+            query_timeout (float): Seconds each feature query may run before
+                it is cancelled through the driver and fails.
+                Defaults to None.
+            timeout (float): Seconds the run may take. Once exceeded,
+                running feature queries are cancelled, queries not started
+                yet are skipped and TimeoutError is raised before the
+                merge. Defaults to None.
+            control (RunControl): Used for cancelling the run from another
+                thread, e.g. by RunHandle.cancel. Defaults to None.
 
         Raises:
             ValueError: Error for missing engine
+            ValueError: Error for invalid output_format
+            ValueError: Error for shared temporary tables
+            ValueError: Error for run manifests of temporary or shared tables
+            ValueError: Error for missing feature_table
+            ValueError: Error for missing output_dir
             ValueError: Error for errored queries
+            TimeoutError: Error for runs exceeding timeout
+            RunCancelled: Error for cancelled runs
         """        
-        
+        # Arguments recorded in the run manifest
+        run_kwargs = {
+            k: v for k, v in locals().items()
+            if k not in ["self", "shared", "run_id", "state_dir", "limiter", "control"]
+        }
+        import json
+        from tqdm.auto import tqdm
+        from coldstart.query import (
+            run_query,
+            multi_query,
+            stage_leftmost_table,
+            describe_table,
+            prep_append_queries,
+            freeze_queries,
+            template_queries,
+            collect_captured_metadata,
+            collect_metadata,
+            prep_join_query,
+            prep_join_schema,
+            lazy_dataframe,
+            drop_tables,
+            downcast_dataframe,
+            query_attributes,
+            results_frame,
+            sql_hash,
+            read_run_manifest,
+            write_run_manifest,
+            resume_queries,
+            RunControl,
+            SessionEngine
+        )
+        from coldstart.export import write_parquet
+
         # Check for engine
         if hasattr(self, "engine") == False:
             raise ValueError("`start_engine` needs to be called before `run`.")
         
+        # Check output format
+        if output_format not in [None, "parquet"]:
+            raise ValueError("output_format must be either None or 'parquet'.")
+        if output_format == "parquet" and output_dir is None:
+            raise ValueError("output_dir needs to be specified for parquet output.")
+        if shared is not None and temp_tables is True:
+            raise ValueError("temp_tables cannot be shared across runs.")
+        if incremental is True and feature_table is None:
+            raise ValueError("feature_table needs to be specified for incremental runs.")
+        if state_dir is not None and (temp_tables is True or shared is not None):
+            raise ValueError("Run manifests cannot be used with temp_tables or shared runs.")
+        if partition_by is None:
+            partition_by = "hash" if self.adapter.supports_hash_partitions is True else "range"
+        self.results_df, self.merge_error = None, None
+        control = control or RunControl()
+        control.start(query_timeout=query_timeout, timeout=timeout, fail_fast=stop_on_error)
+
+        # Load run manifest
+        self.run_id = run_id or f"{datetime.now():%Y%m%d%H%M%S}_{secrets.token_hex(4)}"
+        manifest_path, previous = None, None
+        if state_dir is not None:
+            manifest_path = Path(state_dir).joinpath(f"{self.run_id}.json")
+            previous = read_run_manifest(manifest_path)
+        run_manifest = {"run_id": self.run_id, "status": "RUNNING", "kwargs": run_kwargs, "queries": {}}
+        def save(**updates):
+            run_manifest.update(updates)
+            if manifest_path is not None:
+                write_run_manifest(manifest_path, run_manifest)
+        
         # Start progress bar
         # TODO: Check tqdm arguments
         pbar = tqdm(
@@ -171,138 +743,378 @@ class FeatureFactory(object):
             desc="Overall Progress"
         )
         pbar.update(10)
+        self.progress = {"phase": None, "percent": pbar.n}
+        def advance(n, phase):
+            pbar.update(n)
+            self.progress = {"phase": phase, "percent": pbar.n}
+            print(f"{phase}: Complete")
         
-        # Stage leftmost table
-        if date_range is not None:
-            dt1, dt2 = date_range[0], date_range[1]
-        else:
-            dt1, dt2 = None, None
-        staged_table, staged_tuple = stage_leftmost_table(
-            engine=self.engine,
-            schema=self.schema,
-            leftmost_table=leftmost_table,
-            entity_id=entity_id,
-            dt1=dt1,
-            dt2=dt2
-        )
-        pbar.update(10)
-        print("STAGING: Complete")
-        
-        # Check domains and queries
-        if domains is not None and queries is not None:
-            warnings.warn("domains will be ignored since queries were specified")
-        
-        # Collect queries to run
-        if queries is not None:
-            query_dict = get_queries(
-                db=self.dialect, 
-                entity_id=entity_id, 
-                queries=queries, 
-                query_dir=query_dir
-            )
-        elif domains is not None:
-            query_dict = get_queries_from_domains(
-                dialect=self.dialect,
-                entity_id=entity_id,
-                domains=domains,
-                query_dir=query_dir
-            )
-        pbar.update(10)
-        print("PARSING: Complete")
-        
-        # Freeze queries
-        if export_dir is not None:
-            freeze_queries(query_dir, export_dir, query_dict)
+        # Trace run
+        with self.tracer.start_as_current_span("coldstart.run") as run_span, ExitStack() as cleanup:
             
-        # TODO: Create switch for parquet external tables
-        
-        # Template queries
-        table_dict, query_tuples = template_queries(
-            engine=self.engine,
-            schema=self.schema,
-            staged_table=staged_table,
-            query_dict=query_dict,
-        )
-        pbar.update(10)
-        print("TEMPLATING: Complete")
-        
-        # Execute queries
-        if batching is True:
-            shuffle(query_tuples)
-            c = batch_size
-            t = len(query_tuples)
-            batches = [query_tuples[x:x+c] for x in range(0, t, c)]
-            temp_results = []
-            for batch in batches:
-                temp_results.append(multi_query(batch))
-            results = [item for sublist in temp_results for item in sublist]
-        else:
-            results = multi_query(query_tuples)
-        pbar.update(20)
-        print("QUERYING: Complete")
-        
-        # Append leftmost table info
-        results.append(staged_tuple)
-        table_dict["leftMostTable"] = staged_table
+            # Open session for temporary tables, closed however the run ends
+            if temp_tables is True:
+                engine = SessionEngine(self.engine, dialect=self.adapter)
+                cleanup.callback(engine.close)
+            else:
+                engine = self.engine
 
-        # Create query results dataframe
-        cols = ["query_name", "query_status", "query_seconds"]
-        results_df = pd.DataFrame(results, columns=cols)
-        results_df["table_name"] = results_df["query_name"].replace(table_dict)
-        print(results_df[cols])
+            # Release shared queries when the run ends
+            claimed = []
+            if shared is not None:
+                limiter = shared.limiter
+                def release():
+                    tables = shared.release(claimed)
+                    if drop_intermedieate_tables == True and len(tables) > 0:
+                        drop_tables(engine=self.engine, table_list=tables, dialect=self.adapter, limiter=limiter)
+                cleanup.callback(release)
 
-        # Check for failures
-        if stop_on_error is True:
-            dirty = results_df[results_df["query_status"] == "FAILURE"]
-            if len(dirty) > 0:
-                raise ValueError("One or many queries errord.")
-        clean = results_df[results_df["query_status"] == "SUCCESS"]
-
-        # Collect data types
-        clean_tables = clean["table_name"].unique().tolist()
-        table_df = collect_metadata(
-            engine=self.engine,
-            schema=self.schema,
-            table_list=clean_tables
-        )
-        pbar.update(10)
-        print("METADATA COLLECTING: Complete")
-        
-        # Prep join query
-        join_sql, final_table = prep_join_query(
-            schema=self.schema,
-            table_df=table_df, 
-            feature_table=feature_table
-        )
-        
-        # Execute query
-        try:
-            if return_df is True and compute_df is True:
-                df = run_query(engine=self.engine, sql=join_sql, return_df=True)
-                # Attempt downcasting
-                if downcast is True:
-                    df = attempt_downcast(df)
-                self.df = df
-            elif return_df is False:
-                run_query(engine=self.engine, sql=join_sql, return_df=True)
-            elif return_df is True and compute_df is False:
-                # TODO: Implement dask dataframe option
-                df = run_query(engine=self.engine, sql=join_sql, return_df=True)
-                self.df = df
-                warnings.warn("Dask dataframes not yet supported")
-        except Exception as e:
-            print(e)
-        
-        # Set final table name
-        self.table = final_table 
-        pbar.update(10)
-        print("MERGING: Complete")
-        
-        # Drop tables
-        if drop_intermedieate_tables == True:
-            drop_tables(engine=self.engine, table_list=clean_tables)
-        pbar.update(10)
-        print("DROPPING: Complete")
+            # Stage leftmost table
+            with self.tracer.start_as_current_span("coldstart.staging") as span:
+                if date_range is not None:
+                    dt1, dt2 = date_range[0], date_range[1]
+                else:
+                    dt1, dt2 = None, None
+
+                # Only stage rows missing from an existing feature table
+                feature_df = None
+                if incremental is True:
+                    feature_df = describe_table(
+                        engine=engine,
+                        schema=self.schema,
+                        table_name=feature_table,
+                        dialect=self.adapter
+                    )
+                exclude_table = None if feature_df is None else feature_table
+                stage = partial(
+                    stage_leftmost_table,
+                    engine=engine,
+                    schema=self.schema,
+                    leftmost_table=leftmost_table,
+                    entity_id=entity_id,
+                    dt1=dt1,
+                    dt2=dt2,
+                    table_ttl=table_ttl,
+                    temporary=temp_tables,
+                    dialect=self.adapter,
+                    exclude_table=exclude_table
+                )
+                # Reuse the staged table of an earlier attempt
+                stage_hash = sql_hash(json.dumps(
+                    [self.schema, leftmost_table, entity_id, dt1, dt2, exclude_table], default=str
+                ))
+                staged_df = None
+                if previous is not None and previous.get("stage_hash") == stage_hash and previous.get("staged_table") is not None:
+                    staged_df = describe_table(
+                        engine=engine,
+                        schema=self.schema,
+                        table_name=previous["staged_table"],
+                        dialect=self.adapter
+                    )
+                if staged_df is not None:
+                    staged_table = previous["staged_table"]
+                    columns = staged_df[["column_name", "data_type", "is_nullable"]].to_dict("records")
+                    staged_tuple = ("leftMostTable", "SUCCESS", 0, {"table_name": staged_table, "columns": columns, "resumed": True})
+                elif shared is None:
+                    staged_table, staged_tuple = stage()
+                else:
+                    stage_key = shared.key(self.schema, leftmost_table, entity_id, dt1, dt2, table_ttl, exclude_table)
+                    staged_tuple = shared.execute(stage_key, lambda: stage()[1], claimed)
+                    staged_table = staged_tuple[3].get("table_name")
+                span.set_attributes(query_attributes(staged_tuple))
+                save(
+                    stage_hash=stage_hash,
+                    staged_table=staged_table if staged_tuple[1] == "SUCCESS" else None
+                )
+
+                # Count new rows
+                new_rows = None
+                if feature_df is not None and staged_tuple[1] == "SUCCESS":
+                    count_sql = f"SELECT COUNT(*) AS n FROM {staged_table}"
+                    new_rows = int(run_query(engine=engine, sql=count_sql, return_df=True)["n"].iloc[0])
+                    span.set_attribute("coldstart.new_rows", new_rows)
+                    print(f"STAGING: {new_rows} new rows")
+                advance(10, "STAGING")
+            control.check()
+
+            # Collect queries to run
+            with self.tracer.start_as_current_span("coldstart.parsing") as span:
+                query_dict, features, query_dir = self.collect_queries(
+                    entity_id=entity_id,
+                    domains=domains,
+                    queries=queries,
+                    features=features,
+                    manifest=manifest,
+                    query_dir=query_dir
+                )
+                if new_rows == 0:
+                    query_dict = {}
+                span.set_attribute("coldstart.queries", len(query_dict))
+                advance(10, "PARSING")
+
+            # Freeze queries
+            with self.tracer.start_as_current_span("coldstart.templating") as span:
+                if export_dir is not None:
+                    freeze_queries(query_dir, export_dir, query_dict, features=features)
+
+                # Template queries
+                table_dict, query_tuples = template_queries(
+                    engine=engine,
+                    schema=self.schema,
+                    staged_table=staged_table,
+                    query_dict=query_dict,
+                    table_ttl=table_ttl,
+                    temporary=temp_tables,
+                    dialect=self.adapter
+                )
+
+                # Reuse queries of an earlier attempt
+                query_hashes = {
+                    k: sql_hash(v["SQL"].format(LEFTMOST_TABLE=staged_table))
+                    for k, v in query_dict.items()
+                }
+                reused = []
+                if previous is not None:
+                    query_tuples, reused = resume_queries(
+                        manifest=previous,
+                        query_tuples=query_tuples,
+                        query_hashes=query_hashes,
+                        engine=engine,
+                        schema=self.schema,
+                        dialect=self.adapter
+                    )
+                    table_dict.update({r[0]: r[3]["table_name"] for r in reused})
+                    span.set_attribute("coldstart.resumed", len(reused))
+                    print(f"TEMPLATING: {len(reused)} queries resumed")
+                save(queries={
+                    k: {"sql_hash": v, "table_name": table_dict[k], "status": "PENDING", "error": None}
+                    for k, v in query_hashes.items()
+                })
+                advance(10, "TEMPLATING")
+
+            # Check pool capacity
+            with self.tracer.start_as_current_span("coldstart.querying") as span:
+                max_workers = max_workers or self.max_workers
+                pool = getattr(self.engine, "pool", None)
+                if hasattr(pool, "size") and hasattr(pool, "_max_overflow"):
+                    if max_workers > pool.size() + max(pool._max_overflow, 0):
+                        warnings.warn("max_workers exceeds the connection pool; workers will wait on the pool")
+
+                # Execute queries
+                def execute(query_tuples):
+                    if batching is True:
+                        shuffle(query_tuples)
+                        c = batch_size
+                        t = len(query_tuples)
+                        batches = [query_tuples[x:x+c] for x in range(0, t, c)]
+                        temp_results = []
+                        for batch in batches:
+                            temp_results.append(multi_query(batch, max_workers=max_workers, tracer=self.tracer, limiter=limiter, control=control))
+                        return [item for sublist in temp_results for item in sublist]
+                    return multi_query(query_tuples, max_workers=max_workers, tracer=self.tracer, limiter=limiter, control=control)
+
+                # Reuse queries shared with concurrent runs
+                if shared is None:
+                    results = reused + execute(query_tuples)
+                else:
+                    keys = [
+                        shared.key(stage_key, query_dict[t[0]]["SQL"], table_ttl)
+                        for t in query_tuples
+                    ]
+                    results = shared.execute_many(keys, query_tuples, execute, claimed)
+                    table_dict.update({
+                        r[0]: r[3]["table_name"] for r in results if "table_name" in r[3]
+                    })
+                span.set_attributes({
+                    "coldstart.queries": len(results),
+                    "coldstart.failures": sum(r[1] == "FAILURE" for r in results),
+                    "coldstart.max_workers": max_workers,
+                })
+                save(queries={
+                    r[0]: {
+                        "sql_hash": query_hashes[r[0]],
+                        "table_name": table_dict[r[0]],
+                        "status": r[1],
+                        "error": r[3].get("error"),
+                    }
+                    for r in results
+                })
+                advance(20, "QUERYING")
+
+            # Clean up tables of cancelled queries
+            cancelled = [
+                table_dict[r[0]] for r in results
+                if r[3].get("cancelled") is True and r[3].get("skipped") is not True
+            ]
+            if len(cancelled) > 0:
+                drop_tables(engine=engine, table_list=cancelled, dialect=self.adapter, limiter=limiter)
+            if control.cancelled() and control.error is not None:
+                save(status="FAILURE")
+                control.check()
+
+            # Append leftmost table info
+            results.append(staged_tuple)
+            table_dict["leftMostTable"] = staged_table
+
+            # Create query results dataframe
+            cols = ["query_name", "query_status", "query_seconds"]
+            results_df = results_frame(results, table_dict)
+            self.results_df = results_df
+            print(results_df[cols])
+
+            # Check for failures
+            if stop_on_error is True:
+                dirty = results_df[results_df["query_status"] == "FAILURE"]
+                if len(dirty) > 0:
+                    save(status="FAILURE")
+                    raise ValueError("One or many queries errord.")
+            clean = results_df[results_df["query_status"] == "SUCCESS"]
+
+            # Collect data types
+            with self.tracer.start_as_current_span("coldstart.metadata") as span:
+                clean_tables = clean["table_name"].unique().tolist()
+                table_df = collect_captured_metadata(results)
+                if table_df is None:
+                    table_df = collect_metadata(
+                        engine=engine,
+                        schema=self.schema,
+                        table_list=clean_tables,
+                        dialect=self.adapter
+                    )
+                span.set_attribute("coldstart.columns", len(table_df))
+                advance(10, "METADATA COLLECTING")
+
+            # Prep join query
+            with self.tracer.start_as_current_span("coldstart.merge") as span:
+                join_sql, final_table = prep_join_query(
+                    schema=self.schema,
+                    table_df=table_df, 
+                    feature_table=feature_table if feature_df is None else None,
+                    features=features,
+                    dialect=self.adapter
+                )
+                self.column_types = prep_join_schema(table_df, features=features)
+
+                # Execute query
+                self.df, self.output_dir, self.merge_error = None, None, None
+                try:
+                    if self.adapter.supports_replace is False:
+                        drop_sql = self.adapter.drop_table_sql(final_table)
+                        run_query(engine=engine, sql=drop_sql, return_df=False)
+                    run_query(engine=engine, sql=join_sql, return_df=False)
+
+                    # Append new rows to the feature table
+                    if feature_df is not None:
+                        delta_df = describe_table(
+                            engine=engine,
+                            schema=self.schema,
+                            table_name=final_table,
+                            dialect=self.adapter
+                        )
+                        append_sqls = prep_append_queries(
+                            feature_table=feature_table,
+                            feature_df=feature_df,
+                            delta_table=final_table,
+                            delta_df=delta_df,
+                            dialect=self.adapter
+                        )
+                        for sql in append_sqls + [self.adapter.drop_table_sql(final_table)]:
+                            run_query(engine=engine, sql=sql, return_df=False)
+                        final_table = feature_table
+                    if output_format is None and return_df is True and compute_df is True:
+                        with self.tracer.start_as_current_span("coldstart.fetch") as fetch_span:
+                            df = run_query(
+                                engine=self.engine,
+                                sql=f"SELECT * FROM {final_table}",
+                                return_df=True,
+                                column_types=self.column_types,
+                                dialect=self.adapter
+                            )
+                            fetch_span.set_attributes({
+                                "coldstart.rows": len(df),
+                                "coldstart.bytes": int(df.memory_usage(deep=True).sum()),
+                            })
+                        # Attempt downcasting
+                        if downcast is True:
+                            with self.tracer.start_as_current_span("coldstart.downcast") as downcast_span:
+                                df, self.downcast_report = downcast_dataframe(
+                                    df,
+                                    float_tolerance=float_tolerance
+                                )
+                                a = self.downcast_report["bytes_before"].sum()
+                                b = self.downcast_report["bytes_after"].sum()
+                                downcast_span.set_attributes({
+                                    "coldstart.bytes_before": int(a),
+                                    "coldstart.bytes_after": int(b),
+                                })
+                            if a > 0:
+                                print(f"DataFrame memory reduction: {round((a - b) / a * 100, 2)}%")
+                        self.df = df
+                    elif output_format is None and return_df is True and compute_df is False:
+                        self.df = lazy_dataframe(
+                            engine=self.engine,
+                            table=final_table,
+                            n_partitions=n_partitions or os.cpu_count() or 1,
+                            partition_by=partition_by,
+                            column_types=self.column_types,
+                            dialect=self.adapter
+                        )
+                except Exception as e:
+                    self.merge_error = e
+                    span.record_exception(e)
+                    print(e)
+
+                # Set final table name
+                self.table = final_table 
+                span.set_attributes({
+                    "coldstart.table_name": final_table,
+                    "coldstart.columns": len(self.column_types),
+                })
+                advance(10, "MERGING")
+
+            # Export to parquet
+            if output_format == "parquet":
+                with self.tracer.start_as_current_span("coldstart.export") as span:
+                    n = n_partitions or os.cpu_count() or 1
+                    paths = []
+                    if export_intermediate is True:
+                        for _, row in clean.iterrows():
+                            paths += write_parquet(
+                                engine=engine,
+                                table=row["table_name"],
+                                output_dir=Path(output_dir).joinpath("intermediate", row["query_name"]),
+                                n_partitions=n,
+                                partition_by=partition_by,
+                                dialect=self.adapter
+                            )
+                    paths += write_parquet(
+                        engine=self.engine,
+                        table=final_table,
+                        output_dir=Path(output_dir).joinpath("final"),
+                        n_partitions=n,
+                        partition_by=partition_by,
+                        column_types=self.column_types,
+                        dialect=self.adapter
+                    )
+                    span.set_attributes({
+                        "coldstart.files": len(paths),
+                        "coldstart.bytes": sum(Path(p).stat().st_size for p in paths),
+                    })
+                    self.output_dir = output_dir
+                    print("EXPORTING: Complete")
+
+            # Drop tables
+            failed = self.merge_error is not None or (results_df["query_status"] == "FAILURE").any()
+            save(status="FAILURE" if failed else "SUCCESS", feature_table=final_table)
+            with self.tracer.start_as_current_span("coldstart.drop") as span:
+                if temp_tables is True or shared is not None:
+                    cleanup.close()
+                elif manifest_path is not None and failed:
+                    print("DROPPING: Skipped so the run can be resumed")
+                elif drop_intermedieate_tables == True:
+                    drop_tables(engine=self.engine, table_list=clean_tables, dialect=self.adapter, limiter=limiter)
+                    span.set_attribute("coldstart.tables", len(clean_tables))
+                advance(10, "DROPPING")
         
         # Print for testing
         # print("~~~~~~~~~~~~~~~~~~~~~~~~STAGING~~~~~~~~~~~~~~~~~~~~~~~~")
@@ -318,14 +1130,242 @@ class FeatureFactory(object):
         # print("~~~~~~~~~~~~~~~~~~~~~~~~MERGING~~~~~~~~~~~~~~~~~~~~~~~~")
         # print(join_sql, final_table)
 
+    def resume(self, run_id, state_dir, **kwargs):
+        """For continuing a run from its manifest
+
+        The run is repeated with the arguments recorded in its manifest.
+        The staged table and the tables of queries that succeeded or were
+        still pending are reused if they still exist and their templated
+        SQL is unchanged, so only missing and failed queries are executed
+        before metadata collection, merging and dropping continue as usual.
+
+        Args:
+            run_id (str): Id of the run, as stored in run_id by run
+            state_dir (str): Directory the run manifest was written to
+            **kwargs: Arguments for run overriding the recorded ones
+
+        Raises:
+            ValueError: Error for missing manifest
+        """
+        from coldstart.query import read_run_manifest
+
+        manifest = read_run_manifest(Path(state_dir).joinpath(f"{run_id}.json"))
+        if manifest is None:
+            raise ValueError(f"No manifest was found for run {run_id}.")
+        run_kwargs = dict(manifest["kwargs"], **kwargs)
+        self.run(run_id=run_id, state_dir=state_dir, **run_kwargs)
+
+    def run_async(self, **kwargs):
+        """For running FeatureFactory without blocking
+
+        The run executes on its own thread with its own FeatureFactory, so
+        several runs, e.g. for different entities or date ranges, can
+        overlap on one engine. Overlapping runs share one limit of
+        max_workers query workers, matching the connection pool. Runs can
+        be cancelled with RunHandle.cancel.
+
+        Args:
+            **kwargs: Arguments for run
+
+        Raises:
+            ValueError: Error for missing engine
+
+        Returns:
+            RunHandle: Handle that can be polled, waited on or awaited
+        """
+
+        # Check for engine
+        if hasattr(self, "engine") == False:
+            raise ValueError("`start_engine` needs to be called before `run_async`.")
+
+        from coldstart.query import RunControl
+
+        # Share the engine and query workers
+        ff = FeatureFactory(tracer=self.tracer)
+        for key in ["dialect", "schema", "driver", "config", "project_id", "adapter", "max_workers", "engine"]:
+            if hasattr(self, key):
+                setattr(ff, key, getattr(self, key))
+        if getattr(self, "limiter", None) is None:
+            self.limiter = threading.BoundedSemaphore(self.max_workers)
+        kwargs.setdefault("limiter", self.limiter)
+
+        # Start run
+        handle = RunHandle(ff, RunControl())
+        kwargs["control"] = handle.control
+        def work():
+            if not handle.future.set_running_or_notify_cancel():
+                return
+            try:
+                ff.run(**kwargs)
+            except BaseException as e:
+                handle.future.set_exception(e)
+            else:
+                handle.future.set_result(ff)
+        context = copy_context()
+        threading.Thread(target=context.run, args=(work,), name="coldstart-run", daemon=True).start()
+        return handle
+
+    def report(self, error=None):
+        """For summarizing the last run as JSON-serializable data
+
+        Args:
+            error (Exception): Error raised by run. Defaults to None.
+
+        Returns:
+            dict: status, error, run_id, feature_table, output_dir and
+                queries from results_df
+        """
+        import json
+        
+        results_df = getattr(self, "results_df", None)
+        if error is None:
+            error = getattr(self, "merge_error", None)
+        failed = error is not None or (
+            results_df is not None and (results_df["query_status"] == "FAILURE").any()
+        )
+        return {
+            "status": "FAILURE" if failed else "SUCCESS",
+            "error": None if error is None else str(error),
+            "run_id": getattr(self, "run_id", None),
+            "feature_table": getattr(self, "table", None),
+            "output_dir": getattr(self, "output_dir", None),
+            "queries": [] if results_df is None else json.loads(results_df.to_json(orient="records")),
+        }
+
+    def expensive_queries(self, n=10, by="bytes_billed"):
+        """For listing the most expensive queries of the last run
+
+        Args:
+            n (int): Number of queries. Defaults to 10.
+            by (str): One of bytes_processed, bytes_billed, cpu_ms,
+                rows_written or query_seconds. If no query reports it,
+                queries are ranked by query_seconds. Defaults to
+                "bytes_billed".
+
+        Raises:
+            ValueError: Error for missing run
+
+        Returns:
+            DataFrame: Top n queries, most expensive first
+        """
+        from coldstart.query import most_expensive
+        
+        if getattr(self, "results_df", None) is None:
+            raise ValueError("`run` needs to be called before `expensive_queries`.")
+        return most_expensive(self.results_df, n=n, by=by)
+
+    def load(self, output_dir):
+        """For loading features previously exported to Parquet files
+
+        Args:
+            output_dir (str): Directory used as output_dir in run
+        """
+        self.df = None
+        self.output_dir = output_dir
+
     def get_dataframe(self):
         """For returning a dataframe object
 
+        If features were exported to Parquet files, they are read from the
+        local, memory-mapped files on first access.
+
         Returns:
             DataFrame: Training data
         """        
+        from coldstart.export import read_parquet
+        
+        if getattr(self, "df", None) is None and getattr(self, "output_dir", None) is not None:
+            self.df = read_parquet(Path(self.output_dir).joinpath("final"))
         return self.df
 
+    def write_index(self, path):
+        """For writing the features of the last run to a memory-mapped index
+
+        The index can be opened with coldstart.index.FeatureIndex for
+        single and batched idx lookups without loading the features.
+
+        Args:
+            path (str): Destination file
+
+        Raises:
+            ValueError: Error for missing features
+
+        Returns:
+            Path: Written file
+        """
+        from coldstart.index import write_index
+        
+        if getattr(self, "df", None) is None and getattr(self, "output_dir", None) is None:
+            raise ValueError("`run` or `load` needs to be called before `write_index`.")
+        df = self.get_dataframe()
+        if hasattr(df, "compute"):
+            df = df.compute()
+        return write_index(df, path)
+
+    def iter_batches(
+        self,
+        batch_rows,
+        columns=None,
+        shuffle_seed=None,
+        as_numpy=False,
+    ):
+        """For streaming the final feature table in fixed-size chunks
+
+        Chunks are read from the Parquet export if one exists and from the
+        feature table otherwise. The next chunk is prefetched on a
+        background thread while the current one is being consumed.
+
+        Args:
+            batch_rows (int): Number of rows per chunk
+            columns (list): Columns to read. If None, all columns are read.
+                Defaults to None.
+            shuffle_seed (int): Seed used for shuffling rows. If None, rows
+                are read in stored order. Defaults to None.
+            as_numpy (bool): Used for returning NumPy arrays as opposed to
+                dataframes. Defaults to False.
+
+        Raises:
+            ValueError: Error for invalid batch_rows
+            ValueError: Error for missing feature table
+
+        Returns:
+            generator: DataFrame or NumPy chunks of batch_rows rows
+        """
+        from coldstart.query import iter_query, prefetch
+        from coldstart.export import iter_parquet_batches
+
+        # Check values
+        if batch_rows is None or batch_rows < 1:
+            raise ValueError("batch_rows must be a positive integer.")
+
+        # Read from local export
+        if getattr(self, "output_dir", None) is not None:
+            batches = iter_parquet_batches(
+                path=Path(self.output_dir).joinpath("final"),
+                batch_rows=batch_rows,
+                columns=columns,
+                shuffle_seed=shuffle_seed
+            )
+
+        # Read from warehouse
+        elif getattr(self, "table", None) is not None:
+            select_sql = "*" if columns is None else ", ".join(columns)
+            sql = f"SELECT {select_sql} FROM {self.table}"
+            if shuffle_seed is not None:
+                sql += f" ORDER BY {self.adapter.shuffle_order_sql('idx', shuffle_seed)}"
+            batches = iter_query(
+                engine=self.engine,
+                sql=sql,
+                batch_rows=batch_rows,
+                column_types=getattr(self, "column_types", None)
+            )
+        else:
+            raise ValueError("`run` or `load` needs to be called before `iter_batches`.")
+
+        if as_numpy is True:
+            batches = (df.to_numpy() for df in batches)
+        return prefetch(batches)
+
     def get_table(self):
         """For returning final feature table name
 
@@ -334,6 +1374,45 @@ class FeatureFactory(object):
         """        
         return self.table
     
+    def sweep(self, older_than_hours=24, batch_size=100, dry_run=False):
+        """For dropping orphaned coldstart tables left behind by failed runs
+
+        Args:
+            older_than_hours (float): Minimum table age in hours.
+                Defaults to 24.
+            batch_size (int): Number of tables dropped per batch.
+                Defaults to 100.
+            dry_run (bool): Used for listing tables without dropping them.
+                Defaults to False.
+
+        Raises:
+            ValueError: Error for missing engine
+
+        Returns:
+            DataFrame: Swept tables with query_status and query_seconds
+        """
+        import pandas as pd
+        from coldstart.query import sweep_tables
+        
+        if hasattr(self, "engine") == False:
+            raise ValueError("`start_engine` needs to be called before `sweep`.")
+        results = sweep_tables(
+            engine=self.engine,
+            schema=self.schema,
+            older_than=timedelta(hours=older_than_hours),
+            batch_size=batch_size,
+            dry_run=dry_run,
+            dialect=self.adapter
+        )
+        cols = ["table_name", "query_status", "query_seconds"]
+        return pd.DataFrame([r[:3] for r in results], columns=cols)
+
     def stop_engine(self):
-        """Stops SQLAlchemy engine"""        
-        self.engine.dispose()
+        """Stops SQLAlchemy engine and removes its throwaway database"""        
+        import shutil
+        
+        if hasattr(self, "engine"):
+            self.engine.dispose()
+        if getattr(self, "scratch_dir", None) is not None:
+            shutil.rmtree(self.scratch_dir, ignore_errors=True)
+            self.scratch_dir = None
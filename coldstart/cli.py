@@ -0,0 +1,393 @@
+# Copyright 2022 CVS Health and/or one of its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import json
+import time
+import argparse
+from contextlib import redirect_stdout
+from pathlib import Path
+
+from coldstart.parse import index_queries, resolve_features
+
+
+def default_cache_path():
+    """Returns the file the query catalog is cached in
+
+    Returns:
+        Path: catalog.json under COLDSTART_CACHE_DIR, or ~/.cache/coldstart
+    """
+    cache_dir = os.environ.get("COLDSTART_CACHE_DIR")
+    if cache_dir is None:
+        cache_dir = Path.home().joinpath(".cache", "coldstart")
+    return Path(cache_dir).joinpath("catalog.json")
+
+
+def load_spec(path):
+    """Loads a run spec from a JSON or YAML file
+
+    A spec holds a db_spec for start_engine and a run dictionary of
+    keyword arguments for run, e.g. leftmost_table, entity_id and domains.
+
+    Args:
+        path (str): .json, .yaml or .yml file
+
+    Raises:
+        ValueError: Error for missing PyYAML
+        ValueError: Error for missing db_spec
+
+    Returns:
+        dict: Spec
+    """
+    text = Path(path).read_text()
+    if Path(path).suffix in [".yaml", ".yml"]:
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("PyYAML is required for YAML specs. Use a JSON spec or pip install coldstart[yaml].")
+        spec = yaml.safe_load(text)
+    else:
+        spec = json.loads(text)
+    if not isinstance(spec, dict) or "db_spec" not in spec:
+        raise ValueError("The spec needs to include a db_spec.")
+    spec.setdefault("run", {})
+    return spec
+
+
+def shard_queries(ff, run_kwargs, shards, shard_index):
+    """Narrows run arguments to the queries of one shard
+
+    Queries are sorted by name and dealt round-robin across shards, so every
+    shard of the same spec agrees on the split.
+
+    Args:
+        ff (FeatureFactory): FeatureFactory with a started engine
+        run_kwargs (dict): Arguments for run
+        shards (int): Number of shards
+        shard_index (int): Shard to keep, from 0 to shards - 1
+
+    Raises:
+        ValueError: Error for invalid shard_index
+
+    Returns:
+        dict: Arguments for run limited to the shard's queries
+    """
+    if shard_index < 0 or shard_index >= shards:
+        raise ValueError("shard_index must be between 0 and shards - 1.")
+    query_dict, features, query_dir = ff.collect_queries(
+        entity_id=run_kwargs.get("entity_id"),
+        domains=run_kwargs.get("domains"),
+        queries=run_kwargs.get("queries"),
+        features=run_kwargs.get("features"),
+        manifest=run_kwargs.get("manifest"),
+        query_dir=run_kwargs.get("query_dir")
+    )
+    queries = sorted(query_dict.keys())[shard_index::shards]
+
+    # Keep features produced by the shard's queries
+    if features is not None:
+        shard_features = []
+        for feature in features:
+            try:
+                resolve_features([feature], queries)
+                shard_features.append(feature)
+            except ValueError:
+                pass
+        features = shard_features
+
+    # Write each shard to its own table and directory
+    run_kwargs = dict(run_kwargs, queries=queries, features=features, query_dir=query_dir)
+    run_kwargs.pop("domains", None)
+    run_kwargs.pop("manifest", None)
+    if run_kwargs.get("feature_table") is not None:
+        run_kwargs["feature_table"] = f"{run_kwargs['feature_table']}_shard{shard_index}"
+    if run_kwargs.get("output_dir") is not None:
+        run_kwargs["output_dir"] = str(Path(run_kwargs["output_dir"]).joinpath(f"shard-{shard_index:05d}"))
+    return run_kwargs
+
+
+def add_engine_arguments(parser):
+    """Adds db_spec arguments to a subcommand
+
+    Args:
+        parser (ArgumentParser): Subcommand parser
+    """
+    parser.add_argument("--spec", default=None, help="JSON or YAML spec whose db_spec is used")
+    parser.add_argument("--dialect", default=None, help="Database dialect, e.g. bigquery. Overrides the spec")
+    parser.add_argument("--schema", default=None, help="Schema/dataset holding coldstart tables. Overrides the spec")
+    parser.add_argument("--project-id", default=None, help="Project if using BigQuery. Overrides the spec")
+
+
+def engine_spec(args):
+    """Builds the db_spec of a subcommand using add_engine_arguments
+
+    Args:
+        args (Namespace): Parsed arguments
+
+    Returns:
+        dict: db_spec of --spec, if given, overridden by --dialect, --schema
+            and --project-id
+    """
+    db_spec = {} if args.spec is None else dict(load_spec(args.spec)["db_spec"])
+    for key in ["dialect", "schema", "project_id"]:
+        if getattr(args, key) is not None:
+            db_spec[key] = getattr(args, key)
+    return db_spec
+
+
+def build_parser():
+    """Builds the coldstart argument parser
+
+    Returns:
+        ArgumentParser: Parser with one subparser per command
+    """
+    parser = argparse.ArgumentParser(
+        prog="coldstart",
+        description="Automatic data curation and feature engineering"
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    # Catalog command
+    catalog = subparsers.add_parser("catalog", help="List queries in the query bank")
+    catalog.add_argument("--query-dir", default=None, help="Directory containing feature queries")
+    catalog.add_argument("--dialect", default=None, help="Only list queries for this dialect")
+    catalog.add_argument("--entity", default=None, help="Only list queries for this entity")
+    catalog.add_argument("--domain", action="append", default=None, help="Only list queries in this domain")
+    catalog.add_argument("--no-cache", action="store_true", help="Do not read or write the cached catalog")
+
+    # Plan command
+    plan = subparsers.add_parser("plan", help="Dry run a spec and estimate its cost")
+    plan.add_argument("spec", help="JSON or YAML run spec")
+    plan.add_argument("--max-workers", type=int, default=None, help="Number of concurrent dry runs")
+
+    # Serve command
+    serve = subparsers.add_parser("serve", help="Serve runs over HTTP with a shared engine")
+    serve.add_argument("spec", help="JSON or YAML spec with the db_spec to serve")
+    serve.add_argument("--host", default="127.0.0.1", help="Host to bind")
+    serve.add_argument("--port", type=int, default=8000, help="Port to bind")
+    serve.add_argument("--max-concurrency", type=int, default=None, help="Number of query workers across all runs")
+    serve.add_argument("--query-dir", default=None, help="Directory containing feature queries")
+
+    # Run command
+    run = subparsers.add_parser("run", help="Build features from a spec")
+    run.add_argument("spec", help="JSON or YAML run spec")
+    run.add_argument("--max-workers", type=int, default=None, help="Number of concurrent queries")
+    run.add_argument("--shards", type=int, default=1, help="Number of shards the queries are split into")
+    run.add_argument("--shard-index", type=int, default=0, help="Shard to run, from 0 to shards - 1")
+    run.add_argument("--feature-table", default=None, help="Destination for final table")
+    run.add_argument("--output-format", default=None, choices=["parquet"], help="Export format")
+    run.add_argument("--output-dir", default=None, help="Destination directory for exported files")
+    run.add_argument("--query-timeout", type=float, default=None, help="Seconds each query may run")
+    run.add_argument("--timeout", type=float, default=None, help="Seconds the run may take")
+    run.add_argument("--state-dir", default=None, help="Directory run manifests are written to")
+    run.add_argument("--run-id", default=None, help="Run to continue from its manifest in --state-dir")
+    run.add_argument("--report", default=None, help="Also write the JSON report to this file")
+
+    # Sweep command
+    sweep = subparsers.add_parser("sweep", help="Drop orphaned coldstart tables")
+    add_engine_arguments(sweep)
+    sweep.add_argument("--older-than-hours", type=float, default=24, help="Minimum table age in hours")
+    sweep.add_argument("--batch-size", type=int, default=100, help="Number of tables dropped per batch")
+    sweep.add_argument("--dry-run", action="store_true", help="List tables without dropping them")
+
+    return parser
+
+
+def run_sweep(args):
+    """Runs the sweep command
+
+    Args:
+        args (Namespace): Parsed arguments
+
+    Returns:
+        int: Exit code
+    """
+    from coldstart.build import FeatureFactory
+
+    ff = FeatureFactory()
+    ff.start_engine(engine_spec(args))
+    try:
+        swept_df = ff.sweep(
+            older_than_hours=args.older_than_hours,
+            batch_size=args.batch_size,
+            dry_run=args.dry_run
+        )
+    finally:
+        ff.stop_engine()
+    print(json.dumps(swept_df.to_dict(orient="records"), indent=4))
+    return int((swept_df["query_status"] == "FAILURE").any())
+
+
+def run_catalog(args):
+    """Runs the catalog command
+
+    Args:
+        args (Namespace): Parsed arguments
+
+    Returns:
+        int: Exit code
+    """
+    cache_path = None if args.no_cache else default_cache_path()
+    records = []
+    for entry in index_queries(query_dir=args.query_dir, cache_path=cache_path):
+        if args.dialect is not None and entry["dialect"] != args.dialect:
+            continue
+        if args.entity is not None and entry["entity"] != args.entity:
+            continue
+        if args.domain is not None and entry["domain"] not in args.domain:
+            continue
+        records.append({k: entry[k] for k in ["query_name", "dialect", "entity", "domain", "path"]})
+    print(json.dumps(records, indent=4))
+    return 0
+
+
+def run_plan(args):
+    """Runs the plan command
+
+    Args:
+        args (Namespace): Parsed arguments
+
+    Returns:
+        int: Exit code
+    """
+    from coldstart.build import FeatureFactory
+
+    spec = load_spec(args.spec)
+    plan_keys = [
+        "leftmost_table", "entity_id", "domains", "queries", "features",
+        "manifest", "date_range", "query_dir",
+    ]
+    plan_kwargs = {k: v for k, v in spec["run"].items() if k in plan_keys}
+
+    ff = FeatureFactory()
+    ff.start_engine(spec["db_spec"])
+    try:
+        with redirect_stdout(sys.stderr):
+            plan_df = ff.plan(max_workers=args.max_workers, **plan_kwargs)
+    finally:
+        ff.stop_engine()
+    failures = int((plan_df["query_status"] == "FAILURE").sum())
+    estimated = plan_df["bytes_processed"].dropna()
+    report = {
+        "status": "FAILURE" if failures > 0 else "SUCCESS",
+        "failures": failures,
+        "bytes_processed": int(estimated.sum()) if len(estimated) > 0 else None,
+        "queries": json.loads(plan_df.to_json(orient="records")),
+    }
+    print(json.dumps(report, indent=4))
+    return int(failures > 0)
+
+
+def run_run(args):
+    """Runs the run command
+
+    Progress is written to stderr and a JSON report to stdout. The exit code
+    is 1 if the spec or engine could not be loaded, or if any query or the
+    merge failed.
+
+    Args:
+        args (Namespace): Parsed arguments
+
+    Returns:
+        int: Exit code
+    """
+    from coldstart.build import FeatureFactory
+
+    # Run shard
+    report = {"shard": args.shard_index, "shards": args.shards}
+    time_start = time.perf_counter()
+    error = None
+    ff = FeatureFactory()
+    try:
+        with redirect_stdout(sys.stderr):
+            # Apply overrides
+            spec = load_spec(args.spec)
+            run_kwargs = dict(spec["run"])
+            for key in ["max_workers", "feature_table", "output_format", "output_dir", "state_dir", "run_id", "query_timeout", "timeout"]:
+                if getattr(args, key) is not None:
+                    run_kwargs[key] = getattr(args, key)
+            run_kwargs.setdefault("return_df", False)
+
+            ff.start_engine(spec["db_spec"])
+            if args.shards > 1:
+                run_kwargs = shard_queries(ff, run_kwargs, args.shards, args.shard_index)
+            if args.shards == 1 or len(run_kwargs["queries"]) > 0:
+                ff.run(**run_kwargs)
+    except Exception as e:
+        error = e
+    finally:
+        ff.stop_engine()
+
+    # Report results
+    report.update(ff.report(error=error))
+    report["seconds"] = round(time.perf_counter() - time_start, 3)
+    output = json.dumps(report, indent=4)
+    if args.report is not None:
+        Path(args.report).write_text(output)
+    print(output)
+    return int(report["status"] == "FAILURE")
+
+
+def run_serve(args):
+    """Runs the serve command until interrupted
+
+    Args:
+        args (Namespace): Parsed arguments
+
+    Returns:
+        int: Exit code
+    """
+    from coldstart.service import FeatureService, make_server
+
+    spec = load_spec(args.spec)
+    query_dir = args.query_dir or spec["run"].get("query_dir")
+    service = FeatureService(spec["db_spec"], max_concurrency=args.max_concurrency, query_dir=query_dir)
+    server = make_server(service, host=args.host, port=args.port)
+    print(f"Serving on http://{args.host}:{server.server_address[1]}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+    return 0
+
+
+def main(argv=None):
+    """Entry point for the coldstart command
+
+    Args:
+        argv (list): Arguments. If None, sys.argv is used. Defaults to None.
+
+    Returns:
+        int: Exit code
+    """
+    args = build_parser().parse_args(argv)
+    if args.command == "catalog":
+        return run_catalog(args)
+    if args.command == "plan":
+        return run_plan(args)
+    if args.command == "run":
+        return run_run(args)
+    if args.command == "serve":
+        return run_serve(args)
+    if args.command == "sweep":
+        return run_sweep(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
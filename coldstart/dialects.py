@@ -0,0 +1,736 @@
+# Copyright 2022 CVS Health and/or one of its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import json
+import warnings
+from pathlib import Path
+
+
+class Dialect(object):
+
+    """Base dialect adapter
+
+    Owns everything coldstart needs to know about a database: URL
+    building, idx construction, DDL, metadata lookup and drops. Subclasses
+    override the pieces that differ from ANSI SQL.
+    """
+
+    name = None
+    string_type = "VARCHAR"
+    supports_replace = True
+    supports_ttl = False
+    supports_hash_partitions = False
+
+    def url(self, db_spec):
+        """Builds the SQLAlchemy URL
+
+        Args:
+            db_spec (dict): Used as the config for create_engine
+
+        Returns:
+            str: SQLAlchemy URL
+        """
+        if db_spec.get("url") is not None:
+            return db_spec["url"]
+        database = db_spec.get("database") or ""
+        return f"{self.name}:///{database}"
+
+    def engine_kwargs(self, db_spec):
+        """Builds extra create_engine arguments
+
+        Args:
+            db_spec (dict): Used as the config for create_engine
+
+        Returns:
+            dict: Keyword arguments for create_engine
+        """
+        return {}
+
+    def pool_kwargs(self, db_spec, max_workers):
+        """Builds connection pool arguments for create_engine
+
+        The pool is sized so every query worker holds its own connection.
+        pool_size, max_overflow, pool_pre_ping and pool_recycle in db_spec
+        take precedence.
+
+        Args:
+            db_spec (dict): Used as the config for create_engine
+            max_workers (int): Number of query workers
+
+        Returns:
+            dict: Keyword arguments for create_engine
+        """
+        return {
+            "pool_size": db_spec.get("pool_size") or max_workers,
+            "max_overflow": db_spec.get("max_overflow", 10),
+            "pool_pre_ping": db_spec.get("pool_pre_ping", False),
+            "pool_recycle": db_spec.get("pool_recycle", -1),
+        }
+
+    def cast_string(self, expr):
+        """Casts an expression to a string
+
+        Args:
+            expr (str): SQL expression
+
+        Returns:
+            str: SQL expression
+        """
+        return f"CAST({expr} AS {self.string_type})"
+
+    def cast_date(self, expr):
+        """Casts an expression to a date
+
+        Args:
+            expr (str): SQL expression
+
+        Returns:
+            str: SQL expression
+        """
+        return f"CAST({expr} AS DATE)"
+
+    def concat(self, exprs):
+        """Concatenates string expressions
+
+        Args:
+            exprs (list): SQL expressions
+
+        Returns:
+            str: SQL expression
+        """
+        return "CONCAT(" + ", ".join(exprs) + ")"
+
+    def idx_sql(self, entity_expr, dt1_expr, dt2_expr):
+        """Builds the idx expression: entity_id + min_date + max_date
+
+        Args:
+            entity_expr (str): entity_id expression
+            dt1_expr (str): min_date expression
+            dt2_expr (str): max_date expression
+
+        Returns:
+            str: SQL expression
+        """
+        return self.concat([
+            self.cast_string(entity_expr),
+            "'_'",
+            self.cast_string(dt1_expr),
+            "'_'",
+            self.cast_string(dt2_expr),
+        ])
+
+    def literal(self, value):
+        """Formats a Python value as a SQL literal
+
+        Args:
+            value (object): String, number or None
+
+        Returns:
+            str: SQL literal
+        """
+        if value is None:
+            return "NULL"
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return repr(value)
+        return "'" + str(value).replace("'", "''") + "'"
+
+    def values_sql(self, column, values):
+        """Builds a SELECT of inline values
+
+        Args:
+            column (str): Column name
+            values (list): Column values
+
+        Returns:
+            str: SQL query
+        """
+        rows = ", ".join(f"({self.literal(v)})" for v in values)
+        return f"SELECT * FROM (VALUES {rows}) AS V({column})"
+
+    def create_table_sql(self, table_name, table_ttl=None, temporary=False, replace=False):
+        """Prepares CREATE TABLE statement prefix
+
+        Args:
+            table_name (str): Table name
+            table_ttl (int): Hours until the table expires engine-side.
+                Defaults to None.
+            temporary (bool): Used for creating a session-scoped temporary
+                table. Defaults to False.
+            replace (bool): Used for replacing an existing table. Defaults
+                to False.
+
+        Returns:
+            str: CREATE TABLE ... AS
+        """
+        if table_ttl is not None and self.supports_ttl is False:
+            warnings.warn(f"table_ttl is not supported by {self.name} and will be ignored")
+        if temporary is True:
+            return f"CREATE TEMP TABLE {table_name} AS "
+        if replace is True and self.supports_replace is True:
+            return f"CREATE OR REPLACE TABLE {table_name} AS "
+        return f"CREATE TABLE {table_name} AS "
+
+    def add_column_sql(self, table_name, column_name, data_type=None):
+        """Prepares ALTER TABLE statement adding a nullable column
+
+        Args:
+            table_name (str): Table name
+            column_name (str): Column name
+            data_type (str): Column data type. If None, the engine's default
+                is used where it allows one. Defaults to None.
+
+        Returns:
+            str: SQL statement
+        """
+        if data_type is None or data_type == "":
+            return f"ALTER TABLE {table_name} ADD COLUMN {column_name}"
+        return f"ALTER TABLE {table_name} ADD COLUMN {column_name} {data_type}"
+
+    def drop_table_sql(self, table_name):
+        """Prepares DROP TABLE statement
+
+        Args:
+            table_name (str): Table name
+
+        Returns:
+            str: SQL statement
+        """
+        return f"DROP TABLE IF EXISTS {table_name}"
+
+    def metadata_sql(self, schema, table_names):
+        """Prepares column metadata lookup for tables in schema
+
+        Args:
+            schema (str): schema of interest
+            table_names (list): Table names without schema
+
+        Returns:
+            str: SQL query returning table_name, column_name, data_type and
+                is_nullable
+        """
+        to_insert_str = ", ".join(f"'{t}'" for t in table_names)
+        return f"""
+        SELECT
+            CONCAT(table_schema, '.', table_name) AS table_name,
+            column_name,
+            data_type,
+            is_nullable
+        FROM
+            information_schema.columns
+        WHERE
+            table_schema = '{schema}'
+            AND table_name IN ({to_insert_str})
+        ORDER BY
+            table_name,
+            ordinal_position
+        """
+
+    def hash_partition_sql(self, column, n_partitions, partition):
+        """Prepares predicate selecting one hash partition
+
+        Subclasses overriding this set supports_hash_partitions so runs
+        default to hash partitions.
+
+        Args:
+            column (str): Column to hash
+            n_partitions (int): Number of partitions
+            partition (int): Partition to select
+
+        Raises:
+            ValueError: Error for unsupported hash partitions
+
+        Returns:
+            str: SQL predicate
+        """
+        raise ValueError(f"Hash partitions are not supported by {self.name}. Use range partitions.")
+
+    def shuffle_order_sql(self, column, seed):
+        """Prepares deterministic pseudo-random ORDER BY expression
+
+        Args:
+            column (str): Column to shuffle on
+            seed (int): Seed
+
+        Returns:
+            str: SQL expression
+        """
+        return f"MD5(CONCAT({self.cast_string(column)}, '{seed}'))"
+
+    def fetch_arrow(self, connection, sql):
+        """Fetches query results as an Arrow table
+
+        Args:
+            connection (object): Connection object
+            sql (str): SQL query
+
+        Returns:
+            Table: Arrow table, or None if the driver cannot return Arrow
+        """
+        return None
+
+    def configure_engine(self, engine):
+        """Configures a newly created engine, e.g. to enable profiling
+
+        Args:
+            engine (object): Engine object
+        """
+        pass
+
+    def query_stats(self, result):
+        """Collects engine-side statistics for an executed statement
+
+        Args:
+            result (object): SQLAlchemy result of the statement
+
+        Returns:
+            dict: Any of bytes_processed, bytes_billed, cpu_ms, rows_written
+                and cache_hit the engine exposes
+        """
+        rowcount = getattr(result, "rowcount", -1)
+        return {"rows_written": rowcount if rowcount is not None and rowcount >= 0 else None}
+
+    def dry_run(self, connection, sql):
+        """Validates a query without running it
+
+        Args:
+            connection (object): Connection object
+            sql (str): SQL query
+
+        Returns:
+            dict: bytes_processed, or None if the engine does not estimate it
+        """
+        connection.execute(f"EXPLAIN {sql}")
+        return {"bytes_processed": None}
+
+    def cancel(self, connection):
+        """Cancels the statement running on a connection
+
+        Called from another thread than the one running the statement,
+        which then fails. Uses the driver's cancel (psycopg2) or interrupt
+        (sqlite3 and DuckDB).
+
+        Args:
+            connection (object): Connection object
+
+        Raises:
+            NotImplementedError: Error for drivers that cannot cancel
+        """
+        dbapi_connection = connection.connection.dbapi_connection
+        if hasattr(dbapi_connection, "cancel"):
+            dbapi_connection.cancel()
+        elif hasattr(dbapi_connection, "interrupt"):
+            dbapi_connection.interrupt()
+        else:
+            raise NotImplementedError(f"Statements cannot be cancelled on {self.name}.")
+
+    def scratch_database(self, db_spec):
+        """Checks whether db_spec asks for a throwaway database file
+
+        start_engine creates such databases in a temporary directory that
+        stop_engine removes.
+
+        Args:
+            db_spec (dict): Used as the config for create_engine
+
+        Returns:
+            bool: True for throwaway databases
+        """
+        return False
+
+    def register_sources(self, engine, sources):
+        """Maps source table names to local files
+
+        Args:
+            engine (object): Engine object
+            sources (dict): Table name: Parquet/CSV file, glob or directory
+
+        Raises:
+            ValueError: Error for unsupported local sources
+        """
+        raise ValueError(f"Local sources are not supported by {self.name}. Use duckdb.")
+
+    def start_session(self, connection):
+        """Starts a session on a connection used for temporary tables
+
+        Args:
+            connection (object): Connection object
+        """
+        pass
+
+    def end_session(self, connection):
+        """Ends a session started by start_session
+
+        Args:
+            connection (object): Connection object
+        """
+        pass
+
+
+class BigQueryDialect(Dialect):
+
+    """BigQuery dialect adapter"""
+
+    name = "bigquery"
+    string_type = "STRING"
+    supports_ttl = True
+    supports_hash_partitions = True
+
+    def url(self, db_spec):
+        if db_spec.get("url") is not None:
+            return db_spec["url"]
+        return f"{self.name}:///?ProjectId='{db_spec['project_id']}'"
+
+    def create_table_sql(self, table_name, table_ttl=None, temporary=False, replace=False):
+        if table_ttl is not None and temporary is False and replace is False:
+            expiration = f"TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL {int(table_ttl)} HOUR)"
+            return f"CREATE TABLE {table_name} OPTIONS(expiration_timestamp={expiration}) AS "
+        return super().create_table_sql(table_name, temporary=temporary, replace=replace)
+
+    def literal(self, value):
+        # BigQuery strings use backslash escapes and cannot span lines
+        if value is None or (isinstance(value, (int, float)) and not isinstance(value, bool)):
+            return super().literal(value)
+        escapes = {"\\": "\\\\", "'": "\\'", "\n": "\\n", "\r": "\\r"}
+        return "'" + "".join(escapes.get(c, c) for c in str(value)) + "'"
+
+    def values_sql(self, column, values):
+        array = ", ".join(self.literal(v) for v in values)
+        return f"SELECT {column} FROM UNNEST([{array}]) AS {column}"
+
+    def metadata_sql(self, schema, table_names):
+        to_insert_str = ", ".join(f"'{t}'" for t in table_names)
+        return f"""
+        SELECT
+            CONCAT(table_schema, '.', table_name) AS table_name,
+            column_name,
+            data_type,
+            is_nullable
+        FROM
+            {schema}.INFORMATION_SCHEMA.COLUMNS
+        WHERE
+            table_name IN ({to_insert_str})
+        ORDER BY
+            table_name,
+            ordinal_position
+        """
+
+    def hash_partition_sql(self, column, n_partitions, partition):
+        return f"MOD(MOD(FARM_FINGERPRINT({column}), {n_partitions}) + {n_partitions}, {n_partitions}) = {partition}"
+
+    def shuffle_order_sql(self, column, seed):
+        return f"FARM_FINGERPRINT(CONCAT({column}, '{seed}'))"
+
+    def query_stats(self, result):
+        # Results of DDL close right away and drop their cursor, so the
+        # job is read from the execution context's cursor
+        context = getattr(result, "context", None)
+        cursor = getattr(context, "cursor", None) or getattr(result, "cursor", None)
+        job = getattr(cursor, "_query_job", None)
+        if job is None:
+            return super().query_stats(result)
+        return {
+            "bytes_processed": job.total_bytes_processed,
+            "bytes_billed": job.total_bytes_billed,
+            "cpu_ms": job.slot_millis,
+            "rows_written": job.num_dml_affected_rows,
+            "cache_hit": job.cache_hit,
+        }
+
+    def dry_run(self, connection, sql):
+        from google.cloud import bigquery
+
+        client = connection.connection.dbapi_connection._client
+        job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+        job = client.query(sql, job_config=job_config)
+        return {"bytes_processed": job.total_bytes_processed}
+
+    def cancel(self, connection):
+        # Cancel the jobs of the connection's cursors
+        dbapi_connection = connection.connection.dbapi_connection
+        for cursor in list(getattr(dbapi_connection, "_cursors_created", [])):
+            job = getattr(cursor, "_query_job", None)
+            if job is not None and not job.done():
+                job.cancel()
+
+    def start_session(self, connection):
+        from google.cloud import bigquery
+        from sqlalchemy import event
+
+        client = connection.connection.dbapi_connection._client
+        job = client.query("SELECT 1", job_config=bigquery.QueryJobConfig(create_session=True))
+        job.result()
+
+        # The client is shared with pooled connections, so the session is
+        # attached to the job config of each statement on this connection
+        session = bigquery.ConnectionProperty("session_id", job.session_info.session_id)
+        connection.info["coldstart_job_config"] = bigquery.QueryJobConfig(connection_properties=[session])
+        if not event.contains(connection.engine, "do_execute", self.session_execute):
+            event.listen(connection.engine, "do_execute", self.session_execute)
+
+    def end_session(self, connection):
+        try:
+            connection.execute("CALL BQ.ABORT_SESSION()")
+        finally:
+            connection.info.pop("coldstart_job_config", None)
+
+    @staticmethod
+    def session_execute(cursor, statement, parameters, context):
+        """Runs statements of session connections within their session
+
+        Args:
+            cursor (object): DB-API cursor
+            statement (str): SQL statement
+            parameters (object): Statement parameters
+            context (object): Execution context
+
+        Returns:
+            bool: True if the statement was run, None to leave it to the
+                dialect
+        """
+        job_config = context.root_connection.info.get("coldstart_job_config")
+        if job_config is None:
+            return None
+        cursor.execute(statement, parameters, job_config=copy.deepcopy(job_config))
+        return True
+
+
+class SQLiteDialect(Dialect):
+
+    """SQLite dialect adapter"""
+
+    name = "sqlite"
+    string_type = "TEXT"
+    supports_replace = False
+
+    def in_memory(self, db_spec):
+        """Checks whether db_spec points at an in-memory database
+
+        Args:
+            db_spec (dict): Used as the config for create_engine
+
+        Returns:
+            bool: True for in-memory databases
+        """
+        if db_spec.get("url") is not None:
+            return db_spec["url"] in ["sqlite://", "sqlite:///:memory:"]
+        return db_spec.get("database") in [None, "", ":memory:"]
+
+    def engine_kwargs(self, db_spec):
+        from sqlalchemy.pool import QueuePool, StaticPool
+
+        kwargs = {"connect_args": {"check_same_thread": False}}
+        if self.in_memory(db_spec):
+            kwargs["poolclass"] = StaticPool
+        else:
+            kwargs["poolclass"] = QueuePool
+        return kwargs
+
+    def pool_kwargs(self, db_spec, max_workers):
+        # A single shared connection backs in-memory databases
+        if self.in_memory(db_spec):
+            return {}
+        return super().pool_kwargs(db_spec, max_workers)
+
+    def cast_date(self, expr):
+        return f"DATE({expr})"
+
+    def values_sql(self, column, values):
+        rows = ", ".join(f"({self.literal(v)})" for v in values)
+        return f"SELECT column1 AS {column} FROM (VALUES {rows})"
+
+    def concat(self, exprs):
+        return "(" + " || ".join(exprs) + ")"
+
+    def metadata_sql(self, schema, table_names):
+        to_insert_str = ", ".join(f"'{t}'" for t in table_names)
+        return f"""
+        SELECT
+            '{schema}.' || M.name AS table_name,
+            P.name AS column_name,
+            P.type AS data_type,
+            CASE WHEN P."notnull" = 1 THEN 'NO' ELSE 'YES' END AS is_nullable
+        FROM
+            {schema}.sqlite_master AS M,
+            pragma_table_info(M.name, '{schema}') AS P
+        WHERE
+            M.type = 'table'
+            AND M.name IN ({to_insert_str})
+        ORDER BY
+            M.name,
+            P.cid
+        """
+
+    def shuffle_order_sql(self, column, seed):
+        return f"((rowid * 1103515245 + {int(seed)}) % 2147483648)"
+
+
+class DuckDBDialect(Dialect):
+
+    """DuckDB dialect adapter"""
+
+    name = "duckdb"
+    supports_hash_partitions = True
+
+    def url(self, db_spec):
+        if db_spec.get("url") is not None:
+            return db_spec["url"]
+        database = db_spec.get("database") or ":memory:"
+        return f"{self.name}:///{database}"
+
+    def scratch_database(self, db_spec):
+        # In-memory databases are not shared across pooled connections
+        return db_spec.get("url") is None and db_spec.get("database") in [None, "", ":memory:"]
+
+    def pool_kwargs(self, db_spec, max_workers):
+        # duckdb-engine keeps one connection per thread for in-memory URLs
+        if ":memory:" in (db_spec.get("url") or ""):
+            return {}
+        return super().pool_kwargs(db_spec, max_workers)
+
+    def configure_engine(self, engine):
+        from sqlalchemy import event
+
+        @event.listens_for(engine, "connect")
+        def enable_profiling(dbapi_connection, connection_record):
+            dbapi_connection.execute("PRAGMA enable_profiling='no_output'")
+
+    def query_stats(self, result):
+        try:
+            profile = json.loads(result.cursor.get_profiling_information(format="json"))
+        except Exception:
+            return super().query_stats(result)
+        stats = {
+            "bytes_processed": profile.get("total_bytes_read"),
+            "cpu_ms": None if profile.get("cpu_time") is None else profile["cpu_time"] * 1000,
+            "rows_written": None,
+        }
+        # Rows flowing into CREATE TABLE AS / INSERT
+        for child in profile.get("children", []):
+            if child.get("operator_type") in ["CREATE_TABLE_AS", "INSERT"]:
+                stats["rows_written"] = sum(c.get("operator_cardinality", 0) for c in child.get("children", []))
+        return stats
+
+    def source_sql(self, name, path):
+        """Prepares a view reading a local Parquet/CSV source
+
+        Args:
+            name (str): Table name used in queries, optionally prefixed with
+                schema
+            path (str): Parquet/CSV file, glob or directory of Parquet files
+
+        Returns:
+            str: SQL statement
+        """
+        path = Path(path)
+        if path.is_dir():
+            path = path.joinpath("*.parquet")
+        suffixes = [s.lower() for s in path.suffixes]
+        if any(s in [".csv", ".tsv", ".txt"] for s in suffixes):
+            reader = "read_csv_auto"
+        else:
+            reader = "read_parquet"
+        return f"CREATE OR REPLACE VIEW {name} AS SELECT * FROM {reader}('{path.as_posix()}')"
+
+    def register_sources(self, engine, sources):
+        with engine.connect() as connection:
+            for name, path in sources.items():
+                if "." in name:
+                    connection.execute(f"CREATE SCHEMA IF NOT EXISTS {name.rsplit('.', 1)[0]}")
+                connection.execute(self.source_sql(name, path))
+
+    def fetch_arrow(self, connection, sql):
+        cursor = connection.connection.cursor()
+        try:
+            cursor.execute(sql)
+            if hasattr(cursor, "to_arrow_table"):
+                return cursor.to_arrow_table()
+            return cursor.fetch_arrow_table()
+        finally:
+            cursor.close()
+
+    def hash_partition_sql(self, column, n_partitions, partition):
+        return f"HASH({column}) % {n_partitions} = {partition}"
+
+    def shuffle_order_sql(self, column, seed):
+        return f"HASH(CONCAT({column}, '{seed}'))"
+
+
+class PostgresDialect(Dialect):
+
+    """Postgres dialect adapter"""
+
+    name = "postgresql"
+    string_type = "TEXT"
+    supports_replace = False
+    supports_hash_partitions = True
+
+    def url(self, db_spec):
+        if db_spec.get("url") is not None:
+            return db_spec["url"]
+        driver = db_spec.get("driver")
+        scheme = self.name if driver is None else f"{self.name}+{driver}"
+        user = db_spec.get("user") or ""
+        password = db_spec.get("password")
+        auth = user if password is None else f"{user}:{password}"
+        host = db_spec.get("host") or "localhost"
+        port = db_spec.get("port") or 5432
+        database = db_spec.get("database") or ""
+        return f"{scheme}://{auth}@{host}:{port}/{database}"
+
+    def hash_partition_sql(self, column, n_partitions, partition):
+        return f"MOD(HASHTEXT({column})::BIGINT + 2147483648, {n_partitions}) = {partition}"
+
+
+# Built-in dialect adapters
+DIALECTS = {
+    "bigquery": BigQueryDialect(),
+    "sqlite": SQLiteDialect(),
+    "duckdb": DuckDBDialect(),
+    "postgresql": PostgresDialect(),
+    "postgres": PostgresDialect(),
+}
+
+
+def register_dialect(dialect, name=None):
+    """Registers a dialect adapter
+
+    Args:
+        dialect (Dialect): Dialect adapter
+        name (str): Name to register under. If None, dialect.name is used.
+            Defaults to None.
+    """
+    DIALECTS[name or dialect.name] = dialect
+
+
+def get_dialect(dialect=None):
+    """Returns a dialect adapter
+
+    Args:
+        dialect (str): Dialect name or adapter. If None, the BigQuery
+            adapter is used. Defaults to None.
+
+    Raises:
+        ValueError: Error for unsupported dialect
+
+    Returns:
+        Dialect: Dialect adapter
+    """
+    if dialect is None:
+        return DIALECTS["bigquery"]
+    if isinstance(dialect, Dialect):
+        return dialect
+    if dialect not in DIALECTS:
+        raise ValueError("This database is not currently supported")
+    return DIALECTS[dialect]
@@ -0,0 +1,214 @@
+# Copyright 2022 CVS Health and/or one of its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pathlib import Path
+from tqdm.contrib.concurrent import thread_map
+
+from coldstart.query import run_query, prep_partition_queries
+
+
+def write_parquet(
+    engine,
+    table,
+    output_dir,
+    n_partitions=1,
+    partition_by="hash",
+    compression="snappy",
+    column_types=None,
+    dialect=None,
+):
+    """Writes a table to partitioned, compressed Parquet files
+
+    Partitions are fetched from the warehouse in parallel and each one is
+    written to its own part file. Existing part files in output_dir are
+    removed first.
+
+    Args:
+        engine (object): Engine object
+        table (str): Table to export
+        output_dir (str): Destination directory for part files
+        n_partitions (int): Number of partitions. Defaults to 1.
+        partition_by (str): Either "hash" or "range". Defaults to "hash".
+        compression (str): Parquet compression codec. Defaults to "snappy".
+        column_types (dict): Column name: warehouse data type used for
+            building typed columns. Defaults to None.
+        dialect (str): Dialect name or adapter. Defaults to None.
+
+    Returns:
+        list: Paths of written part files
+    """
+
+    # Prep directory
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for path in output_dir.glob("part-*.parquet"):
+        path.unlink()
+
+    # Collect row count for range partitions
+    row_count = None
+    if partition_by == "range":
+        sql = f"""
+        SELECT COUNT(*) AS n
+        FROM {table}
+        """
+        row_count = int(run_query(engine=engine, sql=sql, return_df=True)["n"].iloc[0])
+
+    # Prep partition queries
+    sql_list = prep_partition_queries(
+        table=table,
+        n_partitions=n_partitions,
+        partition_by=partition_by,
+        row_count=row_count,
+        dialect=dialect
+    )
+
+    # Fetch and write partitions
+    def write_partition(part):
+        i, sql = part
+        df = run_query(
+            engine=engine,
+            sql=sql,
+            return_df=True,
+            column_types=column_types,
+            dialect=dialect
+        )
+        if len(df) == 0 and i > 0:
+            return None
+        path = output_dir.joinpath(f"part-{i:05d}.parquet")
+        arrow_table = pa.Table.from_pandas(df, preserve_index=False)
+        pq.write_table(arrow_table, path, compression=compression)
+        return path
+
+    paths = thread_map(
+        write_partition,
+        list(enumerate(sql_list)),
+        miniters=1,
+        total=len(sql_list),
+        desc="Export Progress"
+    )
+    return [p for p in paths if p is not None]
+
+
+def read_parquet(path, columns=None):
+    """Reads Parquet part files written by write_parquet
+
+    Files are memory-mapped and read with a schema unified across all part
+    files, so partitions with all-null columns do not clash.
+
+    Args:
+        path (str): Directory containing part files
+        columns (list): Columns to read. If None, all columns are read.
+            Defaults to None.
+
+    Raises:
+        ValueError: Error for missing part files
+
+    Returns:
+        DataFrame: Exported data
+    """
+
+    # Collect part files
+    paths = sorted(Path(path).glob("part-*.parquet"))
+    if len(paths) == 0:
+        raise ValueError(f"No Parquet files were found in {path}.")
+
+    # Unify schemas and read
+    schema = pa.unify_schemas([pq.read_schema(p) for p in paths])
+    tables = [
+        pq.read_table(p, columns=columns, schema=schema, memory_map=True)
+        for p in paths
+    ]
+    return pa.concat_tables(tables).to_pandas()
+
+
+def rebatch(frames, batch_rows):
+    """For regrouping dataframes into fixed-size chunks
+
+    Args:
+        frames (iterable): DataFrames of any length
+        batch_rows (int): Number of rows per chunk
+
+    Yields:
+        DataFrame: Chunk of batch_rows rows. The last chunk may be smaller.
+    """
+    buffer, n = [], 0
+    for df in frames:
+        while len(df) > 0:
+            take = batch_rows - n
+            buffer.append(df.iloc[:take])
+            n += len(buffer[-1])
+            df = df.iloc[take:]
+            if n == batch_rows:
+                yield pd.concat(buffer, ignore_index=True)
+                buffer, n = [], 0
+    if n > 0:
+        yield pd.concat(buffer, ignore_index=True)
+
+
+def iter_parquet_batches(path, batch_rows, columns=None, shuffle_seed=None):
+    """For streaming Parquet part files in fixed-size chunks
+
+    Only one chunk per row group is held in memory at a time. If
+    shuffle_seed is specified, row groups are visited in a random order and
+    rows are shuffled within each chunk.
+
+    Args:
+        path (str): Directory containing part files
+        batch_rows (int): Number of rows per chunk
+        columns (list): Columns to read. If None, all columns are read.
+            Defaults to None.
+        shuffle_seed (int): Seed used for shuffling. If None, rows are read
+            in file order. Defaults to None.
+
+    Raises:
+        ValueError: Error for missing part files
+
+    Returns:
+        generator: DataFrame chunks of batch_rows rows
+    """
+
+    # Collect part files and row groups
+    paths = sorted(Path(path).glob("part-*.parquet"))
+    if len(paths) == 0:
+        raise ValueError(f"No Parquet files were found in {path}.")
+    schema = pa.unify_schemas([pq.read_schema(p) for p in paths])
+    groups = [
+        (p, i)
+        for p in paths
+        for i in range(pq.ParquetFile(p).num_row_groups)
+    ]
+
+    # Shuffle row groups
+    rng = None
+    if shuffle_seed is not None:
+        rng = np.random.default_rng(shuffle_seed)
+        groups = [groups[i] for i in rng.permutation(len(groups))]
+
+    # Read row groups in chunks
+    def frames():
+        for p, i in groups:
+            f = pq.ParquetFile(p, memory_map=True)
+            for batch in f.iter_batches(batch_size=batch_rows, row_groups=[i], columns=columns):
+                table = pa.Table.from_batches([batch])
+                table = table.cast(pa.schema([schema.field(c) for c in table.column_names]))
+                df = table.to_pandas()
+                if rng is not None:
+                    df = df.iloc[rng.permutation(len(df))]
+                yield df.reset_index(drop=True)
+
+    return rebatch(frames(), batch_rows)
@@ -0,0 +1,334 @@
+# Copyright 2022 CVS Health and/or one of its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# File layout
+# MAGIC | header length (uint64) | JSON header | blocks
+# Every block starts on an ALIGNMENT boundary and offsets in the header are
+# relative to the first block. The key block holds idx as sorted,
+# fixed-width UTF-8 bytes; fixed columns hold one value per row in key
+# order, optionally followed by a validity block; string columns hold int32
+# codes into a sorted, fixed-width UTF-8 dictionary block, with -1 for null.
+
+import os
+import json
+import mmap
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+MAGIC = b"CSFIDX01"
+ALIGNMENT = 64
+
+
+def align(n):
+    """Rounds n up to the block alignment"""
+    return -(-n // ALIGNMENT) * ALIGNMENT
+
+
+def encode_strings(values):
+    """Encodes strings as fixed-width UTF-8 bytes
+
+    Args:
+        values (iterable): Strings
+
+    Returns:
+        ndarray: Fixed-width bytes array
+    """
+    encoded = [str(v).encode("utf-8") for v in values]
+    width = max([len(v) for v in encoded] + [1])
+    return np.array(encoded, dtype=f"S{width}")
+
+
+def encode_column(s):
+    """Encodes a column as fixed-width blocks
+
+    Args:
+        s (Series): Column in key order
+
+    Returns:
+        dict, list: Column header without offsets, blocks: values and
+            optionally validity or dictionary
+    """
+
+    # Dates and times
+    if pd.api.types.is_datetime64_any_dtype(s.dtype):
+        if getattr(s.dt, "tz", None) is not None:
+            s = s.dt.tz_convert(None)
+        values = s.to_numpy(dtype="datetime64[ns]")
+        return {"kind": "fixed", "dtype": values.dtype.str}, [values]
+
+    # Numbers and booleans
+    if pd.api.types.is_numeric_dtype(s.dtype) or pd.api.types.is_bool_dtype(s.dtype):
+        if pd.api.types.is_float_dtype(s.dtype):
+            dtype = np.dtype(s.dtype.numpy_dtype if hasattr(s.dtype, "numpy_dtype") else s.dtype)
+            return {"kind": "fixed", "dtype": dtype.str}, [s.to_numpy(dtype=dtype, na_value=np.nan)]
+        dtype = np.dtype(s.dtype.numpy_dtype if hasattr(s.dtype, "numpy_dtype") else s.dtype)
+        valid = s.notna().to_numpy()
+        values = s.to_numpy(dtype=dtype, na_value=0)
+        if valid.all():
+            return {"kind": "fixed", "dtype": dtype.str}, [values]
+        return {"kind": "fixed", "dtype": dtype.str, "nullable": True}, [values, valid]
+
+    # Strings and anything else
+    valid = s.notna().to_numpy()
+    strings = s[valid].astype(str).to_numpy()
+    dictionary, inverse = np.unique(encode_strings(strings), return_inverse=True)
+    codes = np.full(len(s), -1, dtype="<i4")
+    codes[valid] = inverse
+    return {"kind": "string", "dtype": codes.dtype.str, "itemsize": dictionary.dtype.itemsize}, [codes, dictionary]
+
+
+def write_index(df, path):
+    """Writes a feature dataframe to a memory-mappable index file
+
+    Rows are sorted by idx and every column is stored as a fixed-width
+    block, so FeatureIndex can look rows up without parsing or copying.
+
+    Args:
+        df (DataFrame): Features including a unique idx column
+        path (str): Destination file
+
+    Raises:
+        ValueError: Error for missing idx column
+        ValueError: Error for duplicate idx
+
+    Returns:
+        Path: Written file
+    """
+
+    # Sort rows by key
+    if "idx" not in df.columns:
+        raise ValueError("df needs to include an idx column.")
+    keys = encode_strings(df["idx"])
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    if len(keys) > 1 and (keys[1:] == keys[:-1]).any():
+        raise ValueError("idx values need to be unique.")
+    df = df.iloc[order].reset_index(drop=True)
+
+    # Encode blocks
+    blocks = [keys]
+    header = {"rows": len(df), "key": {"block": 0, "dtype": keys.dtype.str}, "columns": []}
+    for name in df.columns:
+        if name == "idx":
+            continue
+        column, column_blocks = encode_column(df[name])
+        column["name"] = str(name)
+        column["blocks"] = list(range(len(blocks), len(blocks) + len(column_blocks)))
+        header["columns"].append(column)
+        blocks += column_blocks
+
+    # Lay out blocks
+    offset, offsets = 0, []
+    for block in blocks:
+        offsets.append(offset)
+        offset = align(offset + block.nbytes)
+    header["offsets"] = offsets
+    header["lengths"] = [len(block) for block in blocks]
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = align(len(MAGIC) + 8 + len(header_bytes))
+
+    # Write file
+    path = Path(path)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.array(len(header_bytes), dtype="<u8").tobytes())
+        f.write(header_bytes)
+        for block, block_offset in zip(blocks, offsets):
+            f.seek(data_start + block_offset)
+            f.write(np.ascontiguousarray(block).tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+    return path
+
+
+class FeatureIndex(object):
+
+    """Memory-mapped reader of files written by write_index
+
+    Columns are NumPy views over the mapped file, so opening an index reads
+    only its header and lookups touch only the pages they need. Keys are
+    found by binary search over the sorted key block.
+
+    Args:
+        path (str): Index file
+
+    Raises:
+        ValueError: Error for invalid index file
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a coldstart feature index.")
+            header_length = int(np.frombuffer(f.read(8), dtype="<u8")[0])
+            self.header = json.loads(f.read(header_length))
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data_start = align(len(MAGIC) + 8 + header_length)
+
+        # Map blocks
+        key = self.header["key"]
+        self.keys = self.block(key["block"], key["dtype"])
+        self.columns = {}
+        self.valid = {}
+        self.dictionaries = {}
+        for column in self.header["columns"]:
+            name, blocks = column["name"], column["blocks"]
+            self.columns[name] = self.block(blocks[0], column["dtype"])
+            if column["kind"] == "string":
+                self.dictionaries[name] = self.block(blocks[1], f"S{column['itemsize']}")
+            elif column.get("nullable", False):
+                self.valid[name] = self.block(blocks[1], "?")
+
+    def block(self, i, dtype):
+        """Maps a block as a read-only NumPy view"""
+        offset = self.data_start + self.header["offsets"][i]
+        return np.frombuffer(self.mmap, dtype=dtype, count=self.header["lengths"][i], offset=offset)
+
+    def __len__(self):
+        return self.header["rows"]
+
+    def locate(self, keys):
+        """Finds the rows of keys
+
+        Args:
+            keys (list): idx values
+
+        Returns:
+            ndarray: Row per key, -1 for missing keys
+        """
+        encoded = [str(k).encode("utf-8") for k in keys]
+        width = self.keys.dtype.itemsize
+        fits = np.array([len(k) <= width for k in encoded], dtype=bool)
+        needles = np.array([k if f else b"" for k, f in zip(encoded, fits)], dtype=self.keys.dtype)
+        rows = np.searchsorted(self.keys, needles)
+        rows = np.minimum(rows, max(len(self.keys) - 1, 0))
+        found = fits & (len(self.keys) > 0)
+        if len(self.keys) > 0:
+            found &= self.keys[rows] == needles
+        return np.where(found, rows, -1)
+
+    def column(self, name):
+        """Returns a column as a zero-copy view in key order
+
+        String columns are returned as int32 codes into dictionary(name).
+
+        Args:
+            name (str): Column name
+
+        Returns:
+            ndarray: Column values
+        """
+        return self.columns[name]
+
+    def dictionary(self, name):
+        """Returns the decoded dictionary of a string column
+
+        Args:
+            name (str): Column name
+
+        Returns:
+            ndarray: Strings
+        """
+        return np.char.decode(self.dictionaries[name], "utf-8").astype(object)
+
+    def values(self, name, rows):
+        """Decodes a column at rows
+
+        Args:
+            name (str): Column name
+            rows (ndarray): Rows, -1 for missing
+
+        Returns:
+            ndarray: Values, None or NaN for nulls and missing rows
+        """
+        missing = rows < 0
+        if len(self) == 0:
+            return np.full(len(rows), None, dtype=object)
+        values = self.columns[name][np.where(missing, 0, rows)]
+        if name in self.dictionaries:
+            codes = np.where(missing, -1, values)
+            out = np.full(len(rows), None, dtype=object)
+            present = codes >= 0
+            if present.any():
+                out[present] = np.char.decode(self.dictionaries[name][codes[present]], "utf-8")
+            return out
+        null = missing
+        if name in self.valid:
+            null = null | ~self.valid[name][np.where(missing, 0, rows)]
+        if not null.any():
+            return values
+        if values.dtype.kind == "f":
+            return np.where(null, np.nan, values)
+        if values.dtype.kind == "M":
+            return np.where(null, np.datetime64("NaT"), values)
+        out = values.astype(object)
+        out[null] = None
+        return out
+
+    def get(self, key, columns=None):
+        """Looks up the features of one key
+
+        Args:
+            key (str): idx value
+            columns (list): Columns to return. If None, all columns are
+                returned. Defaults to None.
+
+        Returns:
+            dict: Column: value, or None if the key is missing
+        """
+        needle = str(key).encode("utf-8")
+        if len(needle) > self.keys.dtype.itemsize:
+            return None
+        row = int(np.searchsorted(self.keys, needle))
+        if row >= len(self.keys) or self.keys[row] != needle:
+            return None
+
+        # Read one value per column
+        features = {}
+        for name in (columns or self.columns):
+            value = self.columns[name][row]
+            if name in self.dictionaries:
+                value = None if value < 0 else self.dictionaries[name][value].decode("utf-8")
+            elif name in self.valid and not self.valid[name][row]:
+                value = None
+            features[name] = value
+        return features
+
+    def get_many(self, keys, columns=None):
+        """Looks up the features of many keys
+
+        Args:
+            keys (list): idx values
+            columns (list): Columns to return. If None, all columns are
+                returned. Defaults to None.
+
+        Returns:
+            DataFrame: One row per key in the given order, indexed by idx,
+                with nulls for missing keys
+        """
+        rows = self.locate(keys)
+        data = {name: self.values(name, rows) for name in (columns or self.columns)}
+        return pd.DataFrame(data, index=pd.Index(list(keys), name="idx"))
+
+    def close(self):
+        """Unmaps the file once no views handed out are left"""
+        self.keys, self.columns, self.valid, self.dictionaries = None, {}, {}, {}
+        try:
+            self.mmap.close()
+        except BufferError:
+            pass
@@ -12,10 +12,105 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import re
+import json
+import warnings
+from fnmatch import fnmatchcase
 from pathlib import Path
 
 
+# Parsed query tags keyed by file path
+QUERY_INDEX = {}
+
+
+def parse_tags(query_sql):
+    """Parses the DIALECT, ENTITY and DOMAIN tags of a query
+
+    Args:
+        query_sql (str): Untemplated feature query
+
+    Returns:
+        dict: dialect, entity and domain
+    """
+    return {
+        "dialect": re.search("\\-\\- DIALECT: (.*?)\\n", query_sql).group(1),
+        "entity": re.search("\\-\\- ENTITY: (.*?)\\n", query_sql).group(1),
+        "domain": re.search("\\-\\- DOMAIN: (.*?)\\n", query_sql).group(1),
+    }
+
+
+def index_queries(query_dir=None, cache_path=None):
+    """Indexes the tags of every query in a directory
+
+    Files are only read and parsed when their size or modification time
+    changed since they were last indexed, so repeated lookups against a
+    large query bank cost one directory listing. If cache_path is
+    specified, the index is also persisted there and shared across
+    processes. Indexed entries are shared and should not be modified.
+
+    Args:
+        query_dir (str): Target directory containing feature queries.
+            If None, coldstart/query_bank is used. Defaults to None.
+        cache_path (str): JSON file the index is loaded from and saved to.
+            If None, the index is only kept in memory. Defaults to None.
+
+    Returns:
+        list: Dictionaries of query_name, path, dialect, entity, domain,
+            mtime_ns and size, in directory order
+    """
+
+    # Set query directory
+    if query_dir is None:
+        query_dir = Path(__file__).parent.joinpath("query_bank")
+    query_dir = Path(query_dir).resolve()
+
+    # Load persisted index
+    cached = {}
+    if cache_path is not None and Path(cache_path).is_file():
+        try:
+            cached = json.loads(Path(cache_path).read_text())
+        except (OSError, ValueError):
+            cached = {}
+    for key, entry in cached.items():
+        QUERY_INDEX.setdefault(key, entry)
+
+    # Parse new and changed queries
+    index = []
+    for path in query_dir.rglob("*.sql"):
+        key = str(path)
+        stat = path.stat()
+        entry = QUERY_INDEX.get(key)
+        if entry is None or entry["mtime_ns"] != stat.st_mtime_ns or entry["size"] != stat.st_size:
+            entry = {
+                "query_name": path.stem,
+                "path": key,
+                **parse_tags(path.read_text()),
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+            }
+            QUERY_INDEX[key] = entry
+        index.append(entry)
+
+    # Persist index
+    if cache_path is not None:
+        prefix = str(query_dir) + os.sep
+        persisted = {k: v for k, v in cached.items() if not k.startswith(prefix)}
+        persisted.update((entry["path"], entry) for entry in index)
+        if persisted != cached:
+            try:
+                cache_path = Path(cache_path)
+                cache_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+                tmp_path.write_text(json.dumps(persisted))
+                os.replace(tmp_path, cache_path)
+            except OSError as e:
+                warnings.warn(f"Query index not cached: {e}")
+
+    # Return index
+    return index
+
+
 def list_dialects(query_dir=None):
     """Return list of available dialects
 
@@ -35,11 +130,9 @@ def list_dialects(query_dir=None):
 
     # Collect dialects
     valid_dialects = []
-    for path in query_dir.rglob("*.sql"):
-        query_sql = path.read_text()
-        query_dialect = re.search("\-\- DIALECT: (.*?)\\n", query_sql).group(1)
-        if query_dialect not in valid_dialects:
-            valid_dialects.append(query_dialect)          
+    for entry in index_queries(query_dir):
+        if entry["dialect"] not in valid_dialects:
+            valid_dialects.append(entry["dialect"])
 
     # Return databases
     return valid_dialects
@@ -76,12 +169,9 @@ def list_entities(dialect=None, query_dir=None):
 
     # Collect entities
     valid_entities = []
-    for path in query_dir.rglob("*.sql"):
-        query_sql = path.read_text()
-        query_dialect = re.search("\-\- DIALECT: (.*?)\\n", query_sql).group(1)
-        query_entity = re.search("\-\- ENTITY: (.*?)\\n", query_sql).group(1)
-        if query_dialect == dialect and query_entity not in valid_entities:
-            valid_entities.append(query_entity)          
+    for entry in index_queries(query_dir):
+        if entry["dialect"] == dialect and entry["entity"] not in valid_entities:
+            valid_entities.append(entry["entity"])
 
     # Return entities
     return valid_entities
@@ -128,13 +218,10 @@ def list_domains(dialect=None, entity_id=None, query_dir=None):
 
     # Collect domains
     valid_domains = []
-    for path in query_dir.rglob("*.sql"):
-        query_sql = path.read_text()
-        query_dialect = re.search("\-\- DIALECT: (.*?)\\n", query_sql).group(1)
-        query_entity = re.search("\-\- ENTITY: (.*?)\\n", query_sql).group(1)
-        query_domain = re.search("\-\- DOMAIN: (.*?)\\n", query_sql).group(1)
-        if query_dialect == dialect and query_entity == entity_id and query_domain not in valid_domains:
-            valid_domains.append(query_domain)          
+    for entry in index_queries(query_dir):
+        query_domain = entry["domain"]
+        if entry["dialect"] == dialect and entry["entity"] == entity_id and query_domain not in valid_domains:
+            valid_domains.append(query_domain)
 
     # Return domains
     return valid_domains
@@ -195,12 +282,11 @@ def list_queries(
 
     # Collect queries
     valid_queries = []
-    for path in query_dir.rglob("*.sql"):
-        query_name = path.stem
-        query_sql = path.read_text()
-        query_dialect = re.search("\-\- DIALECT: (.*?)\\n", query_sql).group(1)
-        query_entity = re.search("\-\- ENTITY: (.*?)\\n", query_sql).group(1)
-        query_domain = re.search("\-\- DOMAIN: (.*?)\\n", query_sql).group(1)
+    for entry in index_queries(query_dir):
+        query_name = entry["query_name"]
+        query_dialect = entry["dialect"]
+        query_entity = entry["entity"]
+        query_domain = entry["domain"]
         if query_dialect == dialect and query_entity == entity_id and domains is None:
             valid_queries.append(query_name)
         elif query_dialect == dialect and query_entity == entity_id and query_domain in domains and query_name not in valid_queries: 
@@ -264,15 +350,14 @@ def get_queries_from_domains(
 
     # Collect applicable domains and queries
     queries_2_run = {}
-    for path in query_dir.rglob('*.sql'):
-        query_name = path.stem
-        query_sql = path.read_text()
-        query_dialect = re.search("\-\- DIALECT: (.*?)\\n", query_sql).group(1)
-        query_domain = re.search("\-\- DOMAIN: (.*?)\\n", query_sql).group(1)
-        query_entity = re.search("\-\- ENTITY: (.*?)\\n", query_sql).group(1)
+    for entry in index_queries(query_dir):
+        query_name = entry["query_name"]
+        query_dialect = entry["dialect"]
+        query_domain = entry["domain"]
+        query_entity = entry["entity"]
         if query_dialect == dialect and query_entity == entity_id and query_domain in domains:
             queries_2_run[query_name] = {
-                'SQL': query_sql,
+                'SQL': Path(entry["path"]).read_text(),
                 'DIALECT': query_dialect,
                 'ENTITY': query_entity,
                 'DOMAIN': query_domain,
@@ -331,15 +416,14 @@ def get_queries(dialect=None, entity_id=None, queries=None, query_dir=None):
 
     # Collect queries
     queries_2_run = {}
-    for path in query_dir.rglob('*.sql'):
-        query_name = path.stem
-        query_sql = path.read_text()
-        query_dialect = re.search("\-\- DIALECT: (.*?)\\n", query_sql).group(1)
-        query_domain = re.search("\-\- DOMAIN: (.*?)\\n", query_sql).group(1)
-        query_entity = re.search("\-\- ENTITY: (.*?)\\n", query_sql).group(1)
+    for entry in index_queries(query_dir):
+        query_name = entry["query_name"]
+        query_dialect = entry["dialect"]
+        query_domain = entry["domain"]
+        query_entity = entry["entity"]
         if query_dialect == dialect and query_entity == entity_id and query_name in queries:
             queries_2_run[query_name] = {
-                'SQL': query_sql,
+                'SQL': Path(entry["path"]).read_text(),
                 'DIALECT': query_dialect,
                 'ENTITY': query_entity,
                 'DOMAIN': query_domain,
@@ -347,3 +431,59 @@ def get_queries(dialect=None, entity_id=None, queries=None, query_dir=None):
 
     # Return query dict
     return queries_2_run
+
+
+def resolve_features(features, queries):
+    """Maps requested features to the queries that produce them
+
+    Features are fully qualified `query_column` names or Unix shell-style
+    patterns, e.g. `teamGameStats_some_sum` or `teamGameStats_*`.
+
+    Args:
+        features (list): Features of interest
+        queries (list): Queries to choose from
+
+    Raises:
+        ValueError: Error for invalid feature
+
+    Returns:
+        dict: Dictionary of query_name: list of column patterns
+    """
+
+    # Match features to queries
+    query_features = {}
+    for feature in features:
+        prefixed = [q for q in queries if feature.startswith(q + "_")]
+        if len(prefixed) > 0:
+            query_name = max(prefixed, key=len)
+            matched = {query_name: feature[len(query_name) + 1:]}
+        else:
+            head, _, tail = feature.partition("_")
+            matched = {q: tail or "*" for q in queries if fnmatchcase(q, head)}
+        if len(matched) == 0:
+            raise ValueError(f"You have submitted an invalid feature: {feature}.")
+        for query_name, column in matched.items():
+            query_features.setdefault(query_name, []).append(column)
+
+    # Return query dict
+    return query_features
+
+
+def load_manifest(path):
+    """Loads a frozen production manifest
+
+    Args:
+        path (str): Manifest file or directory containing manifest.json
+
+    Raises:
+        ValueError: Error for missing manifest
+
+    Returns:
+        dict: Manifest with queries and features
+    """
+    path = Path(path)
+    if path.is_dir():
+        path = path.joinpath("manifest.json")
+    if path.is_file() is False:
+        raise ValueError(f"No manifest was found at {path}.")
+    return json.loads(path.read_text())
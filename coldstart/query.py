@@ -17,37 +17,478 @@
 # https://cloud.google.com/bigquery/docs/best-practices-performance-patterns
 # https://cloud.google.com/bigquery/docs/sessions-intro
 
+import os
 import re
+import json
+import time
+import hashlib
+import queue
 import shutil
+import threading
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 from pathlib import Path
-from datetime import datetime
-from tqdm.contrib.concurrent import thread_map
+from datetime import datetime, timedelta
+from contextlib import contextmanager, nullcontext
+from fnmatch import fnmatchcase
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from sqlalchemy import inspect
+from sqlalchemy.engine import Engine
+from tqdm.auto import tqdm
 
+from coldstart.dialects import get_dialect
+from coldstart.trace import Tracer
 
-def name_table(schema, query_name):
+
+class SessionEngine(object):
+
+    """Engine wrapper that runs every statement on one shared connection
+
+    Used for session-scoped temporary tables, which are only visible to the
+    connection (or BigQuery session) that created them. Statements from
+    concurrent workers are run one at a time on the shared connection, and
+    temporary tables vanish when the session is closed.
+    """
+
+    def __init__(self, engine, dialect=None):
+
+        self.engine = engine
+        self.dialect = engine.dialect
+        self.adapter = get_dialect(dialect or engine.dialect.name)
+        self.lock = threading.RLock()
+        self.connection = None
+
+    @contextmanager
+    def connect(self):
+        """Yields the shared connection, opening it on first use"""
+        with self.lock:
+            if self.connection is None:
+                self.connection = self.engine.connect()
+                self.adapter.start_session(self.connection)
+            yield self.connection
+
+    def close(self):
+        """Closes the shared connection, ending the session"""
+        with self.lock:
+            if self.connection is not None:
+                try:
+                    self.adapter.end_session(self.connection)
+                except Exception as e:
+                    print(e)
+                self.connection.close()
+                self.connection = None
+
+    def dispose(self):
+        """Closes the session and disposes the wrapped engine"""
+        self.close()
+        self.engine.dispose()
+
+
+class ConnectionEngine(object):
+
+    """Engine wrapper that runs every statement on one checked-out connection
+
+    Used by query workers, which check a connection out of the pool once and
+    reuse it across all of their statements instead of checking one out per
+    statement.
+    """
+
+    def __init__(self, connection):
+
+        self.connection = connection
+        self.dialect = connection.dialect
+
+    @contextmanager
+    def connect(self):
+        """Yields the checked-out connection"""
+        yield self.connection
+
+    def close(self):
+        """Returns the connection to the pool"""
+        self.connection.close()
+
+
+class RunCancelled(Exception):
+
+    """Raised by runs cancelled before they finished"""
+
+
+class QueryWatch(object):
+
+    """Statement watched by RunControl
+
+    Args:
+        engine (object): Engine the statement runs on. Statements on
+            engines holding a connection, e.g. ConnectionEngine or
+            SessionEngine, can be cancelled.
+        interval (float): Seconds between repeated cancels. Defaults to 0.1.
+    """
+
+    def __init__(self, engine, interval=0.1):
+
+        self.engine = engine
+        self.interval = interval
+        self.reason = None
+        self.done = threading.Event()
+
+    def interrupt(self, reason):
+        """Cancels the statement through the driver
+
+        Drivers ignore cancels arriving before the statement starts, so
+        the cancel is repeated until the watch ends.
+
+        Args:
+            reason (str): Recorded as the query's error
+        """
+        if self.reason is not None:
+            return
+        self.reason = reason
+        connection = getattr(self.engine, "connection", None)
+        if connection is None:
+            return
+        def cancel():
+            try:
+                get_dialect(self.engine.dialect.name).cancel(connection)
+            except Exception as e:
+                print("QUERY NOT CANCELLED: ", e)
+                return
+            while not self.done.wait(self.interval):
+                get_dialect(self.engine.dialect.name).cancel(connection)
+        threading.Thread(target=cancel, daemon=True).start()
+
+
+class RunControl(object):
+
+    """Timeouts and cancellation of a run's queries
+
+    Queries run by multi_query are watched while they run. A query running
+    longer than query_timeout is cancelled through the driver. Queries on a
+    SessionEngine are only watched while they hold the session, so time
+    spent queued for it does not count and cancels never reach statements
+    of other queries. Once the
+    run is cancelled, exceeds its deadline or, with fail_fast, any query
+    fails, every watched query is cancelled and queries not started yet are
+    skipped.
+
+    Args:
+        query_timeout (float): Seconds each query may run. Defaults to None.
+        timeout (float): Seconds the run may take from now. Defaults to None.
+        fail_fast (bool): Used for cancelling the run when any query fails.
+            Defaults to False.
+    """
+
+    def __init__(self, query_timeout=None, timeout=None, fail_fast=False):
+
+        self.lock = threading.Lock()
+        self.watches = set()
+        self.reason = None
+        self.error = None
+        self.start(query_timeout=query_timeout, timeout=timeout, fail_fast=fail_fast)
+
+    def start(self, query_timeout=None, timeout=None, fail_fast=False):
+        """Sets the timeouts, starting the deadline from now
+
+        Args:
+            query_timeout (float): Seconds each query may run.
+                Defaults to None.
+            timeout (float): Seconds the run may take from now.
+                Defaults to None.
+            fail_fast (bool): Used for cancelling the run when any query
+                fails. Defaults to False.
+        """
+        self.query_timeout = query_timeout
+        self.timeout = timeout
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        self.fail_fast = fail_fast
+
+    def cancel(self, reason="The run was cancelled.", error=RunCancelled):
+        """Cancels watched queries and skips queries not started yet
+
+        Args:
+            reason (str): Recorded as the error of cancelled queries.
+                Defaults to "The run was cancelled.".
+            error (type): Exception raised by check, or None if check
+                should not raise. Defaults to RunCancelled.
+        """
+        with self.lock:
+            if self.reason is not None:
+                return
+            self.reason, self.error = reason, error
+            watches = list(self.watches)
+        for watch in watches:
+            watch.interrupt(reason)
+
+    def cancelled(self):
+        """Returns whether the run was cancelled, checking its deadline"""
+        if self.reason is None and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel(f"The run exceeded its timeout of {self.timeout} seconds.", TimeoutError)
+        return self.reason is not None
+
+    def check(self):
+        """Raises if the run was cancelled or exceeded its deadline
+
+        Raises:
+            RunCancelled: Error for cancelled runs
+            TimeoutError: Error for runs exceeding their deadline
+        """
+        if self.cancelled() and self.error is not None:
+            raise self.error(self.reason)
+
+    def fail(self, query_name):
+        """Cancels the run for a failed query if fail_fast is set
+
+        Args:
+            query_name (str): Failed query
+        """
+        if self.fail_fast is True:
+            self.cancel(f"Cancelled after {query_name} failed.", None)
+
+    @contextmanager
+    def watch(self, engine):
+        """Watches a statement for the duration of the block
+
+        Args:
+            engine (object): Engine the statement runs on
+
+        Yields:
+            QueryWatch: Watch whose reason is set if the statement was
+                cancelled
+        """
+        watch = QueryWatch(engine)
+        seconds = [t for t in [self.query_timeout] if t is not None]
+        if self.deadline is not None:
+            seconds.append(max(self.deadline - time.monotonic(), 0))
+
+        # Cancel the statement once it runs out of time
+        def expire():
+            if not self.cancelled():
+                watch.interrupt(f"The query exceeded its timeout of {self.query_timeout} seconds.")
+        timer = None
+        if len(seconds) > 0:
+            timer = threading.Timer(min(seconds), expire)
+            timer.daemon = True
+            timer.start()
+        with self.lock:
+            self.watches.add(watch)
+            reason = self.reason
+        if reason is not None:
+            watch.interrupt(reason)
+        try:
+            yield watch
+        finally:
+            watch.done.set()
+            if timer is not None:
+                timer.cancel()
+            with self.lock:
+                self.watches.discard(watch)
+
+
+def default_workers():
+    """Returns the default number of query workers
+
+    Matches the ThreadPoolExecutor default of min(32, CPUs + 4).
+
+    Returns:
+        int: Number of workers
+    """
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+# Table timestamps are unique within a process so concurrent runs never
+# name the same table
+TABLE_TIME_LOCK = threading.Lock()
+LAST_TABLE_TIME = datetime.min
+
+
+def name_table(schema, query_name, temporary=False):
     """Names tables according to pattern
 
     Args:
         schema (str): Name of schema
         query_name (str): Name of query
+        temporary (bool): Used for naming session-scoped temporary tables,
+            which are not prefixed with schema. Defaults to False.
 
     Returns:
         str: Table name
     """    
-    NOW = datetime.now().strftime("%Y%m%d%H%M%S%f")
-    table_name = f"{schema}.coldstart_{query_name}_{NOW}_tmp"
+    global LAST_TABLE_TIME
+    with TABLE_TIME_LOCK:
+        now = max(datetime.now(), LAST_TABLE_TIME + timedelta(microseconds=1))
+        LAST_TABLE_TIME = now
+    NOW = now.strftime("%Y%m%d%H%M%S%f")
+    table_name = f"coldstart_{query_name}_{NOW}_tmp"
+    if temporary is False:
+        table_name = f"{schema}.{table_name}"
     return table_name
 
 
-def run_query(engine, sql, return_df=True):
+def parse_table_time(table_name):
+    """Parses creation time from tables named according to pattern
+
+    Args:
+        table_name (str): Table name, optionally prefixed with schema
+
+    Returns:
+        datetime: Creation time or None if the table does not match pattern
+    """
+    match = re.match(r"^coldstart_.+_(\d{20})_tmp$", table_name.split(".")[-1])
+    if match is None:
+        return None
+    return datetime.strptime(match.group(1), "%Y%m%d%H%M%S%f")
+
+
+def create_table_sql(table_name, table_ttl=None, temporary=False, replace=False, dialect=None):
+    """Prepares CREATE TABLE statement prefix
+
+    Args:
+        table_name (str): Table name
+        table_ttl (int): Hours until the table expires engine-side. If None,
+            the table does not expire. Defaults to None.
+        temporary (bool): Used for creating a session-scoped temporary
+            table. Defaults to False.
+        replace (bool): Used for replacing an existing table. Defaults to
+            False.
+        dialect (str): Dialect name or adapter. Defaults to None.
+
+    Returns:
+        str: CREATE TABLE ... AS
+    """
+    return get_dialect(dialect).create_table_sql(
+        table_name,
+        table_ttl=table_ttl,
+        temporary=temporary,
+        replace=replace
+    )
+
+
+# Warehouse data types mapped to Arrow types
+ARROW_TYPES = {
+    "INT64": pa.int64(),
+    "INT": pa.int64(),
+    "INTEGER": pa.int64(),
+    "SMALLINT": pa.int64(),
+    "BIGINT": pa.int64(),
+    "TINYINT": pa.int64(),
+    "BYTEINT": pa.int64(),
+    "FLOAT64": pa.float64(),
+    "FLOAT": pa.float64(),
+    "REAL": pa.float64(),
+    "DOUBLE": pa.float64(),
+    "BOOL": pa.bool_(),
+    "BOOLEAN": pa.bool_(),
+    "STRING": pa.string(),
+    "VARCHAR": pa.string(),
+    "TEXT": pa.string(),
+    "DATE": pa.date32(),
+    "DATETIME": pa.timestamp("us"),
+    "TIMESTAMP": pa.timestamp("us", tz="UTC"),
+    "BYTES": pa.binary(),
+}
+
+# Fixed-point warehouse data types, mapped to Arrow decimals of their
+# declared precision and scale
+DECIMAL_TYPES = ["NUMERIC", "BIGNUMERIC", "DECIMAL", "BIGDECIMAL"]
+
+# Arrow types mapped to pandas dtypes supporting pd.NA
+PANDAS_TYPES = {
+    pa.int64(): pd.Int64Dtype(),
+    pa.bool_(): pd.BooleanDtype(),
+    pa.string(): pd.StringDtype(),
+}
+
+
+def arrow_type(data_type):
+    """For mapping a warehouse data type to an Arrow type
+
+    Fixed-point types map to decimal128, or decimal256 beyond 38 digits,
+    of their declared precision and scale. Without one, None is returned
+    so the decimal type is inferred from the values.
+
+    Args:
+        data_type (str): Warehouse data type, e.g. INT64, STRING(10) or
+            NUMERIC(10, 2)
+
+    Returns:
+        DataType: Arrow type or None if the data type is not supported
+    """
+    if data_type is None or pd.isna(data_type):
+        return None
+    name, _, params = str(data_type).partition("(")
+    name = name.strip().upper()
+    if name in DECIMAL_TYPES:
+        match = re.fullmatch(r"\s*(\d+)\s*(?:,\s*(\d+)\s*)?\)\s*", params)
+        if match is None:
+            return None
+        precision, scale = int(match.group(1)), int(match.group(2) or 0)
+        if not 0 < precision <= 76 or scale > precision:
+            return None
+        return pa.decimal128(precision, scale) if precision <= 38 else pa.decimal256(precision, scale)
+    return ARROW_TYPES.get(name)
+
+
+def typed_frame(rows, columns, column_types, threshold=0.5):
+    """For building a dataframe from rows using warehouse data types
+
+    Columns are built directly as Arrow arrays of the mapped type, so
+    integer, boolean, date and string columns never pass through an object
+    dtype. String columns with a ratio of distinct values to rows below
+    threshold are dictionary encoded and returned as categoricals.
+
+    Args:
+        rows (list): Result rows
+        columns (list): Column names
+        column_types (dict): Column name: warehouse data type
+        threshold (float): Maximum ratio of distinct values to rows for
+            categorical conversion. Defaults to 0.5.
+
+    Returns:
+        DataFrame: Query results
+    """
+    arrays = []
+    values_list = list(zip(*rows)) if len(rows) > 0 else [()] * len(columns)
+    for name, values in zip(columns, values_list):
+        pa_type = arrow_type(column_types.get(name))
+        try:
+            if pa_type is None:
+                arr = pa.array(values)
+            else:
+                try:
+                    arr = pa.array(values, type=pa_type)
+                except (pa.ArrowInvalid, pa.ArrowTypeError):
+                    arr = pa.array(values).cast(pa_type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            arr = pa.array([str(v) if v is not None else None for v in values], type=pa.string())
+        if pa_type == pa.string() and len(arr) > 0:
+            encoded = arr.dictionary_encode()
+            if len(encoded.dictionary) / len(arr) < threshold:
+                arr = encoded
+        arrays.append(arr)
+    table = pa.Table.from_arrays(arrays, names=list(columns))
+    return table.to_pandas(types_mapper=PANDAS_TYPES.get, date_as_object=False)
+
+
+# Engine-side statistics collected per query
+QUERY_STATS = ["bytes_processed", "bytes_billed", "cpu_ms", "rows_written", "cache_hit"]
+
+
+def run_query(engine, sql, return_df=True, column_types=None, dialect=None, stats=None):
     """For running queries
 
     Args:
         engine (object): Engine object
         sql (str): SQL query
         return_df (bool): Will return dataframe. Defaults to True.
+        column_types (dict): Column name: warehouse data type used for
+            building typed columns. Defaults to None.
+        dialect (str): Dialect name or adapter. If the adapter can fetch
+            Arrow tables, results are returned through Arrow instead of
+            row tuples. Defaults to None.
+        stats (dict): If given, filled with engine-side statistics of the
+            statement (see QUERY_STATS) when return_df is False. Defaults
+            to None.
 
     Returns:
         DataFrame: Query results
@@ -55,62 +496,599 @@ def run_query(engine, sql, return_df=True):
     # TODO: Add retrying with tenacity
     with engine.connect() as connection:
         if return_df is False:
-            connection.execute(sql)
+            result = connection.execute(sql)
+            if stats is not None:
+                try:
+                    stats.update(get_dialect(dialect or engine.dialect.name).query_stats(result))
+                except Exception as e:
+                    print('STATS NOT CAPTURED: ', e)
         else:
+            if dialect is not None:
+                table = get_dialect(dialect).fetch_arrow(connection, sql)
+                if table is not None:
+                    return table.to_pandas(types_mapper=PANDAS_TYPES.get, date_as_object=False)
             result = connection.execute(sql)
-            df = pd.DataFrame(result.fetchall(), columns=result._metadata.keys)
+            if column_types is None:
+                df = pd.DataFrame(result.fetchall(), columns=result._metadata.keys)
+            else:
+                df = typed_frame(result.fetchall(), list(result._metadata.keys), column_types)
             return df
 
 
+def capture_schema(engine, table_name):
+    """For capturing the columns of a table right after it is created
+
+    Args:
+        engine (object): Engine object
+        table_name (str): Table name, optionally prefixed with schema
+
+    Returns:
+        list: Columns as dictionaries of column_name, data_type and
+            is_nullable
+    """
+
+    # Split schema
+    if "." in table_name:
+        schema, name = table_name.rsplit(".", 1)
+    else:
+        schema, name = None, table_name
+
+    # Inspect table
+    with engine.connect() as connection:
+        try:
+            columns = inspect(connection).get_columns(name, schema=schema)
+        except Exception:
+            columns = []
+
+        # Describe temporary tables the inspector cannot see
+        if len(columns) == 0:
+            result = connection.execute(f"SELECT * FROM {table_name} LIMIT 0")
+            columns = [
+                {"name": d[0], "type": d[1] if isinstance(d[1], str) else None}
+                for d in result.cursor.description
+            ]
+            result.close()
+
+    # Format columns
+    schema_list = []
+    for column in columns:
+        try:
+            data_type = None if column["type"] is None else str(column["type"])
+        except Exception:
+            data_type = None
+        schema_list.append({
+            "column_name": column["name"],
+            "data_type": data_type,
+            "is_nullable": "YES" if column.get("nullable", True) else "NO",
+        })
+    return schema_list
+
+
 def run_threaded_query(query_tuple):
     """Wrapper function for running concurrent queries via threading
 
+    If query_tuple includes a table_name, the columns of the table are
+    captured as soon as the query completes.
+
     Args:
-        query_tuple (tuple): query_name, engine, sql, return_df
+        query_tuple (tuple): query_name, engine, sql, return_df and
+            optionally table_name
 
     Returns:
-        tuple: Results: query_name, status, run_time
+        tuple: Results: query_name, status, run_time, meta
     """    
 
     # Unpack tuple
-    query_name, engine, sql, return_df = query_tuple
+    query_name, engine, sql, return_df, *table_name = query_tuple
+    meta = {}
 
     # Start timing
     time_start = datetime.now()
 
     # Execute query
     try:
-        run_query(engine=engine, sql=sql, return_df=return_df)
+        stats = {}
+        run_query(engine=engine, sql=sql, return_df=return_df, stats=stats)
+        meta["stats"] = stats
         status = 'SUCCESS'
         time_stop = datetime.now()
         run_time = (time_stop - time_start).seconds
-        return (query_name, status, run_time)
 
     except Exception as e:
         status = 'FAILURE'
         run_time = 0
         print(f'{query_name} FAILED: ', e)
-        return (query_name, status, run_time)
+        meta["error"] = str(e)
+        return (query_name, status, run_time, meta)
 
+    # Capture schema
+    if len(table_name) > 0 and table_name[0] is not None:
+        meta["table_name"] = table_name[0]
+        try:
+            meta["columns"] = capture_schema(engine=engine, table_name=table_name[0])
+        except Exception as e:
+            print(f'{query_name} SCHEMA NOT CAPTURED: ', e)
+
+    return (query_name, status, run_time, meta)
+
+
+def query_attributes(result):
+    """Formats a query result as span attributes
+
+    Args:
+        result (tuple): query_name, status, run_time and optionally meta
+
+    Returns:
+        dict: Span attributes
+    """
+    meta = result[3] if len(result) > 3 else {}
+    attributes = {
+        "coldstart.query_name": result[0],
+        "coldstart.status": result[1],
+        "coldstart.seconds": result[2],
+    }
+    for key in ["table_name", "pool_wait", "error"]:
+        if meta.get(key) is not None:
+            attributes[f"coldstart.{key}"] = meta[key]
+    if meta.get("columns") is not None:
+        attributes["coldstart.columns"] = len(meta["columns"])
+    for key, value in meta.get("stats", {}).items():
+        if value is not None:
+            attributes[f"coldstart.{key}"] = value
+    return attributes
+
+
+def results_frame(results, table_dict=None):
+    """For tabulating query results with their engine-side statistics
+
+    Args:
+        results (list): Results: query_name, status, run_time and
+            optionally meta
+        table_dict (dict): Query name: table name. Defaults to None.
+
+    Returns:
+        DataFrame: query_name, query_status, query_seconds, table_name,
+            pool_wait and one column per QUERY_STATS
+    """
+    cols = ["query_name", "query_status", "query_seconds"]
+    df = pd.DataFrame([r[:3] for r in results], columns=cols)
+    metas = [r[3] if len(r) > 3 else {} for r in results]
+    df["table_name"] = df["query_name"].replace(table_dict or {})
+    df["pool_wait"] = [m.get("pool_wait") for m in metas]
+    for key in QUERY_STATS:
+        df[key] = [m.get("stats", {}).get(key) for m in metas]
+    return df
+
+
+def most_expensive(results_df, n=10, by="bytes_billed"):
+    """For listing the most expensive queries of a run
+
+    Args:
+        results_df (DataFrame): Output of results_frame
+        n (int): Number of queries. Defaults to 10.
+        by (str): Statistic to rank by. If no query reports it, queries are
+            ranked by query_seconds. Defaults to "bytes_billed".
+
+    Returns:
+        DataFrame: Top n queries, most expensive first
+    """
+    if by not in results_df.columns or results_df[by].isna().all():
+        by = "query_seconds"
+    df = results_df[results_df[by].notna()]
+    df = df.assign(**{by: pd.to_numeric(df[by])})
+    return df.sort_values(by, ascending=False).head(n).reset_index(drop=True)
 
-def multi_query(query_tuples):
+
+def multi_query(query_tuples, max_workers=None, tracer=None, limiter=None, control=None):
     """For running concurrent queries via threading
 
+    Each worker checks one connection out of the engine's pool and reuses it
+    for all of its queries. The time spent waiting on the pool, and on the
+    limiter if one is given, is recorded in each result's meta as pool_wait.
+    Queries cancelled by control fail with cancelled in their meta.
+
     Args:
-        query_tuples (list): List of tuples: query_name, engine, sql, return_df
+        query_tuples (list): List of tuples: query_name, engine, sql,
+            return_df and optionally table_name
+        max_workers (int): Number of workers. If None, default_workers is
+            used. Defaults to None.
+        tracer (Tracer): Tracer receiving a coldstart.query span per
+            query. Defaults to None.
+        limiter (Semaphore): Held by each worker while it holds
+            connections, so concurrent calls sharing it run at most its
+            value of workers at once. Defaults to None.
+        control (RunControl): Timeouts and cancellation of the queries.
+            Defaults to None.
 
     Returns:
-        list: Results: query_name, status, run_time 
+        list: Results: query_name, status, run_time, meta
     """    
-    results = thread_map(run_threaded_query,
-                         query_tuples,
-                         miniters=1,
-                         total=len(query_tuples),
-                         desc='Query Progress')
+    control = control or RunControl()
+    n = len(query_tuples)
+    results = [None] * n
+    tasks = queue.Queue()
+    for task in enumerate(query_tuples):
+        tasks.put(task)
+    pbar = tqdm(total=n, miniters=1, desc='Query Progress')
+
+    # Run queries on one connection per worker
+    def work():
+        connections = {}
+        limit_wait = 0.0
+        if limiter is not None:
+            wait_start = time.perf_counter()
+            limiter.acquire()
+            limit_wait = time.perf_counter() - wait_start
+        try:
+            while True:
+                try:
+                    i, (query_name, engine, *args) = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                if control.cancelled():
+                    results[i] = (query_name, 'FAILURE', 0, {"error": control.reason, "cancelled": True, "skipped": True})
+                    pbar.update(1)
+                    continue
+                pool_wait, limit_wait = limit_wait, 0.0
+                if isinstance(engine, Engine):
+                    if id(engine) not in connections:
+                        wait_start = time.perf_counter()
+                        try:
+                            connections[id(engine)] = ConnectionEngine(engine.connect())
+                        except Exception as e:
+                            print(f'{query_name} FAILED: ', e)
+                            results[i] = (query_name, 'FAILURE', 0, {"error": str(e)})
+                            control.fail(query_name)
+                            pbar.update(1)
+                            continue
+                        pool_wait += time.perf_counter() - wait_start
+                    engine = connections[id(engine)]
+                with tracer.start_as_current_span("coldstart.query") as span:
+                    # Watch session statements only once they hold the session
+                    session = engine.connect() if isinstance(engine, SessionEngine) else nullcontext()
+                    with session, control.watch(engine) as watch:
+                        results[i] = run_threaded_query((query_name, engine, *args))
+                    if results[i][1] == 'FAILURE' and watch.reason is not None:
+                        results[i][3].update({"error": watch.reason, "cancelled": True})
+                    results[i][3]["pool_wait"] = round(pool_wait, 3)
+                    span.set_attributes(query_attributes(results[i]))
+                if results[i][1] == 'FAILURE':
+                    control.fail(query_name)
+                pbar.update(1)
+        finally:
+            for connection in connections.values():
+                connection.close()
+            if limiter is not None:
+                limiter.release()
+
+    # Run workers in the caller's context so spans nest under it
+    tracer = tracer or Tracer()
+    workers = max(1, min(max_workers or default_workers(), n))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(copy_context().run, work) for _ in range(workers)]
+        for future in futures:
+            future.result()
+    pbar.close()
     return results
 
 
-def stage_leftmost_table(engine, schema, leftmost_table, entity_id, dt1, dt2):
+def iter_query(engine, sql, batch_rows, column_types=None):
+    """For streaming query results in fixed-size chunks
+
+    Args:
+        engine (object): Engine object
+        sql (str): SQL query
+        batch_rows (int): Number of rows per chunk
+        column_types (dict): Column name: warehouse data type used for
+            building typed columns. Defaults to None.
+
+    Yields:
+        DataFrame: Query results chunk
+    """
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(sql)
+        columns = list(result.keys())
+        while True:
+            rows = result.fetchmany(batch_rows)
+            if len(rows) == 0:
+                break
+            if column_types is None:
+                yield pd.DataFrame(rows, columns=columns)
+            else:
+                yield typed_frame(rows, columns, column_types)
+
+
+def prefetch(iterable, depth=1):
+    """For prefetching items of an iterable on a background thread
+
+    The iterable is closed, if it can be, once it is exhausted, fails or
+    the consumer stops, so generators holding cursors release them.
+
+    Args:
+        iterable (iterable): Items to prefetch, e.g. DataFrame chunks
+        depth (int): Number of items fetched ahead. Defaults to 1.
+
+    Yields:
+        object: Items of iterable
+    """
+
+    # Fill queue in background
+    q = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        q.put((item, None), timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            q.put((done, None))
+        except Exception as e:
+            q.put((done, e))
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+
+    # Drain queue
+    try:
+        while True:
+            item, error = q.get()
+            if error is not None:
+                raise error
+            if item is done:
+                break
+            yield item
+    finally:
+        stop.set()
+
+
+def prep_partition_queries(
+    table,
+    n_partitions,
+    partition_by="hash",
+    row_count=None,
+    dialect=None
+):
+    """For preparing queries that read a table in partitions
+
+    Args:
+        table (str): Table to read
+        n_partitions (int): Number of partitions
+        partition_by (str): Either "hash" for splitting on a hash of idx or
+            "range" for splitting on ordered idx row ranges.
+            Defaults to "hash".
+        row_count (int): Number of rows in table. Required when partition_by
+            is "range". Defaults to None.
+        dialect (str): Dialect name or adapter. Defaults to None.
+
+    Raises:
+        ValueError: Error for invalid n_partitions
+        ValueError: Error for missing row_count
+        ValueError: Error for invalid partition_by
+
+    Returns:
+        list: Partition queries
+    """
+
+    # Check partitions
+    if n_partitions is None or n_partitions < 1:
+        raise ValueError("n_partitions must be a positive integer.")
+
+    # Split on idx hash
+    sql_list = []
+    if partition_by == "hash":
+        for i in range(n_partitions):
+            sql = f"""
+            SELECT *
+            FROM {table}
+            WHERE {get_dialect(dialect).hash_partition_sql("idx", n_partitions, i)}
+            """
+            sql_list.append(sql)
+
+    # Split on idx row ranges
+    elif partition_by == "range":
+        if row_count is None:
+            raise ValueError("row_count needs to be specified for range partitions.")
+        size = max(-(-row_count // n_partitions), 1)
+        for start in range(0, max(row_count, 1), size):
+            sql = f"""
+            SELECT *
+            FROM {table}
+            ORDER BY idx
+            LIMIT {size} OFFSET {start}
+            """
+            sql_list.append(sql)
+    else:
+        raise ValueError("partition_by must be either 'hash' or 'range'.")
+
+    return sql_list
+
+
+def read_partition(engine, sql, meta, column_types=None):
+    """For fetching one partition of a lazy dataframe
+
+    Dtypes that depend on the rows fetched, e.g. categoricals or columns
+    without a warehouse data type, are cast to those of meta.
+
+    Args:
+        engine (object): Engine object
+        sql (str): SQL query of the partition
+        meta (DataFrame): Empty frame with the dtypes of the dataframe
+        column_types (dict): Column name: warehouse data type used for
+            building typed columns. Defaults to None.
+
+    Returns:
+        DataFrame: Partition
+    """
+    df = run_query(engine=engine, sql=sql, return_df=True, column_types=column_types)
+    return df.astype(meta.dtypes.to_dict())
+
+
+def lazy_dataframe(
+    engine,
+    table,
+    n_partitions,
+    partition_by="hash",
+    column_types=None,
+    dialect=None
+):
+    """For reading a table as a lazy, partitioned Dask dataframe
+
+    Partitions are only fetched when the dataframe is computed, at which
+    point Dask's scheduler fetches them in parallel.
+
+    Args:
+        engine (object): Engine object
+        table (str): Table to read
+        n_partitions (int): Number of partitions
+        partition_by (str): Either "hash" or "range". Defaults to "hash".
+        column_types (dict): Column name: warehouse data type used for
+            building typed columns. Defaults to None.
+        dialect (str): Dialect name or adapter. Defaults to None.
+
+    Raises:
+        ImportError: Error for missing dask
+
+    Returns:
+        DataFrame: Dask dataframe
+    """
+
+    # Import dask
+    try:
+        import dask.dataframe as dd
+        from dask import delayed
+    except ImportError:
+        raise ImportError("dask is required when compute_df is False. Install with `pip install coldstart[dask]`.")
+
+    # Collect empty frame for column names and dtypes, sampling a row for
+    # columns without a warehouse data type
+    column_types = column_types or {}
+    sql = f"""
+    SELECT *
+    FROM {table}
+    LIMIT 1
+    """
+    meta = run_query(engine=engine, sql=sql, return_df=True, column_types=column_types).iloc[:0]
+
+    # Collect row count for range partitions
+    row_count = None
+    if partition_by == "range":
+        sql = f"""
+        SELECT COUNT(*) AS n
+        FROM {table}
+        """
+        row_count = int(run_query(engine=engine, sql=sql, return_df=True)["n"].iloc[0])
+
+    # Prep delayed partitions
+    sql_list = prep_partition_queries(
+        table=table,
+        n_partitions=n_partitions,
+        partition_by=partition_by,
+        row_count=row_count,
+        dialect=dialect
+    )
+    parts = [
+        delayed(read_partition)(engine=engine, sql=sql, meta=meta, column_types=column_types)
+        for sql in sql_list
+    ]
+
+    return dd.from_delayed(parts, meta=meta)
+
+
+def prep_stage_sql(leftmost_table, entity_id, dt1=None, dt2=None, dialect=None):
+    """Prepares the SELECT that adds idx to the leftmost table
+
+    Args:
+        leftmost_table (str): User defined leftmost table
+        entity_id (str): entity_id of interst
+        dt1 (str): min_date. If None, the min_date column is used.
+            Defaults to None.
+        dt2 (str): max_date. If None, the max_date column is used.
+            Defaults to None.
+        dialect (str): Dialect name or adapter. Defaults to None.
+
+    Returns:
+        str: SQL query
+    """
+    dialect = get_dialect(dialect)
+    dt1_expr = "LT.min_date" if dt1 is None else f"'{dt1}'"
+    dt2_expr = "LT.max_date" if dt2 is None else f"'{dt2}'"
+    idx_sql = dialect.idx_sql(f"LT.{entity_id}", dt1_expr, dt2_expr)
+    sql = f"""
+        SELECT
+            {idx_sql} AS idx,
+            LT.{entity_id},
+            LT.y,
+            {dialect.cast_date(dt1_expr)} AS min_date,
+            {dialect.cast_date(dt2_expr)} AS max_date
+        FROM
+            {leftmost_table} AS LT
+        """
+    return sql
+
+
+def prep_lookup_sql(entity_id, entity_ids, dt1, dt2, dialect=None):
+    """Prepares the staging SELECT for entity ids inlined as values
+
+    Args:
+        entity_id (str): entity_id of interst
+        entity_ids (list): Entity ids to look up
+        dt1 (str): min_date
+        dt2 (str): max_date
+        dialect (str): Dialect name or adapter. Defaults to None.
+
+    Returns:
+        str: SQL query with the same columns as the staged leftmost table
+    """
+    dialect = get_dialect(dialect)
+    values_sql = dialect.values_sql(entity_id, list(entity_ids))
+    leftmost_table = f"(SELECT E.{entity_id}, NULL AS y FROM ({values_sql}) AS E)"
+    return prep_stage_sql(leftmost_table, entity_id, dt1, dt2, dialect=dialect)
+
+
+def prep_delta_sql(stage_sql, feature_table):
+    """Prepares the staging SELECT limited to rows missing from a feature table
+
+    Args:
+        stage_sql (str): Staging SELECT
+        feature_table (str): Existing feature table
+
+    Returns:
+        str: SQL query
+    """
+    sql = f"""
+        SELECT S.*
+        FROM ({stage_sql}) AS S
+        WHERE NOT EXISTS (
+            SELECT 1
+            FROM {feature_table} AS F
+            WHERE F.idx = S.idx
+        )
+        """
+    return sql
+
+
+def stage_leftmost_table(
+    engine,
+    schema,
+    leftmost_table,
+    entity_id,
+    dt1,
+    dt2,
+    table_ttl=None,
+    temporary=False,
+    dialect=None,
+    exclude_table=None
+):
     """Stages leftmost table to include idx while performing data validation
 
     Args:
@@ -121,6 +1099,13 @@ def stage_leftmost_table(engine, schema, leftmost_table, entity_id, dt1, dt2):
         entity_id (str): entity_id of interst
         dt1 (str): min_date
         dt2 (str): max_date
+        table_ttl (int): Hours until the staged table expires engine-side.
+            Defaults to None.
+        temporary (bool): Used for staging a session-scoped temporary
+            table. Defaults to False.
+        dialect (str): Dialect name or adapter. Defaults to None.
+        exclude_table (str): Feature table whose idx values are left out
+            of the staged table. Defaults to None.
 
     Raises:
         ValueError: Error for invalid entity_id column
@@ -130,7 +1115,8 @@ def stage_leftmost_table(engine, schema, leftmost_table, entity_id, dt1, dt2):
         ValueError: Error for invalid date format
 
     Returns:
-        str, tuple: Staged table name, Results: query_name, status, run_time
+        str, tuple: Staged table name, Results: query_name, status, run_time,
+            meta
     """
 
     # Start timing
@@ -175,68 +1161,58 @@ def stage_leftmost_table(engine, schema, leftmost_table, entity_id, dt1, dt2):
 
     # Create idx table
     query_name = "leftMostTable"
-    staged_table = name_table(schema=schema, query_name=query_name)
+    staged_table = name_table(schema=schema, query_name=query_name, temporary=temporary)
+    create_sql = create_table_sql(
+        staged_table,
+        table_ttl=table_ttl,
+        temporary=temporary,
+        dialect=dialect
+    )
     if date_flag == 1:
-        sql = f"""
-        CREATE TABLE {staged_table}
-        AS
-        SELECT
-            CONCAT(
-                CAST(LT.{entity_id} AS STRING),
-                '_',
-                CAST('{dt1}' AS STRING),
-                '_',
-                CAST('{dt2}' AS STRING)
-            ) AS idx,
-            LT.{entity_id},
-            LT.y,
-            CAST('{dt1}' AS DATE) AS min_date,
-            CAST('{dt2}' AS DATE) AS max_date
-        FROM
-            {leftmost_table} AS LT
-        """
-    elif date_flag ==2:
-        sql = f"""
-        CREATE TABLE {staged_table}
-        AS
-        SELECT
-            CONCAT(
-                CAST(LT.{entity_id} AS STRING),
-                '_',
-                CAST(LT.{dt1} AS STRING),
-                '_',
-                CAST(LT.{dt2} AS STRING)
-            ) AS idx,
-            LT.{entity_id},
-            LT.y,
-            CAST(LT.{dt1} AS DATE) AS min_date,
-            CAST(LT.{dt2} AS DATE) AS max_date
-        FROM
-            {leftmost_table} AS LT
-        """
+        stage_sql = prep_stage_sql(leftmost_table, entity_id, dt1, dt2, dialect=dialect)
+    elif date_flag == 2:
+        stage_sql = prep_stage_sql(leftmost_table, entity_id, None, None, dialect=dialect)
+    if exclude_table is not None:
+        stage_sql = prep_delta_sql(stage_sql, exclude_table)
+    sql = create_sql + stage_sql
     
     # Execute query
+    meta = {"stats": {}}
     try:
-        df = run_query(engine=engine, sql=sql, return_df=False)
+        run_query(engine=engine, sql=sql, return_df=False, dialect=dialect, stats=meta["stats"])
         status = 'SUCCESS'
     except Exception as e:
+        status = 'FAILURE'
         print(e)
 
     # Stop timing
     time_stop = datetime.now()
     run_time = (time_stop - time_start).seconds
 
+    # Capture schema
+    if status == 'SUCCESS':
+        meta["table_name"] = staged_table
+        try:
+            meta["columns"] = capture_schema(engine=engine, table_name=staged_table)
+        except Exception as e:
+            print(f'{query_name} SCHEMA NOT CAPTURED: ', e)
+
     # Return results
-    return staged_table, (query_name, status, run_time)
+    return staged_table, (query_name, status, run_time, meta)
 
 
-def freeze_queries(query_dir, export_dir, query_dict):
+def freeze_queries(query_dir, export_dir, query_dict, features=None):
     """Instruction to save queries to specified directory
 
+    If features are specified, a manifest.json carrying the queries and
+    features is also written so production runs can be projected the same
+    way.
+
     Args:
         query_dir (str): Directory to copy feature queries from
         export_dir (str): Directory to export feature queries to
         query_dict (dict): Untemplated feature queries to freeze
+        features (list): Features of interest. Defaults to None.
     """
 
     # Check if directory exists
@@ -260,8 +1236,21 @@ def freeze_queries(query_dir, export_dir, query_dict):
         if query_name in queries_to_copy:
             shutil.copy(path, f"{export_dir}/{query_name}.sql")
 
-
-def template_queries(engine, schema, staged_table, query_dict):
+    # Write manifest
+    if features is not None:
+        manifest = {"queries": sorted(queries_to_copy), "features": list(features)}
+        Path(export_dir).joinpath("manifest.json").write_text(json.dumps(manifest, indent=4))
+
+
+def template_queries(
+    engine,
+    schema,
+    staged_table,
+    query_dict,
+    table_ttl=None,
+    temporary=False,
+    dialect=None
+):
     """Templates queries with LEFTMOST_TABLE
 
     Args:
@@ -269,6 +1258,11 @@ def template_queries(engine, schema, staged_table, query_dict):
         schema (str): schema of interest
         staged_table (str): Name of staged leftmost tables
         query_dict (dict): Queries to template 
+        table_ttl (int): Hours until intermediate tables expire engine-side.
+            Defaults to None.
+        temporary (bool): Used for creating session-scoped temporary tables.
+            Defaults to False.
+        dialect (str): Dialect name or adapter. Defaults to None.
 
     Returns:
         dict, list: Dictionary of query_name: table_name, list of tamplated
@@ -282,23 +1276,29 @@ def template_queries(engine, schema, staged_table, query_dict):
 
         # Parse dictionary and name tables
         query_name = k
-        table_name = name_table(schema=schema, query_name=query_name)
+        table_name = name_table(schema=schema, query_name=query_name, temporary=temporary)
         raw_sql = query_dict[k]['SQL']
 
         # Base templating
-        base_sql = f'CREATE TABLE {table_name} AS '
+        base_sql = create_table_sql(
+            table_name,
+            table_ttl=table_ttl,
+            temporary=temporary,
+            dialect=dialect
+        )
         full_sql = base_sql + raw_sql
 
         # Parameterized templating
         templated_sql = full_sql.format(LEFTMOST_TABLE=staged_table)
 
         # Append query list and table dictionary
-        # HINT: name, sql, return_df
+        # HINT: name, engine, sql, return_df, table_name
         query_tuple = (
             query_name,
             engine,
             templated_sql,
-            True,
+            False,
+            table_name,
         )
         query_list.append(query_tuple)
         table_dict[query_name] = table_name
@@ -306,32 +1306,146 @@ def template_queries(engine, schema, staged_table, query_dict):
     return table_dict, query_list
 
 
-def collect_metadata(engine, schema, table_list):
+def sql_hash(sql):
+    """Hashes SQL independently of whitespace
+
+    Args:
+        sql (str): SQL
+
+    Returns:
+        str: Hash
+    """
+    return hashlib.sha256(" ".join(sql.split()).encode("utf-8")).hexdigest()
+
+
+def read_run_manifest(path):
+    """Reads a run manifest
+
+    Args:
+        path (str): Manifest file
+
+    Returns:
+        dict: Manifest or None if the file does not exist
+    """
+    path = Path(path)
+    if not path.is_file():
+        return None
+    return json.loads(path.read_text())
+
+
+def write_run_manifest(path, manifest):
+    """Writes a run manifest atomically, so a run interrupted while writing
+    leaves the previous manifest intact
+
+    Args:
+        path (str): Manifest file
+        manifest (dict): Manifest
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=4, default=str))
+    os.replace(tmp_path, path)
+
+
+def resume_queries(manifest, query_tuples, query_hashes, engine, schema, dialect=None):
+    """For reusing tables created by an earlier attempt of a run
+
+    A query is reused if the manifest records the same SQL hash for it, it
+    did not fail and its table still exists. Queries still pending when the
+    attempt stopped are reused too, since their tables only exist once they
+    completed.
+
+    Args:
+        manifest (dict): Manifest of the earlier attempt
+        query_tuples (list): Templated queries: query_name, engine, sql,
+            return_df and table_name
+        query_hashes (dict): Query name: SQL hash
+        engine (object): Engine object
+        schema (str): schema of interest
+        dialect (str): Dialect name or adapter. Defaults to None.
+
+    Returns:
+        list, list: Query tuples still to run, Results of reused queries:
+            query_name, status, run_time, meta
+    """
+
+    # Match queries
+    candidates = {}
+    for query_tuple in query_tuples:
+        entry = manifest.get("queries", {}).get(query_tuple[0])
+        if entry is None or entry.get("table_name") is None:
+            continue
+        if entry["status"] != "FAILURE" and entry["sql_hash"] == query_hashes[query_tuple[0]]:
+            candidates[query_tuple[0]] = entry["table_name"]
+    if len(candidates) == 0:
+        return query_tuples, []
+
+    # Check which tables exist
+    table_df = collect_metadata(
+        engine=engine,
+        schema=schema,
+        table_list=list(candidates.values()),
+        dialect=dialect
+    )
+    table_df["name"] = table_df["table_name"].str.split(".").str[-1]
+    columns = {
+        name: df[["column_name", "data_type", "is_nullable"]].to_dict("records")
+        for name, df in table_df.groupby("name")
+    }
+
+    # Split queries
+    remaining, results = [], []
+    for query_tuple in query_tuples:
+        table_name = candidates.get(query_tuple[0])
+        name = None if table_name is None else table_name.split(".")[-1]
+        if name in columns:
+            meta = {"table_name": table_name, "columns": columns[name], "resumed": True}
+            results.append((query_tuple[0], "SUCCESS", 0, meta))
+        else:
+            remaining.append(query_tuple)
+    return remaining, results
+
+
+def collect_captured_metadata(results):
+    """For collecting metadata captured while feature queries ran
+
+    Args:
+        results (list): Results: query_name, status, run_time, meta
+
+    Returns:
+        DataFrame: table_name, column_name, data_type and is_nullable, or
+            None if any successful query is missing its captured schema
+    """
+    rows = []
+    for result in results:
+        if result[1] != 'SUCCESS':
+            continue
+        meta = result[3] if len(result) > 3 else {}
+        if "columns" not in meta or len(meta["columns"]) == 0:
+            return None
+        for column in meta["columns"]:
+            rows.append({"table_name": meta["table_name"], **column})
+    cols = ["table_name", "column_name", "data_type", "is_nullable"]
+    return pd.DataFrame(rows, columns=cols)
+
+
+def collect_metadata(engine, schema, table_list, dialect=None):
     """For collecting successful feature query metadata
 
     Args:
         engine (object): Engine object
         schema (str): schema of interest
         table_list (list): Table names of successful feature queries
+        dialect (str): Dialect name or adapter. Defaults to None.
 
     Returns:
-        DataFrame: table_name and column_name
+        DataFrame: table_name, column_name, data_type and is_nullable
     """    
     
-    # Split tables
-    to_insert = ["'"+t.split(".")[1]+"'" for t in table_list]
-    to_insert_str = ", ".join(str(x) for x in to_insert)
-    
-    # Format query
-    sql = f"""
-    SELECT
-        CONCAT(table_schema, '.', table_name) AS table_name,
-        column_name
-    FROM
-        {schema}.INFORMATION_SCHEMA.COLUMN_FIELD_PATHS
-    WHERE
-        table_name IN ({to_insert_str})
-    """
+    # Split tables and format query
+    table_names = [t.split(".")[-1] for t in table_list]
+    sql = get_dialect(dialect).metadata_sql(schema, table_names)
     
     # Execute query
     try:
@@ -343,13 +1457,89 @@ def collect_metadata(engine, schema, table_list):
     return df
 
 
-def prep_join_query(schema, table_df, feature_table=None):
+def describe_table(engine, schema, table_name, dialect=None):
+    """For collecting the columns of a table that may not exist
+
+    Args:
+        engine (object): Engine object
+        schema (str): schema used if table_name is not qualified
+        table_name (str): Table name, optionally prefixed with schema
+        dialect (str): Dialect name or adapter. Defaults to None.
+
+    Returns:
+        DataFrame: table_name, column_name, data_type and is_nullable, or
+            None if the table does not exist
+    """
+    table_schema, _, name = table_name.rpartition(".")
+    sql = get_dialect(dialect).metadata_sql(table_schema or schema, [name])
+    df = run_query(engine=engine, sql=sql, return_df=True)
+    return df if len(df) > 0 else None
+
+
+def prep_append_queries(feature_table, feature_df, delta_table, delta_df, dialect=None):
+    """For appending new rows to an existing feature table
+
+    Columns the feature table lacks are added first and are null for its
+    earlier rows. Columns the new rows lack are left null. The statements
+    are not run in a transaction, as warehouses commit ALTER TABLE on its
+    own, so added columns stay if the INSERT fails.
+
+    Args:
+        feature_table (str): Existing feature table
+        feature_df (DataFrame): Containing column_name of feature_table
+        delta_table (str): Table holding the new rows
+        delta_df (DataFrame): Containing column_name and data_type of
+            delta_table
+        dialect (str): Dialect name or adapter. Defaults to None.
+
+    Returns:
+        list: SQL statements to run in order
+    """
+    dialect = get_dialect(dialect)
+    existing = set(feature_df["column_name"])
+    data_types = delta_df["data_type"] if "data_type" in delta_df.columns else [None] * len(delta_df)
+    sql_list = [
+        dialect.add_column_sql(feature_table, column_name, data_type)
+        for column_name, data_type in zip(delta_df["column_name"], data_types)
+        if column_name not in existing
+    ]
+    cols = ", ".join(delta_df["column_name"])
+    sql_list.append(f"INSERT INTO {feature_table} ({cols}) SELECT {cols} FROM {delta_table}")
+    return sql_list
+
+
+def match_features(column_name, features):
+    """For checking whether a final column is a feature of interest
+
+    Args:
+        column_name (str): Final column name, i.e. query_column
+        features (list): Feature names or patterns. If None, every column
+            matches.
+
+    Returns:
+        bool: Whether the column matches
+    """
+    if features is None:
+        return True
+    return any(fnmatchcase(column_name, f) for f in features)
+
+
+def prep_join_query(
+    schema,
+    table_df,
+    feature_table=None,
+    features=None,
+    dialect=None
+):
     """For preparing final join query
 
     Args:
         schema (str): schema of interest
         table_df (DataFrame): Containing table_name and column_name
         feature_table (str): Specified name of final table. Defaults to None.
+        features (list): Feature names or patterns to select. If None, all
+            columns are selected. Defaults to None.
+        dialect (str): Dialect name or adapter. Defaults to None.
 
     Returns:
         str, str: Join SQL, Name of final table
@@ -360,7 +1550,7 @@ def prep_join_query(schema, table_df, feature_table=None):
         join_table = name_table(schema=schema, query_name="final")
     else:
         join_table = feature_table
-    base_sql = f"CREATE OR REPLACE TABLE {join_table} AS "
+    base_sql = create_table_sql(join_table, replace=True, dialect=dialect)
 
     # Leftmost templating
     left_df = table_df[table_df['table_name'].str.contains('left')]
@@ -377,9 +1567,9 @@ def prep_join_query(schema, table_df, feature_table=None):
         query_name = table_name.split('_')[-3]
         old_col_name = row['column_name']
         new_col_name = f'{query_name}_{old_col_name}'
-        if table_name not in join_dict:
-            join_dict[table_name] = query_name
-        if old_col_name != 'idx':
+        if old_col_name != 'idx' and match_features(new_col_name, features):
+            if table_name not in join_dict:
+                join_dict[table_name] = query_name
             select_sql += f', {query_name}.{old_col_name} AS {new_col_name}'
 
     for table, alias in join_dict.items():
@@ -392,12 +1582,50 @@ def prep_join_query(schema, table_df, feature_table=None):
     return full_sql, join_table
 
 
-def drop_tables(engine, table_list):
+def prep_join_schema(table_df, features=None):
+    """For preparing final table data types
+
+    Args:
+        table_df (DataFrame): Containing table_name, column_name and
+            optionally data_type
+        features (list): Feature names or patterns to select. If None, all
+            columns are selected. Defaults to None.
+
+    Returns:
+        dict: Final column name: warehouse data type
+    """
+
+    # Collect data types
+    if 'data_type' in table_df.columns:
+        data_types = [None if pd.isna(x) else x for x in table_df['data_type']]
+    else:
+        data_types = [None] * len(table_df)
+    rows = zip(table_df['table_name'], table_df['column_name'], data_types)
+
+    # Leftmost and feature data types
+    column_types = {}
+    for table_name, column_name, data_type in rows:
+        if 'left' in table_name:
+            if column_name == 'idx' or column_name.lower() == 'y':
+                column_types[column_name] = data_type
+        elif column_name != 'idx':
+            query_name = table_name.split('_')[-3]
+            new_col_name = f"{query_name}_{column_name}"
+            if match_features(new_col_name, features):
+                column_types[new_col_name] = data_type
+
+    return column_types
+
+
+def drop_tables(engine, table_list, dialect=None, limiter=None):
     """For dropping intermediate tables
 
     Args:
         engine (object): Engine object
         table_list (list): Tables to drop
+        dialect (str): Dialect name or adapter. Defaults to None.
+        limiter (Semaphore): Limits workers as in multi_query.
+            Defaults to None.
 
     Returns:
         list: Results: query_name, status, run_time 
@@ -406,7 +1634,7 @@ def drop_tables(engine, table_list):
     # Drop intermediate tables
     query_list = []
     for table in table_list:
-        sql = f'DROP TABLE IF EXISTS {table}'
+        sql = get_dialect(dialect).drop_table_sql(table)
         query_tuple = (
             table,
             engine,
@@ -416,15 +1644,30 @@ def drop_tables(engine, table_list):
         query_list.append(query_tuple)
 
     # Execute queries
-    results = multi_query(query_list)
+    results = multi_query(query_list, limiter=limiter)
     return results
 
 
-def convert_categorical(s):
+def count_unique(s):
+    """For counting distinct values with vectorized hashing
+
+    Args:
+        s (Series): To count distinct values of
+
+    Returns:
+        int: Number of distinct values, counting nulls as one value
+    """
+    hashes = pd.util.hash_array(s.to_numpy(dtype=object, na_value=None), categorize=False)
+    return len(pd.unique(hashes))
+
+
+def convert_categorical(s, threshold=0.5):
     """For attempting categorical conversion
 
     Args:
         s (Series): To attempt categorical conversion on
+        threshold (float): Maximum ratio of distinct values to rows.
+            Defaults to 0.5.
 
     Returns:
         Series: Converted to categorical data type
@@ -433,35 +1676,160 @@ def convert_categorical(s):
     # Convert strings/objects to categoricals if criteria is met
     string_types = [np.dtype('object'), np.dtype('O')]
     dt_col_names = ['date', 'time', 'dt', 'period']
-    dt_check = any(x in s.name for x in dt_col_names)
+    dt_check = any(x in str(s.name) for x in dt_col_names)
     if (s.dtype in string_types or pd.api.types.is_string_dtype(s)) \
-        and (s.nunique() / len(s)) < 0.5 and dt_check is False:
+        and len(s) > 0 and (count_unique(s) / len(s)) < threshold and dt_check is False:
         s = s.astype('category')
     return s
 
 
-def attempt_downcast(df):
+def downcast_integer(s):
+    """For narrowing integers to the smallest fitting width
+
+    Args:
+        s (Series): Integer series, either NumPy or nullable
+
+    Returns:
+        Series: Narrowed series
+    """
+    if s.count() == 0:
+        return s
+    lo, hi = s.min(), s.max()
+    nullable = pd.api.types.is_extension_array_dtype(s)
+    for dtype in [np.int8, np.int16, np.int32, np.int64]:
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            if np.dtype(dtype) == s.dtype:
+                return s
+            return s.astype(pd.api.types.pandas_dtype(np.dtype(dtype).name.capitalize()) if nullable else dtype)
+    return s
+
+
+def downcast_float(s, float_tolerance):
+    """For casting floats to float32 if within tolerance
+
+    Args:
+        s (Series): Float series
+        float_tolerance (float): Maximum relative error allowed
+
+    Returns:
+        Series: float32 series if within tolerance, otherwise s
+    """
+    nullable = pd.api.types.is_extension_array_dtype(s)
+    x = s.to_numpy(dtype=np.float64, na_value=np.nan)
+    x32 = x.astype(np.float32)
+    if np.allclose(x32, x, rtol=float_tolerance, atol=0, equal_nan=True):
+        return s.astype("Float32" if nullable else np.float32)
+    return s
+
+
+def downcast_series(s, float_tolerance=None, threshold=0.5):
+    """For downcasting a single series
+
+    Args:
+        s (Series): To downcast
+        float_tolerance (float): Maximum relative error allowed when casting
+            floats to float32. If None, floats are not cast. Defaults to None.
+        threshold (float): Maximum ratio of distinct values to rows for
+            categorical conversion. Defaults to 0.5.
+
+    Returns:
+        Series: Downcasted series
+    """
+
+    # Infer best possible dtype for objects
+    if s.dtype == np.dtype('O'):
+        inferred = pd.api.types.infer_dtype(s, skipna=True)
+        if inferred in ['integer', 'floating', 'mixed-integer-float', 'boolean', 'decimal']:
+            s = s.convert_dtypes()
+        elif inferred == 'string':
+            s = convert_categorical(s, threshold=threshold)
+
+    # Narrow numeric widths
+    if pd.api.types.is_bool_dtype(s):
+        return s
+    if pd.api.types.is_integer_dtype(s):
+        return downcast_integer(s)
+    if pd.api.types.is_float_dtype(s) and float_tolerance is not None:
+        return downcast_float(s, float_tolerance)
+    if pd.api.types.is_string_dtype(s) and not isinstance(s.dtype, pd.CategoricalDtype):
+        return convert_categorical(s, threshold=threshold)
+    return s
+
+
+def downcast_dataframe(df, float_tolerance=None, threshold=0.5, max_workers=None):
+    """For downcasting dataframe columns in place
+
+    Columns are converted one at a time across a thread pool and replaced
+    in df as they complete, so the frame is never copied as a whole.
+
+    Args:
+        df (DataFrame): To downcast
+        float_tolerance (float): Maximum relative error allowed when casting
+            floats to float32. If None, floats are not cast. Defaults to None.
+        threshold (float): Maximum ratio of distinct values to rows for
+            categorical conversion. Defaults to 0.5.
+        max_workers (int): Number of threads. Defaults to None.
+
+    Returns:
+        DataFrame, DataFrame: Downcasted dataframe, per-column memory report
+    """
+
+    # Collect memory before
+    before = df.memory_usage(deep=True, index=False)
+    dtypes = df.dtypes.astype(str)
+
+    # Downcast columns concurrently
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                downcast_series,
+                df.iloc[:, i],
+                float_tolerance=float_tolerance,
+                threshold=threshold
+            ): i
+            for i in range(df.shape[1])
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                s = future.result()
+            except Exception as e:
+                print(f'{df.columns[i]} NOT DOWNCASTED: ', e)
+                continue
+            if s.dtype != df.dtypes.iloc[i]:
+                df[df.columns[i]] = s
+
+    # Collect memory after
+    report = pd.DataFrame({
+        "column_name": df.columns,
+        "dtype_before": dtypes.values,
+        "dtype_after": df.dtypes.astype(str).values,
+        "bytes_before": before.values,
+        "bytes_after": df.memory_usage(deep=True, index=False).values,
+    })
+
+    return df, report
+
+
+def attempt_downcast(df, float_tolerance=None):
     """For attempting data type downcasting
 
     Args:
-        df (DataFrame): To attempt downcasting on
+        df (DataFrame): To attempt downcasting on. Columns are replaced
+            in place.
+        float_tolerance (float): Maximum relative error allowed when casting
+            floats to float32. If None, floats are not cast. Defaults to None.
 
     Returns:
         DataFrame: Downcasted dataframe
     """
-    
-    # Calculate reduction in MB
-    a = df.memory_usage().sum()
 
     try:
-        # Convert columns to best possible dtypes using dtypes supporting pd.NA
-        df = df.copy(deep=True).convert_dtypes()
-
-        # Convert strings/objects to categoricals if criteria is met
-        df = df.copy(deep=True).apply(convert_categorical)
+        df, report = downcast_dataframe(df, float_tolerance=float_tolerance)
 
         # Calculate reduction in MB
-        b = df.memory_usage().sum()
+        a, b = report["bytes_before"].sum(), report["bytes_after"].sum()
         pct_reduction = np.abs(np.round(((a - b) / a) * 100, 2))
         print(f'DataFrame memory reduction: {pct_reduction}%')
 
@@ -469,3 +1837,67 @@ def attempt_downcast(df):
         print(e)
 
     return df
+
+
+def list_orphaned_tables(engine, schema, older_than):
+    """For listing coldstart tables older than a cutoff
+
+    Tables are matched on the name_table pattern and aged on the creation
+    time encoded in their names. Final tables named by prep_join_query are
+    run outputs, not orphans, and are never listed.
+
+    Args:
+        engine (object): Engine object
+        schema (str): schema of interest
+        older_than (timedelta): Minimum table age
+
+    Returns:
+        list: Table names
+    """
+    cutoff = datetime.now() - older_than
+    with engine.connect() as connection:
+        names = inspect(connection).get_table_names(schema=schema)
+    table_list = []
+    for name in sorted(names):
+        if name.startswith("coldstart_final_"):
+            continue
+        created = parse_table_time(name)
+        if created is not None and created < cutoff:
+            table_list.append(f"{schema}.{name}")
+    return table_list
+
+
+def sweep_tables(
+    engine,
+    schema,
+    older_than,
+    batch_size=100,
+    dry_run=False,
+    dialect=None
+):
+    """For dropping orphaned coldstart tables in parallel batches
+
+    Args:
+        engine (object): Engine object
+        schema (str): schema of interest
+        older_than (timedelta): Minimum table age
+        batch_size (int): Number of tables dropped per batch.
+            Defaults to 100.
+        dry_run (bool): Used for listing tables without dropping them.
+            Defaults to False.
+        dialect (str): Dialect name or adapter. Defaults to None.
+
+    Returns:
+        list: Results: query_name, status, run_time, meta
+    """
+    table_list = list_orphaned_tables(engine=engine, schema=schema, older_than=older_than)
+    if dry_run is True:
+        return [(table, 'SKIPPED', 0, {}) for table in table_list]
+    results = []
+    for x in range(0, len(table_list), batch_size):
+        results += drop_tables(
+            engine=engine,
+            table_list=table_list[x:x+batch_size],
+            dialect=dialect
+        )
+    return results
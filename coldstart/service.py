@@ -0,0 +1,403 @@
+# Copyright 2022 CVS Health and/or one of its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+import json
+import hashlib
+import threading
+from datetime import date
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from coldstart.build import FeatureFactory
+from coldstart.parse import index_queries
+
+
+class SharedQuery(object):
+
+    """Staging or feature query shared by concurrent runs
+
+    Args:
+        key (str): Hash of everything that determines the query's result
+    """
+
+    def __init__(self, key):
+
+        self.key = key
+        self.future = Future()
+        self.refs = 0
+
+
+class SharedQueries(object):
+
+    """Coalesces identical queries of concurrent runs
+
+    The first run to claim a key executes the query and every run claiming
+    the same key while it is held waits for and reuses the result, including
+    the table it created. Tables are returned for dropping once the last
+    run holding them releases them. Failed queries are forgotten as soon as
+    they fail, so later runs retry them.
+
+    Args:
+        max_concurrency (int): Number of query workers allowed across all
+            runs at once
+    """
+
+    def __init__(self, max_concurrency):
+
+        self.limiter = threading.BoundedSemaphore(max_concurrency)
+        self.lock = threading.Lock()
+        self.queries = {}
+
+    def key(self, *parts):
+        """Hashes the parts that determine a query's result
+
+        Returns:
+            str: Key
+        """
+        return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+    def claim(self, key):
+        """Claims a query
+
+        Args:
+            key (str): Query key
+
+        Returns:
+            SharedQuery, bool: Shared query and whether the caller has to
+                execute it and call resolve
+        """
+        with self.lock:
+            query = self.queries.get(key)
+            leader = query is None
+            if leader:
+                query = SharedQuery(key)
+                self.queries[key] = query
+            query.refs += 1
+        return query, leader
+
+    def forget(self, query):
+        """Stops sharing a query; must be called holding self.lock"""
+        if self.queries.get(query.key) is query:
+            del self.queries[query.key]
+
+    def resolve(self, query, result=None, error=None):
+        """Shares the result of a claimed query
+
+        Args:
+            query (SharedQuery): Query claimed as leader
+            result (tuple): Results: query_name, status, run_time, meta.
+                Defaults to None.
+            error (Exception): Raised to every run waiting on the query.
+                Defaults to None.
+        """
+        failed = error is not None or result[1] == "FAILURE"
+        if failed:
+            with self.lock:
+                self.forget(query)
+        if error is not None:
+            query.future.set_exception(error)
+        else:
+            query.future.set_result(result)
+
+    def execute(self, key, fn, claimed):
+        """Executes a query once for every concurrent run claiming its key
+
+        Args:
+            key (str): Query key
+            fn (callable): Executes the query and returns its results
+            claimed (list): Shared queries held by the calling run. The
+                claimed query is appended.
+
+        Returns:
+            tuple: Results: query_name, status, run_time, meta
+        """
+        query, leader = self.claim(key)
+        claimed.append(query)
+        if leader:
+            try:
+                result = fn()
+            except BaseException as e:
+                self.resolve(query, error=e)
+                raise
+            self.resolve(query, result)
+        return query.future.result()
+
+    def execute_many(self, keys, query_tuples, fn, claimed):
+        """Executes queries once for every concurrent run claiming their keys
+
+        Queries claimed first by this run are executed together by fn, and
+        the rest wait on the runs executing them.
+
+        Args:
+            keys (list): Query key per query tuple
+            query_tuples (list): Tuples: query_name, engine, sql, return_df
+                and table_name
+            fn (callable): Executes a list of query tuples and returns
+                their results
+            claimed (list): Shared queries held by the calling run. The
+                claimed queries are appended.
+
+        Returns:
+            list: Results per query tuple. Results of queries executed by
+                other runs carry coalesced in meta.
+        """
+        queries, leaders = [], []
+        for key, query_tuple in zip(keys, query_tuples):
+            query, leader = self.claim(key)
+            claimed.append(query)
+            queries.append((query, leader))
+            if leader:
+                leaders.append((query, query_tuple))
+
+        # Execute led queries
+        try:
+            results = fn([t for _, t in leaders])
+        except BaseException as e:
+            for query, _ in leaders:
+                self.resolve(query, error=e)
+            raise
+        results = {r[0]: r for r in results}
+        for query, query_tuple in leaders:
+            self.resolve(query, results[query_tuple[0]])
+
+        # Wait for queries led by other runs
+        shared_results = []
+        for query, leader in queries:
+            result = query.future.result()
+            if leader is False:
+                result = (*result[:3], dict(result[3], coalesced=True))
+            shared_results.append(result)
+        return shared_results
+
+    def release(self, queries):
+        """Releases claimed queries
+
+        Args:
+            queries (list): Shared queries claimed by a run
+
+        Returns:
+            list: Tables no run holds anymore
+        """
+        tables = []
+        with self.lock:
+            for query in queries:
+                query.refs -= 1
+                if query.refs > 0:
+                    continue
+                self.forget(query)
+                if query.future.done() and query.future.exception() is None:
+                    result = query.future.result()
+                    if result[1] == "SUCCESS" and result[3].get("table_name") is not None:
+                        tables.append(result[3]["table_name"])
+        return tables
+
+
+class FeatureService(object):
+
+    """Long-running feature service
+
+    Holds one engine, one warmed query catalog and one SharedQueries for
+    all runs, so concurrent runs share the connection pool, stay within one
+    concurrency budget and execute identical staging and feature queries
+    once.
+
+    Args:
+        db_spec (dict): Used as the config for start_engine
+        max_concurrency (int): Number of query workers allowed across all
+            runs at once. If None, the engine's max_workers is used.
+            Defaults to None.
+        query_dir (str): Query directory indexed on start. If None,
+            coldstart/query_bank is used. Defaults to None.
+        tracer (Tracer): Tracer passed to every run. Defaults to None.
+    """
+
+    def __init__(self, db_spec, max_concurrency=None, query_dir=None, tracer=None):
+
+        self.db_spec = dict(db_spec)
+        if max_concurrency is not None:
+            self.db_spec.setdefault("max_workers", max_concurrency)
+        self.query_dir = query_dir
+        self.factory = FeatureFactory(tracer=tracer)
+        self.factory.start_engine(self.db_spec)
+        self.max_concurrency = max_concurrency or self.factory.max_workers
+        self.shared = SharedQueries(self.max_concurrency)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.catalog = index_queries(query_dir)
+
+    def run(self, **kwargs):
+        """Runs FeatureFactory for one request
+
+        Args:
+            **kwargs: Arguments for run. query_dir defaults to the service's.
+
+        Returns:
+            dict: Report of the run
+        """
+        ff = FeatureFactory(tracer=self.factory.tracer)
+        ff.start_engine(dict(self.db_spec, engine=self.factory.engine, sources=None))
+        kwargs.setdefault("query_dir", self.query_dir)
+        kwargs.setdefault("return_df", False)
+        with self.lock:
+            self.active += 1
+        error = None
+        try:
+            ff.run(shared=self.shared, **kwargs)
+        except Exception as e:
+            error = e
+        finally:
+            with self.lock:
+                self.active -= 1
+        report = ff.report(error=error)
+        if kwargs["return_df"] is True and ff.get_dataframe() is not None:
+            report["data"] = json.loads(ff.get_dataframe().to_json(orient="records"))
+        return report
+
+    def status(self):
+        """Returns service status
+
+        Returns:
+            dict: status, active runs, shared queries held and catalog size
+        """
+        with self.lock:
+            active = self.active
+        with self.shared.lock:
+            shared = len(self.shared.queries)
+        return {
+            "status": "OK",
+            "active_runs": active,
+            "shared_queries": shared,
+            "max_concurrency": self.max_concurrency,
+            "queries": len(self.catalog),
+        }
+
+    def stop(self):
+        """Stops the service's engine"""
+        self.factory.stop_engine()
+
+
+# Run arguments HTTP clients may set; the rest, e.g. server-side paths or
+# the tables runs write, stay under the service's control
+RUN_ARGUMENTS = [
+    "leftmost_table",
+    "entity_id",
+    "domains",
+    "queries",
+    "features",
+    "date_range",
+    "return_df",
+]
+
+# Plain identifiers, optionally qualified with dataset and project
+TABLE_PATTERN = r"[A-Za-z_][\w-]*(\.[A-Za-z_][\w-]*){0,2}"
+COLUMN_PATTERN = r"[A-Za-z_]\w*"
+
+
+def check_run_arguments(kwargs):
+    """Checks run arguments sent by an HTTP client
+
+    Arguments interpolated into SQL need to be plain identifiers or dates.
+
+    Args:
+        kwargs (dict): Run arguments
+
+    Raises:
+        ValueError: Error for unsupported arguments
+        ValueError: Error for invalid leftmost_table, entity_id or date_range
+    """
+    unknown = sorted(set(kwargs) - set(RUN_ARGUMENTS))
+    if len(unknown) > 0:
+        raise ValueError(f"Unsupported run arguments: {', '.join(unknown)}.")
+    for key, pattern in [("leftmost_table", TABLE_PATTERN), ("entity_id", COLUMN_PATTERN)]:
+        value = kwargs.get(key)
+        if value is not None and (not isinstance(value, str) or re.fullmatch(pattern, value) is None):
+            raise ValueError(f"{key} needs to be a plain identifier.")
+    date_range = kwargs.get("date_range")
+    if date_range is not None:
+        try:
+            if len(date_range) != 2:
+                raise ValueError
+            for dt in date_range:
+                date.fromisoformat(dt)
+        except (TypeError, ValueError):
+            raise ValueError("date_range needs to be two dates formatted as YYYY-MM-DD.")
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+
+    """JSON over HTTP front end of a FeatureService
+
+    GET /status and GET /catalog describe the service, and POST /run takes
+    run arguments from RUN_ARGUMENTS as a JSON object, checked by
+    check_run_arguments, and answers with the run's report.
+    """
+
+    def send_json(self, code, body):
+        data = json.dumps(body, default=str).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == "/status":
+            self.send_json(200, service.status())
+        elif self.path == "/catalog":
+            service.catalog = index_queries(service.query_dir)
+            keys = ["query_name", "dialect", "entity", "domain"]
+            self.send_json(200, [{k: e[k] for k in keys} for e in service.catalog])
+        else:
+            self.send_json(404, {"error": f"Unknown path: {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/run":
+            self.send_json(404, {"error": f"Unknown path: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            kwargs = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(kwargs, dict):
+                raise ValueError("The request body needs to be a JSON object.")
+            check_run_arguments(kwargs)
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        report = self.server.service.run(**kwargs)
+        self.send_json(200 if report["status"] == "SUCCESS" else 500, report)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(service, host="127.0.0.1", port=8000):
+    """Builds an HTTP server for a FeatureService
+
+    Each request is handled on its own thread. Call serve_forever to start
+    serving and shutdown to stop.
+
+    Args:
+        service (FeatureService): Service to serve
+        host (str): Host to bind. Defaults to "127.0.0.1".
+        port (int): Port to bind, or 0 for any free port. Defaults to 8000.
+
+    Returns:
+        ThreadingHTTPServer: Server
+    """
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
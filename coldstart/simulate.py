@@ -0,0 +1,219 @@
+# Copyright 2022 CVS Health and/or one of its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+import time
+import zlib
+import shutil
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from fnmatch import fnmatchcase
+from sqlalchemy import create_engine, event
+
+from coldstart.dialects import get_dialect
+from coldstart.query import default_workers
+
+
+class SimulatedError(Exception):
+
+    """Failure injected by the simulated warehouse"""
+
+
+class ThrottlingError(SimulatedError):
+
+    """Throttling error injected by the simulated warehouse"""
+
+
+class Simulator(object):
+
+    """Deterministic simulated warehouse backed by SQLite
+
+    Statements run on a real SQLite engine, but first wait for a latency
+    drawn from the profile matching their label and may fail with injected
+    throttling errors or failures. Statements are labelled with the query
+    name of the coldstart table they create (e.g. testQuery1), the name of
+    any other table they create, or else their first keyword (e.g. SELECT,
+    DROP or PRAGMA). Draws depend only on the seed, the label and how many
+    statements with that label ran before, so runs are reproducible
+    regardless of thread scheduling. Statements execute on SQLite one at a
+    time while latencies overlap, and every start and end is recorded so
+    concurrency can be inspected over time.
+
+    Args:
+        profiles (dict): Label pattern: profile. A profile is a dictionary
+            of latency (seconds as a number, a (low, high) uniform range or
+            a callable taking a NumPy Generator), failure_rate and
+            throttle_rate. The first matching pattern is used, so put "*"
+            last. Defaults to None.
+        seed (int): Seed for latency and failure draws. Defaults to 0.
+        max_concurrency (int): Statements beyond this many in flight are
+            rejected with ThrottlingError. Defaults to None.
+        database (str): SQLite database file. If None, a temporary file is
+            used. Defaults to None.
+        max_workers (int): Number of query workers the pool is sized for.
+            If None, default_workers is used. Defaults to None.
+    """
+
+    def __init__(self, profiles=None, seed=0, max_concurrency=None, database=None, max_workers=None):
+
+        self.profiles = profiles or {}
+        self.seed = seed
+        self.max_concurrency = max_concurrency
+        self.lock = threading.Lock()
+        self.execute_lock = threading.Lock()
+        self.counts = {}
+        self.active = 0
+        self.events = []
+        self.local = threading.local()
+
+        # Create engine
+        self.scratch_dir = None
+        if database is None:
+            self.scratch_dir = tempfile.mkdtemp(prefix="coldstart_")
+            database = Path(self.scratch_dir).joinpath("simulated.db")
+        db_spec = {"database": str(database)}
+        adapter = get_dialect("sqlite")
+        engine_kwargs = adapter.engine_kwargs(db_spec)
+        engine_kwargs.update(adapter.pool_kwargs(db_spec, max_workers or default_workers()))
+        self.engine = create_engine(adapter.url(db_spec), **engine_kwargs)
+        self.t0 = time.perf_counter()
+
+        # Hook statements
+        event.listen(self.engine, "before_cursor_execute", self.before_execute)
+        event.listen(self.engine, "after_cursor_execute", self.after_execute)
+        event.listen(self.engine, "handle_error", self.handle_error)
+
+    def label(self, sql):
+        """Labels a statement
+
+        Args:
+            sql (str): SQL statement
+
+        Returns:
+            str: Label
+        """
+        match = re.search(r"CREATE\s+(?:OR\s+REPLACE\s+)?(?:TEMP\s+)?TABLE\s+([\w.]+)", sql, re.IGNORECASE)
+        if match is not None:
+            table = match.group(1).split(".")[-1]
+            query = re.match(r"coldstart_(.+)_\d{20}_tmp$", table)
+            return query.group(1) if query is not None else table
+        words = sql.split()
+        return words[0].upper() if len(words) > 0 else ""
+
+    def profile(self, label):
+        """Returns the profile matching a label
+
+        Args:
+            label (str): Statement label
+
+        Returns:
+            dict: Profile
+        """
+        for pattern, profile in self.profiles.items():
+            if fnmatchcase(label, pattern):
+                return profile
+        return {}
+
+    def draw(self, label, n):
+        """Draws latency and injected error for a statement
+
+        Args:
+            label (str): Statement label
+            n (int): Number of earlier statements with the same label
+
+        Returns:
+            tuple: Latency in seconds, exception class or None
+        """
+        profile = self.profile(label)
+        rng = np.random.default_rng([self.seed, zlib.crc32(label.encode()), n])
+        latency = profile.get("latency", 0)
+        if callable(latency):
+            latency = latency(rng)
+        elif isinstance(latency, (tuple, list)):
+            latency = rng.uniform(latency[0], latency[1])
+        error = None
+        if rng.random() < profile.get("throttle_rate", 0):
+            error = ThrottlingError
+        elif rng.random() < profile.get("failure_rate", 0):
+            error = SimulatedError
+        return max(float(latency), 0.0), error
+
+    def record(self, label, kind):
+        """Records a statement event; must be called holding self.lock"""
+        self.events.append((time.perf_counter() - self.t0, label, kind, self.active))
+
+    def before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        label = self.label(statement)
+        with self.lock:
+            n = self.counts.get(label, 0)
+            self.counts[label] = n + 1
+            if self.max_concurrency is not None and self.active >= self.max_concurrency:
+                self.record(label, "throttled")
+                raise ThrottlingError(f"{label}: exceeded rate limits: too many concurrent queries")
+            self.active += 1
+            self.record(label, "start")
+        latency, error = self.draw(label, n)
+        time.sleep(latency)
+        if error is not None:
+            self.finish(label, "throttled" if error is ThrottlingError else "failed")
+            raise error(f"{label}: injected {error.__name__}")
+        self.execute_lock.acquire()
+        self.local.label = label
+
+    def finish(self, label, kind):
+        with self.lock:
+            self.active -= 1
+            self.record(label, kind)
+
+    def after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.execute_lock.release()
+        self.finish(self.local.label, "end")
+        self.local.label = None
+
+    def handle_error(self, context):
+        # Only errors raised by SQLite itself hold the execute lock
+        if getattr(self.local, "label", None) is not None:
+            self.execute_lock.release()
+            self.finish(self.local.label, "failed")
+            self.local.label = None
+
+    def timeline(self):
+        """Returns statement events over time
+
+        Returns:
+            DataFrame: seconds since start, label, event (start, end, failed
+                or throttled) and the number of statements in flight
+        """
+        with self.lock:
+            events = list(self.events)
+        return pd.DataFrame(events, columns=["seconds", "label", "event", "active"])
+
+    def max_active(self):
+        """Returns the highest number of statements in flight
+
+        Returns:
+            int: Peak concurrency
+        """
+        df = self.timeline()
+        return int(df["active"].max()) if len(df) > 0 else 0
+
+    def dispose(self):
+        """Disposes the SQLite engine and removes its temporary database"""
+        self.engine.dispose()
+        if self.scratch_dir is not None:
+            shutil.rmtree(self.scratch_dir, ignore_errors=True)
+            self.scratch_dir = None
@@ -0,0 +1,186 @@
+# Copyright 2022 CVS Health and/or one of its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# References
+# https://opentelemetry.io/docs/specs/otel/trace/api/
+
+import json
+import time
+import secrets
+import threading
+import traceback
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+class NoOpSpan(object):
+
+    """Span that discards everything"""
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+    def add_event(self, name, attributes=None):
+        pass
+
+    def record_exception(self, exception, attributes=None):
+        pass
+
+    def is_recording(self):
+        return False
+
+
+class Tracer(object):
+
+    """No-op tracer and the interface coldstart traces through
+
+    coldstart only calls start_as_current_span on tracers and
+    set_attribute, set_attributes, add_event and record_exception on spans,
+    so an OpenTelemetry tracer, e.g. opentelemetry.trace.get_tracer(
+    "coldstart"), can be used in place of any Tracer.
+    """
+
+    @contextmanager
+    def start_as_current_span(self, name, attributes=None):
+        """Starts a span that is current for the duration of the block
+
+        Args:
+            name (str): Span name
+            attributes (dict): Span attributes. Defaults to None.
+
+        Yields:
+            NoOpSpan: Span
+        """
+        yield NoOpSpan()
+
+
+class Span(NoOpSpan):
+
+    """Span recorded by JSONTracer"""
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.events = []
+        self.status = "UNSET"
+        self.start_time = time.time_ns()
+        self.end_time = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes):
+        self.attributes.update(attributes)
+
+    def add_event(self, name, attributes=None):
+        self.events.append({
+            "name": name,
+            "time_unix_nano": time.time_ns(),
+            "attributes": dict(attributes or {}),
+        })
+
+    def record_exception(self, exception, attributes=None):
+        event_attributes = {
+            "exception.type": type(exception).__name__,
+            "exception.message": str(exception),
+            "exception.stacktrace": "".join(traceback.format_exception(
+                type(exception), exception, exception.__traceback__
+            )),
+        }
+        event_attributes.update(attributes or {})
+        self.add_event("exception", event_attributes)
+
+    def is_recording(self):
+        return self.end_time is None
+
+    def to_dict(self):
+        """Formats the span like the OpenTelemetry JSON exporters
+
+        Returns:
+            dict: Span
+        """
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time_unix_nano": self.start_time,
+            "end_time_unix_nano": self.end_time,
+            "duration_ms": None if self.end_time is None else (self.end_time - self.start_time) / 1e6,
+            "status": self.status,
+            "attributes": self.attributes,
+            "events": self.events,
+        }
+
+
+class JSONTracer(Tracer):
+
+    """Tracer that records spans as JSON
+
+    Finished spans are kept in spans as dictionaries and, if path is given,
+    appended to it as JSON lines. Spans started in threads inherit the
+    current span when the thread runs in a copied context.
+
+    Args:
+        path (str): JSON lines file finished spans are appended to.
+            Defaults to None.
+    """
+
+    def __init__(self, path=None):
+
+        self.path = path
+        self.spans = []
+        self.lock = threading.Lock()
+        self.current = ContextVar(f"coldstart_span_{id(self)}", default=None)
+
+    @contextmanager
+    def start_as_current_span(self, name, attributes=None):
+        parent = self.current.get()
+        if parent is None:
+            span = Span(name, secrets.token_hex(16), attributes=attributes)
+        else:
+            span = Span(name, parent.trace_id, parent.span_id, attributes=attributes)
+        token = self.current.set(span)
+        try:
+            yield span
+            if span.status == "UNSET":
+                span.status = "OK"
+        except BaseException as e:
+            span.record_exception(e)
+            span.status = "ERROR"
+            raise
+        finally:
+            self.current.reset(token)
+            span.end_time = time.time_ns()
+            self.export(span)
+
+    def export(self, span):
+        """Records a finished span
+
+        Args:
+            span (Span): Finished span
+        """
+        record = span.to_dict()
+        with self.lock:
+            self.spans.append(record)
+            if self.path is not None:
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(record, default=str) + "\n")
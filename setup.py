@@ -39,8 +39,13 @@ REQUIREMENTS = [
     "sqlalchemy>=1.4.27",
     "tenacity",
     "sqlalchemy-bigquery",
-    # "dask>=2.11.0",
 ]
+EXTRAS = {
+    "dask": ["dask[dataframe]>=2.11.0"],
+    "duckdb": ["duckdb>=0.7.0", "duckdb-engine>=0.7.0"],
+    "bench": ["pytest-benchmark>=3.4.1"],
+    "yaml": ["pyyaml>=5.1"],
+}
 
 # Run setup
 setup(
@@ -56,6 +61,8 @@ setup(
     python_requires=PYTHON_REQ,
     packages=PACKAGES,
     install_requires=REQUIREMENTS,
+    extras_require=EXTRAS,
+    entry_points={"console_scripts": ["coldstart=coldstart.cli:main"]},
     include_package_data=True,
     setup_requires=["pytest-runner"],
     tests_require=["pytest"],
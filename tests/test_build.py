@@ -12,7 +12,42 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+import time
+import pytest
+import pandas as pd
+
 from coldstart.build import FeatureFactory
+from coldstart.query import RunCancelled, SessionEngine
+
+
+SQLITE_QUERY = """-- DIALECT: sqlite
+-- ENTITY: team_id
+-- DOMAIN: wins
+SELECT
+    LMT.idx,
+    SUM(G.win) AS win_count
+FROM
+    {LEFTMOST_TABLE} AS LMT
+    LEFT JOIN games AS G
+        ON LMT.team_id = G.team_id
+GROUP BY
+    LMT.idx
+"""
+
+
+def make_sqlite_factory(tmp_path, max_workers=None):
+    
+    ff = FeatureFactory()
+    db_spec = {"dialect": "sqlite", "database": str(tmp_path.joinpath("wh.db")), "schema": "main"}
+    if max_workers is not None:
+        db_spec["max_workers"] = max_workers
+    ff.start_engine(db_spec)
+    ff.engine.execute("CREATE TABLE teams (team_id TEXT, y INTEGER)")
+    ff.engine.execute("INSERT INTO teams VALUES ('a', 1), ('b', 0)")
+    ff.engine.execute("CREATE TABLE games (team_id TEXT, win INTEGER)")
+    ff.engine.execute("INSERT INTO games VALUES ('a', 1), ('a', 1), ('b', 0)")
+    return ff
 
 
 def test_start_engine():
@@ -90,5 +125,353 @@ def test_start_engine():
         ff.start_engine(db_spec)
     except ValueError:
         assert True
+
+
+def test_iter_batches(tmp_path):
+    """ ValueError is raised when batch_rows is invalid, when no feature table exists """
+    
+    output_dir = tmp_path.joinpath("final")
+    output_dir.mkdir()
+    df = pd.DataFrame({"idx": [f"a{i}" for i in range(10)], "y": [i % 2 for i in range(10)]})
+    df.to_parquet(output_dir.joinpath("part-00000.parquet"), index=False)
+    
+    ff = FeatureFactory()
+    
+    with pytest.raises(ValueError):
+        ff.iter_batches(4)
+    
+    ff.load(tmp_path)
+    
+    with pytest.raises(ValueError):
+        ff.iter_batches(0)
         
-    
\ No newline at end of file
+    assert [len(b) for b in ff.iter_batches(4)] == [4, 4, 2]
+    assert ff.iter_batches(4, columns=["y"], as_numpy=True).__next__().shape == (4, 1)
+    assert len(ff.get_dataframe()) == 10
+
+
+def test_write_index(tmp_path):
+    """ ValueError is raised when there are no features to index """
+    
+    ff = FeatureFactory()
+    
+    with pytest.raises(ValueError):
+        ff.write_index(tmp_path.joinpath("features.idx"))
+    
+    ff.df = pd.DataFrame({"idx": ["b", "a"], "y": [1, 0]})
+    path = ff.write_index(tmp_path.joinpath("features.idx"))
+    
+    from coldstart.index import FeatureIndex
+    assert FeatureIndex(path).get("a") == {"y": 0}
+
+
+def test_sweep_keeps_final_table(tmp_path):
+    """ Sweeping drops orphaned intermediate tables but never final tables """
+    
+    query_dir = tmp_path.joinpath("bank")
+    query_dir.mkdir()
+    query_dir.joinpath("sqliteQuery1.sql").write_text(SQLITE_QUERY)
+    
+    ff = make_sqlite_factory(tmp_path)
+    ff.run(
+        leftmost_table="teams",
+        entity_id="team_id",
+        domains=["wins"],
+        date_range=["2020-01-01", "2020-12-31"],
+        query_dir=query_dir,
+        drop_intermedieate_tables=False,
+    )
+    
+    swept = ff.sweep(older_than_hours=0)
+    assert len(swept) == 2
+    assert ff.table.startswith("main.coldstart_final_")
+    assert len(ff.engine.execute(f"SELECT * FROM {ff.table}").fetchall()) == 2
+    ff.stop_engine()
+
+
+def test_sqlite_timeouts(tmp_path):
+    """ Runaway queries are cancelled by query_timeout, timeout, fail-fast and RunHandle.cancel """
+    
+    query_dir = tmp_path.joinpath("bank")
+    query_dir.mkdir()
+    query_dir.joinpath("sqliteQuery1.sql").write_text(SQLITE_QUERY)
+    query_dir.joinpath("sqliteQuery2.sql").write_text(SQLITE_QUERY.replace(
+        "LEFT JOIN games AS G",
+        "CROSS JOIN (WITH RECURSIVE R(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM R) SELECT i FROM R) AS N LEFT JOIN games AS G"
+    ))
+    
+    ff = make_sqlite_factory(tmp_path, max_workers=2)
+    kwargs = {
+        "leftmost_table": "teams",
+        "entity_id": "team_id",
+        "domains": ["wins"],
+        "date_range": ["2020-01-01", "2020-12-31"],
+        "query_dir": query_dir,
+    }
+    def tables():
+        sql = "SELECT name FROM sqlite_master WHERE name LIKE 'coldstart_sqliteQuery2_%'"
+        return ff.engine.execute(sql).fetchall()
+    
+    # Only the runaway query fails
+    time_start = time.perf_counter()
+    ff.run(query_timeout=0.5, **kwargs)
+    status = ff.results_df.set_index("query_name")["query_status"]
+    assert status["sqliteQuery1"] == "SUCCESS" and status["sqliteQuery2"] == "FAILURE"
+    assert "sqliteQuery1_win_count" in ff.df.columns
+    assert time.perf_counter() - time_start < 5
+    
+    # The run stops at its deadline
+    with pytest.raises(TimeoutError):
+        ff.run(timeout=0.5, **kwargs)
+    assert tables() == []
+    
+    # The first failure cancels the rest
+    query_dir.joinpath("sqliteQuery0.sql").write_text(SQLITE_QUERY.replace("games", "losses"))
+    time_start = time.perf_counter()
+    with pytest.raises(ValueError):
+        ff.run(stop_on_error=True, **kwargs)
+    assert ff.results_df.set_index("query_name")["query_status"]["sqliteQuery2"] == "FAILURE"
+    assert time.perf_counter() - time_start < 5
+    assert tables() == []
+    
+    # Cancelled runs raise RunCancelled
+    handle = ff.run_async(**kwargs)
+    while handle.progress()["phase"] != "TEMPLATING":
+        time.sleep(0.05)
+    assert handle.cancel() is True
+    with pytest.raises(RunCancelled):
+        handle.result(timeout=5)
+    assert handle.progress()["status"] == "FAILURE"
+    assert tables() == []
+    ff.stop_engine()
+
+
+def test_sqlite_session_timeouts(tmp_path):
+    """ Time queued for the session does not count against query_timeout """
+    
+    query_dir = tmp_path.joinpath("bank")
+    query_dir.mkdir()
+    slow_sql = "(WITH RECURSIVE R(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM R WHERE i < 1500000) SELECT COUNT(*) FROM R)"
+    for i in range(4):
+        query_dir.joinpath(f"sqliteQuery{i}.sql").write_text(SQLITE_QUERY.replace("SUM(G.win)", f"SUM(G.win) + {slow_sql}"))
+    
+    ff = make_sqlite_factory(tmp_path, max_workers=4)
+    ff.run(
+        leftmost_table="teams",
+        entity_id="team_id",
+        domains=["wins"],
+        date_range=["2020-01-01", "2020-12-31"],
+        query_dir=query_dir,
+        temp_tables=True,
+        query_timeout=1.5,
+    )
+    assert (ff.results_df["query_status"] == "SUCCESS").all()
+    assert len(ff.df.columns) == 6
+    ff.stop_engine()
+
+
+def test_sqlite_session_closed_on_error(tmp_path, monkeypatch):
+    """ The temp_tables session is closed when a run raises """
+    
+    closed = []
+    close = SessionEngine.close
+    monkeypatch.setattr(SessionEngine, "close", lambda self: closed.append(self.connection) or close(self))
+    
+    query_dir = tmp_path.joinpath("bank")
+    query_dir.mkdir()
+    query_dir.joinpath("sqliteQuery1.sql").write_text(SQLITE_QUERY.replace("games", "losses"))
+    
+    ff = make_sqlite_factory(tmp_path)
+    with pytest.raises(ValueError):
+        ff.run(
+            leftmost_table="teams",
+            entity_id="team_id",
+            domains=["wins"],
+            date_range=["2020-01-01", "2020-12-31"],
+            query_dir=query_dir,
+            temp_tables=True,
+            stop_on_error=True,
+        )
+    assert len(closed) == 1 and closed[0] is not None
+    ff.stop_engine()
+
+
+def test_sqlite_lookup(tmp_path):
+    """ Features are looked up for inlined entity ids without creating tables """
+    
+    query_dir = tmp_path.joinpath("bank")
+    query_dir.mkdir()
+    query_dir.joinpath("sqliteQuery1.sql").write_text(SQLITE_QUERY)
+    query_dir.joinpath("sqliteQuery2.sql").write_text(SQLITE_QUERY.replace("SUM", "MAX"))
+    
+    ff = FeatureFactory()
+    ff.start_engine({"dialect": "sqlite", "database": str(tmp_path.joinpath("wh.db")), "schema": "main"})
+    ff.engine.execute("CREATE TABLE games (team_id TEXT, win INTEGER)")
+    ff.engine.execute("INSERT INTO games VALUES ('a', 1), ('a', 1), ('b', 0), ('o''k', 1)")
+    
+    df = ff.lookup(
+        ["b", "a", "c", "o'k", "x\\"],
+        ["2020-01-01", "2020-12-31"],
+        entity_id="team_id",
+        features=["sqliteQuery1_*"],
+        query_dir=query_dir,
+    )
+    
+    assert df["team_id"].tolist() == ["b", "a", "c", "o'k", "x\\"]
+    assert df.columns.tolist() == ["idx", "team_id", "min_date", "max_date", "sqliteQuery1_win_count"]
+    assert df["sqliteQuery1_win_count"].tolist()[:2] == [0, 2]
+    assert df["sqliteQuery1_win_count"].tolist()[3] == 1
+    assert ff.engine.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'").scalar() == 1
+    
+    with pytest.raises(ValueError):
+        ff.lookup([], ["2020-01-01", "2020-12-31"], entity_id="team_id", domains=["wins"], query_dir=query_dir)
+    ff.stop_engine()
+
+
+def test_sqlite_incremental_run(tmp_path):
+    """ Incremental runs only query new leftmost rows and add new feature columns """
+    
+    query_dir = tmp_path.joinpath("bank")
+    query_dir.mkdir()
+    query_dir.joinpath("sqliteQuery1.sql").write_text(SQLITE_QUERY)
+    
+    ff = make_sqlite_factory(tmp_path)
+    ff.engine.execute("INSERT INTO games VALUES ('c', 1)")
+    kwargs = {
+        "leftmost_table": "teams",
+        "feature_table": "main.features",
+        "entity_id": "team_id",
+        "domains": ["wins"],
+        "date_range": ["2020-01-01", "2020-12-31"],
+        "query_dir": query_dir,
+        "incremental": True,
+    }
+    
+    ff.run(**kwargs)
+    assert len(ff.df) == 2
+    
+    # New rows and a new query
+    ff.engine.execute("INSERT INTO teams VALUES ('c', 1)")
+    query_dir.joinpath("sqliteQuery2.sql").write_text(SQLITE_QUERY.replace("SUM", "MAX"))
+    ff.run(**kwargs)
+    df = ff.df.sort_values("idx").reset_index(drop=True)
+    
+    assert df["idx"].str[0].tolist() == ["a", "b", "c"]
+    assert df["sqliteQuery1_win_count"].tolist() == [2, 0, 1]
+    assert df["sqliteQuery2_win_count"].isna().tolist() == [True, True, False]
+    
+    # No new rows
+    ff.run(**kwargs)
+    assert ff.results_df["query_name"].tolist() == ["leftMostTable"]
+    assert len(ff.df) == 3
+    assert ff.engine.execute("SELECT COUNT(*) FROM sqlite_master WHERE name LIKE 'coldstart_%'").scalar() == 0
+    
+    with pytest.raises(ValueError):
+        ff.run(**dict(kwargs, feature_table=None))
+    ff.stop_engine()
+
+
+def test_sqlite_resume(tmp_path):
+    """ Resumed runs reuse the staged table and successful queries from the run manifest """
+    
+    query_dir = tmp_path.joinpath("bank")
+    query_dir.mkdir()
+    query_dir.joinpath("sqliteQuery1.sql").write_text(SQLITE_QUERY)
+    query_dir.joinpath("sqliteQuery2.sql").write_text(SQLITE_QUERY.replace("games", "losses"))
+    state_dir = tmp_path.joinpath("runs")
+    
+    ff = make_sqlite_factory(tmp_path)
+    ff.run(
+        leftmost_table="teams",
+        feature_table="main.features",
+        entity_id="team_id",
+        domains=["wins"],
+        date_range=["2020-01-01", "2020-12-31"],
+        query_dir=query_dir,
+        state_dir=state_dir,
+    )
+    
+    # Failed run keeps its tables
+    manifest = json.loads(state_dir.joinpath(f"{ff.run_id}.json").read_text())
+    assert ff.report()["status"] == "FAILURE"
+    assert manifest["status"] == "FAILURE"
+    assert manifest["queries"]["sqliteQuery1"]["status"] == "SUCCESS"
+    assert manifest["queries"]["sqliteQuery2"]["status"] == "FAILURE"
+    
+    # Only the failed query runs again
+    ff.engine.execute("CREATE TABLE losses (team_id TEXT, win INTEGER)")
+    ff.engine.execute("INSERT INTO losses VALUES ('b', 1)")
+    ff.resume(ff.run_id, state_dir)
+    tables = ff.results_df.set_index("query_name")["table_name"]
+    assert ff.report()["status"] == "SUCCESS"
+    assert tables["leftMostTable"] == manifest["staged_table"]
+    assert tables["sqliteQuery1"] == manifest["queries"]["sqliteQuery1"]["table_name"]
+    assert tables["sqliteQuery2"] != manifest["queries"]["sqliteQuery2"]["table_name"]
+    df = ff.df.sort_values("idx").reset_index(drop=True)
+    assert df["sqliteQuery1_win_count"].tolist() == [2, 0]
+    assert df["sqliteQuery2_win_count"].isna().tolist() == [True, False]
+    assert json.loads(state_dir.joinpath(f"{ff.run_id}.json").read_text())["status"] == "SUCCESS"
+    assert ff.engine.execute("SELECT COUNT(*) FROM sqlite_master WHERE name LIKE 'coldstart_%'").scalar() == 0
+    
+    with pytest.raises(ValueError):
+        ff.resume("missing", state_dir)
+    ff.stop_engine()
+
+
+def test_sqlite_lazy_dataframe(tmp_path):
+    """ Lazy dataframes fall back to range partitions on dialects without hash partitions """
+    
+    query_dir = tmp_path.joinpath("bank")
+    query_dir.mkdir()
+    query_dir.joinpath("sqliteQuery1.sql").write_text(SQLITE_QUERY)
+    
+    ff = make_sqlite_factory(tmp_path)
+    ff.run(
+        leftmost_table="teams",
+        entity_id="team_id",
+        domains=["wins"],
+        date_range=["2020-01-01", "2020-12-31"],
+        query_dir=query_dir,
+        compute_df=False,
+        n_partitions=2,
+    )
+    assert ff.merge_error is None
+    df = ff.df.compute().sort_values("idx").reset_index(drop=True)
+    assert df["sqliteQuery1_win_count"].tolist() == [2, 0]
+    
+    ff.run(
+        leftmost_table="teams",
+        entity_id="team_id",
+        domains=["wins"],
+        date_range=["2020-01-01", "2020-12-31"],
+        query_dir=query_dir,
+        compute_df=False,
+        partition_by="hash",
+    )
+    assert isinstance(ff.merge_error, ValueError)
+    ff.stop_engine()
+
+
+def test_sqlite_feature_queries(tmp_path):
+    """ Bare query names and patterns select every column of their queries """
+    
+    query_dir = tmp_path.joinpath("bank")
+    query_dir.mkdir()
+    query_dir.joinpath("sqliteQuery1.sql").write_text(SQLITE_QUERY)
+    query_dir.joinpath("sqliteQuery2.sql").write_text(SQLITE_QUERY.replace("SUM", "MAX"))
+    query_dir.joinpath("otherQuery.sql").write_text(SQLITE_QUERY)
+    
+    ff = make_sqlite_factory(tmp_path)
+    kwargs = {
+        "leftmost_table": "teams",
+        "entity_id": "team_id",
+        "date_range": ["2020-01-01", "2020-12-31"],
+        "query_dir": query_dir,
+    }
+    
+    ff.run(features=["sqliteQuery1"], **kwargs)
+    assert ff.df.columns.tolist() == ["idx", "y", "sqliteQuery1_win_count"]
+    
+    ff.run(features=["sqliteQuery?"], **kwargs)
+    assert sorted(ff.df.columns) == ["idx", "sqliteQuery1_win_count", "sqliteQuery2_win_count", "y"]
+    ff.stop_engine()
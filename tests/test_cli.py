@@ -0,0 +1,164 @@
+# Copyright 2022 CVS Health and/or one of its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import pytest
+from pathlib import Path
+from sqlalchemy import create_engine
+
+from coldstart.cli import build_parser, load_spec, main
+
+
+SQLITE_QUERY = """-- DIALECT: sqlite
+-- ENTITY: team_id
+-- DOMAIN: wins
+SELECT
+    LMT.idx,
+    SUM(G.win) AS win_count
+FROM
+    {LEFTMOST_TABLE} AS LMT
+    LEFT JOIN games AS G
+        ON LMT.team_id = G.team_id
+GROUP BY
+    LMT.idx
+"""
+
+
+@pytest.fixture
+def sqlite_spec(tmp_path):
+    
+    query_dir = tmp_path.joinpath("bank")
+    query_dir.mkdir()
+    query_dir.joinpath("sqliteQuery1.sql").write_text(SQLITE_QUERY)
+    query_dir.joinpath("sqliteQuery2.sql").write_text(SQLITE_QUERY.replace("SUM", "MAX"))
+    
+    database = str(tmp_path.joinpath("wh.db"))
+    engine = create_engine(f"sqlite:///{database}")
+    engine.execute("CREATE TABLE teams (team_id TEXT, y INTEGER)")
+    engine.execute("INSERT INTO teams VALUES ('a', 1), ('b', 0)")
+    engine.execute("CREATE TABLE games (team_id TEXT, win INTEGER)")
+    engine.execute("INSERT INTO games VALUES ('a', 1), ('a', 1), ('b', 0)")
+    engine.dispose()
+    
+    spec = {
+        "db_spec": {"dialect": "sqlite", "database": database, "schema": "main"},
+        "run": {
+            "leftmost_table": "teams",
+            "feature_table": "main.features",
+            "entity_id": "team_id",
+            "domains": ["wins"],
+            "date_range": ["2020-01-01", "2020-12-31"],
+            "query_dir": str(query_dir),
+        },
+    }
+    path = tmp_path.joinpath("spec.json")
+    path.write_text(json.dumps(spec))
+    return path
+
+
+def test_build_parser():
+    """ SystemExit is raised when no command is given """
+    
+    parser = build_parser()
+    
+    args = parser.parse_args(["sweep", "--dialect", "bigquery", "--schema", "my_schema", "--dry-run"])
+    assert args.command == "sweep"
+    assert args.older_than_hours == 24
+    assert args.dry_run is True
+    
+    with pytest.raises(SystemExit):
+        parser.parse_args([])
+
+
+def test_load_spec(tmp_path):
+    """ ValueError is raised when a spec has no db_spec """
+    
+    pytest.importorskip("yaml")
+    tmp_path.joinpath("spec.yaml").write_text("db_spec:\n  dialect: sqlite\n  schema: main\n")
+    assert load_spec(tmp_path.joinpath("spec.yaml")) == {"db_spec": {"dialect": "sqlite", "schema": "main"}, "run": {}}
+    
+    tmp_path.joinpath("spec.json").write_text('{"run": {}}')
+    with pytest.raises(ValueError):
+        load_spec(tmp_path.joinpath("spec.json"))
+
+
+def test_catalog(capsys, monkeypatch, tmp_path):
+    """ Queries are filtered by dialect, entity and domain """
+    
+    monkeypatch.setenv("COLDSTART_CACHE_DIR", str(tmp_path))
+    query_dir = str(Path(__file__).parent.joinpath("query_bank"))
+    
+    assert main(["catalog", "--query-dir", query_dir, "--dialect", "bigquery", "--entity", "team_id"]) == 0
+    records = json.loads(capsys.readouterr().out)
+    assert len(records) > 0
+    assert {r["dialect"] for r in records} == {"bigquery"}
+    assert tmp_path.joinpath("catalog.json").is_file()
+    
+    assert main(["catalog", "--query-dir", query_dir, "--domain", "missing", "--no-cache"]) == 0
+    assert json.loads(capsys.readouterr().out) == []
+    
+    # Cache failures leave stdout valid JSON
+    monkeypatch.setenv("COLDSTART_CACHE_DIR", str(tmp_path.joinpath("catalog.json", "cache")))
+    with pytest.warns(UserWarning):
+        assert main(["catalog", "--query-dir", query_dir, "--dialect", "bigquery", "--entity", "team_id"]) == 0
+    assert len(json.loads(capsys.readouterr().out)) == len(records)
+
+
+def test_plan(capsys, sqlite_spec):
+    """ Every query is validated without creating tables """
+    
+    assert main(["plan", str(sqlite_spec)]) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report["status"] == "SUCCESS"
+    assert sorted(q["query_name"] for q in report["queries"]) == ["leftMostTable", "sqliteQuery1", "sqliteQuery2"]
+
+
+def test_run(capsys, sqlite_spec, tmp_path):
+    """ Shards run disjoint queries and failures give a non-zero exit code """
+    
+    assert main(["run", str(sqlite_spec), "--shards", "2", "--shard-index", "1", "--report", str(tmp_path.joinpath("report.json"))]) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report["status"] == "SUCCESS"
+    assert report["feature_table"] == "main.features_shard1"
+    assert sorted(q["query_name"] for q in report["queries"]) == ["leftMostTable", "sqliteQuery2"]
+    assert json.loads(tmp_path.joinpath("report.json").read_text()) == report
+    
+    spec = json.loads(sqlite_spec.read_text())
+    spec["run"]["leftmost_table"] = "missing"
+    sqlite_spec.write_text(json.dumps(spec))
+    assert main(["run", str(sqlite_spec)]) == 1
+    assert json.loads(capsys.readouterr().out)["status"] == "FAILURE"
+    
+    # Bad specs and engines are reported too
+    tmp_path.joinpath("bad.json").write_text('{"run": {}}')
+    assert main(["run", str(tmp_path.joinpath("bad.json"))]) == 1
+    assert "db_spec" in json.loads(capsys.readouterr().out)["error"]
+    
+    spec["db_spec"]["dialect"] = None
+    sqlite_spec.write_text(json.dumps(spec))
+    assert main(["run", str(sqlite_spec)]) == 1
+    assert json.loads(capsys.readouterr().out)["status"] == "FAILURE"
+
+
+def test_sweep(capsys, sqlite_spec):
+    """ Sweeps run against the database of a spec """
+    
+    database = json.loads(sqlite_spec.read_text())["db_spec"]["database"]
+    engine = create_engine(f"sqlite:///{database}")
+    engine.execute("CREATE TABLE coldstart_sqliteQuery1_20000101000000000000_tmp AS SELECT 1 AS idx")
+    
+    assert main(["sweep", "--spec", str(sqlite_spec), "--dry-run"]) == 0
+    records = json.loads(capsys.readouterr().out)
+    assert [r["table_name"] for r in records] == ["main.coldstart_sqliteQuery1_20000101000000000000_tmp"]
+    engine.dispose()
@@ -0,0 +1,285 @@
+# Copyright 2022 CVS Health and/or one of its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+import tempfile
+import pandas as pd
+from pathlib import Path
+
+from coldstart.build import FeatureFactory
+from coldstart.dialects import Dialect, get_dialect, register_dialect
+from coldstart.query import collect_metadata
+
+
+SQLITE_QUERY = """-- DIALECT: sqlite
+-- ENTITY: team_id
+-- DOMAIN: wins
+SELECT
+    LMT.idx,
+    SUM(G.win) AS win_count
+FROM
+    {LEFTMOST_TABLE} AS LMT
+    LEFT JOIN games AS G
+        ON LMT.team_id = G.team_id
+GROUP BY
+    LMT.idx
+"""
+
+
+def test_get_dialect():
+    """ BigQuery is the default, adapters pass through, unknown names raise ValueError """
+    
+    assert get_dialect().name == "bigquery"
+    assert get_dialect("postgres").name == "postgresql"
+    adapter = get_dialect("duckdb")
+    assert get_dialect(adapter) is adapter
+    
+    with pytest.raises(ValueError):
+        get_dialect("bigqueryv2")
+        
+    class MyDialect(Dialect):
+        name = "mydb"
+        
+    register_dialect(MyDialect())
+    assert get_dialect("mydb").name == "mydb"
+
+
+def test_dialect_sql():
+    """ Adapters build their own URLs, idx expressions, DDL and partitions """
+    
+    assert get_dialect("bigquery").url({"project_id": "p"}) == "bigquery:///?ProjectId='p'"
+    assert get_dialect("sqlite").url({"database": "/tmp/x.db"}) == "sqlite:////tmp/x.db"
+    assert get_dialect("duckdb").url({"url": "duckdb:///:memory:"}) == "duckdb:///:memory:"
+    assert get_dialect("postgresql").url({
+        "user": "u", "password": "pw", "host": "h", "database": "d"
+    }) == "postgresql://u:pw@h:5432/d"
+    
+    assert "||" in get_dialect("sqlite").idx_sql("a", "b", "c")
+    assert "AS STRING" in get_dialect("bigquery").idx_sql("a", "b", "c")
+    
+    assert "expiration_timestamp" in get_dialect("bigquery").create_table_sql("s.t", table_ttl=2)
+    assert "OR REPLACE" in get_dialect("duckdb").create_table_sql("s.t", replace=True)
+    assert "OR REPLACE" not in get_dialect("sqlite").create_table_sql("s.t", replace=True)
+    with pytest.warns(UserWarning):
+        get_dialect("postgresql").create_table_sql("s.t", table_ttl=2)
+        
+    assert "HASHTEXT" in get_dialect("postgresql").hash_partition_sql("idx", 4, 1)
+    with pytest.raises(ValueError):
+        get_dialect("sqlite").hash_partition_sql("idx", 4, 1)
+    
+    assert get_dialect("postgresql").values_sql("id", ["a'b", 1]) == "SELECT * FROM (VALUES ('a''b'), (1)) AS V(id)"
+    assert "column1 AS id" in get_dialect("sqlite").values_sql("id", ["a"])
+    assert "UNNEST(['a', 'b'])" in get_dialect("bigquery").values_sql("id", ["a", "b"])
+    assert get_dialect("bigquery").values_sql("id", ["a'b", "c\\", None]) == r"SELECT id FROM UNNEST(['a\'b', 'c\\', NULL]) AS id"
+    assert get_dialect("bigquery").literal("x\ny") == r"'x\ny'"
+
+
+def test_bigquery_query_stats():
+    """ BigQuery statistics are read from the job of closed DDL results """
+    
+    from types import SimpleNamespace
+    job = SimpleNamespace(
+        total_bytes_processed=100,
+        total_bytes_billed=200,
+        slot_millis=30,
+        num_dml_affected_rows=None,
+        cache_hit=False,
+    )
+    result = SimpleNamespace(cursor=None, rowcount=-1, context=SimpleNamespace(cursor=SimpleNamespace(_query_job=job)))
+    assert get_dialect("bigquery").query_stats(result) == {
+        "bytes_processed": 100,
+        "bytes_billed": 200,
+        "cpu_ms": 30,
+        "rows_written": None,
+        "cache_hit": False,
+    }
+    
+    result = SimpleNamespace(cursor=None, rowcount=3, context=SimpleNamespace(cursor=SimpleNamespace()))
+    assert get_dialect("bigquery").query_stats(result) == {"rows_written": 3}
+
+
+def test_bigquery_session():
+    """ BigQuery session statements carry the session's job config without touching the shared client """
+    
+    from types import SimpleNamespace
+    executed = []
+    cursor = SimpleNamespace(execute=lambda statement, parameters, job_config=None: executed.append(job_config))
+    info = {"coldstart_job_config": {"session_id": "abc"}}
+    context = SimpleNamespace(root_connection=SimpleNamespace(info=info))
+    dialect = get_dialect("bigquery")
+    assert dialect.session_execute(cursor, "SELECT 1", None, context) is True
+    assert executed == [{"session_id": "abc"}] and executed[0] is not info["coldstart_job_config"]
+    
+    # Other connections are left to the dialect
+    context = SimpleNamespace(root_connection=SimpleNamespace(info={}))
+    assert dialect.session_execute(cursor, "SELECT 1", None, context) is None
+    assert len(executed) == 1
+    
+    connection = SimpleNamespace(info=info, execute=lambda sql: executed.append(sql))
+    dialect.end_session(connection)
+    assert executed[-1] == "CALL BQ.ABORT_SESSION()"
+    assert info == {}
+
+
+def test_pool_kwargs(tmp_path):
+    """ Pools are sized to the query workers unless db_spec overrides them """
+    
+    kwargs = get_dialect("bigquery").pool_kwargs({"pool_pre_ping": True}, 8)
+    assert kwargs["pool_size"] == 8
+    assert kwargs["pool_pre_ping"] is True
+    assert get_dialect("postgresql").pool_kwargs({"pool_size": 3}, 8)["pool_size"] == 3
+    assert get_dialect("sqlite").pool_kwargs({}, 8) == {}
+    
+    ff = FeatureFactory()
+    ff.start_engine({
+        "dialect": "sqlite",
+        "database": str(tmp_path.joinpath("wh.db")),
+        "schema": "main",
+        "max_workers": 6,
+        "max_overflow": 0
+    })
+    assert ff.max_workers == 6
+    assert ff.engine.pool.size() == 6
+    ff.stop_engine()
+
+
+def test_sqlite_metadata(tmp_path):
+    """ SQLite metadata is looked up in one statement for any number of tables """
+    
+    ff = FeatureFactory()
+    ff.start_engine({"dialect": "sqlite", "database": str(tmp_path.joinpath("wh.db")), "schema": "main"})
+    tables = [f"main.t{i}" for i in range(600)]
+    for t in tables:
+        ff.engine.execute(f"CREATE TABLE {t} (idx TEXT NOT NULL, y INTEGER)")
+    
+    df = collect_metadata(ff.engine, "main", tables, dialect="sqlite")
+    
+    assert len(df) == 1200
+    assert df["is_nullable"].tolist()[:2] == ["NO", "YES"]
+    ff.stop_engine()
+
+
+def test_sqlite_run(tmp_path):
+    """ FeatureFactory runs end-to-end on SQLite """
+    
+    query_dir = tmp_path.joinpath("bank")
+    query_dir.mkdir()
+    query_dir.joinpath("sqliteQuery1.sql").write_text(SQLITE_QUERY)
+    
+    ff = FeatureFactory()
+    ff.start_engine({"dialect": "sqlite", "database": str(tmp_path.joinpath("wh.db")), "schema": "main"})
+    ff.engine.execute("CREATE TABLE teams (team_id TEXT, y INTEGER)")
+    ff.engine.execute("INSERT INTO teams VALUES ('a', 1), ('b', 0)")
+    ff.engine.execute("CREATE TABLE games (team_id TEXT, win INTEGER)")
+    ff.engine.execute("INSERT INTO games VALUES ('a', 1), ('a', 1), ('b', 0)")
+    
+    ff.run(
+        leftmost_table="teams",
+        feature_table="main.features",
+        entity_id="team_id",
+        domains=["wins"],
+        date_range=["2020-01-01", "2020-12-31"],
+        query_dir=query_dir,
+    )
+    df = ff.df.sort_values("idx").reset_index(drop=True)
+    
+    assert df["idx"].tolist() == ["a_2020-01-01_2020-12-31", "b_2020-01-01_2020-12-31"]
+    assert df["sqliteQuery1_win_count"].tolist() == [2, 0]
+    
+    # Rerun replaces the feature table
+    ff.run(
+        leftmost_table="teams",
+        feature_table="main.features",
+        entity_id="team_id",
+        domains=["wins"],
+        date_range=["2020-01-01", "2020-12-31"],
+        query_dir=query_dir,
+    )
+    assert len(ff.df) == 2
+    assert ff.engine.execute("SELECT COUNT(*) FROM sqlite_master WHERE name LIKE 'coldstart_%'").scalar() == 0
+    ff.stop_engine()
+
+
+def test_duckdb_sources(tmp_path):
+    """ Local sources become views, other adapters raise ValueError """
+    
+    adapter = get_dialect("duckdb")
+    
+    assert "read_parquet" in adapter.source_sql("s.t", tmp_path.joinpath("t.parquet"))
+    assert "read_csv_auto" in adapter.source_sql("t", tmp_path.joinpath("t.csv.gz"))
+    assert "*.parquet" in adapter.source_sql("t", tmp_path)
+    assert adapter.url({}) == "duckdb:///:memory:"
+    
+    with pytest.raises(ValueError):
+        get_dialect("sqlite").register_sources(None, {"t": "t.parquet"})
+
+
+def test_duckdb_run(tmp_path):
+    """ FeatureFactory runs in-process on DuckDB over local files """
+    
+    pytest.importorskip("duckdb_engine")
+    
+    pd.DataFrame({"team_id": ["a", "b"], "y": [1, 0]}).to_csv(tmp_path.joinpath("teams.csv"), index=False)
+    games_dir = tmp_path.joinpath("games")
+    games_dir.mkdir()
+    pd.DataFrame({"team_id": ["a", "a", "b"], "win": [1, 1, 0]}).to_parquet(games_dir.joinpath("part-0.parquet"))
+    query_dir = tmp_path.joinpath("bank")
+    query_dir.mkdir()
+    query_dir.joinpath("duckdbQuery1.sql").write_text(SQLITE_QUERY.replace("sqlite", "duckdb"))
+    
+    ff = FeatureFactory()
+    ff.start_engine({
+        "dialect": "duckdb",
+        "database": str(tmp_path.joinpath("wh.duckdb")),
+        "schema": "main",
+        "sources": {"teams": tmp_path.joinpath("teams.csv"), "games": games_dir},
+    })
+    ff.run(
+        leftmost_table="teams",
+        feature_table="main.features",
+        entity_id="team_id",
+        domains=["wins"],
+        date_range=["2020-01-01", "2020-12-31"],
+        query_dir=query_dir,
+    )
+    df = ff.df.sort_values("idx").reset_index(drop=True)
+    
+    assert df["duckdbQuery1_win_count"].tolist() == [2, 0]
+    stats = ff.results_df.set_index("query_name")
+    assert stats.loc["duckdbQuery1", "rows_written"] == 2
+    assert stats.loc["duckdbQuery1", "cpu_ms"] >= 0
+    assert ff.expensive_queries(n=1, by="cpu_ms")["query_name"].tolist()[0] in stats.index
+    ff.stop_engine()
+
+
+def test_duckdb_scratch_database():
+    """ DuckDB engines without a database use a directory removed by stop_engine """
+    
+    pytest.importorskip("duckdb_engine")
+    
+    ff = FeatureFactory()
+    ff.start_engine({"dialect": "duckdb", "schema": "main"})
+    ff.engine.execute("CREATE TABLE t AS SELECT 1 AS x")
+    scratch_dir = Path(ff.scratch_dir)
+    assert scratch_dir.joinpath("coldstart.duckdb").is_file()
+    
+    # Engines passed in, e.g. by FeatureService, leave no directory behind
+    scratch_dirs = set(Path(tempfile.gettempdir()).glob("coldstart_*"))
+    shared = FeatureFactory()
+    shared.start_engine({"dialect": "duckdb", "schema": "main", "engine": ff.engine})
+    assert shared.scratch_dir is None
+    assert set(Path(tempfile.gettempdir()).glob("coldstart_*")) == scratch_dirs
+    
+    ff.stop_engine()
+    assert not scratch_dir.exists()
@@ -0,0 +1,93 @@
+# Copyright 2022 CVS Health and/or one of its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+from sqlalchemy import create_engine
+
+import pandas as pd
+
+from coldstart.export import (
+    write_parquet,
+    read_parquet,
+    rebatch,
+    iter_parquet_batches
+)
+
+
+@pytest.fixture(scope="module")
+def global_db(tmp_path_factory):
+    
+    path = tmp_path_factory.mktemp("db").joinpath("test.db")
+    engine = create_engine(f"sqlite:///{path}")
+    
+    engine.execute("CREATE TABLE feature_table (idx STRING, y INTEGER, testQuery1_win_count INTEGER)")
+    with engine.connect() as conn:
+        for i in range(10):
+            conn.execute(f"INSERT INTO feature_table VALUES ('a{i}', {i % 2}, {i})")
+        
+    return {"engine": engine}
+
+
+def test_write_parquet(global_db, tmp_path):
+    
+    engine = global_db["engine"]
+    
+    paths = write_parquet(engine, "main.feature_table", tmp_path, n_partitions=3, partition_by="range")
+    assert len(paths) == 3
+    
+    # Stale part files are replaced
+    paths = write_parquet(engine, "main.feature_table", tmp_path, n_partitions=2, partition_by="range")
+    assert len(list(tmp_path.glob("part-*.parquet"))) == 2
+    
+    
+def test_read_parquet(global_db, tmp_path):
+    """ ValueError is raised when no part files are found """
+    
+    engine = global_db["engine"]
+    
+    write_parquet(engine, "main.feature_table", tmp_path, n_partitions=3, partition_by="range")
+    df = read_parquet(tmp_path)
+    assert len(df) == 10
+    assert df["testQuery1_win_count"].sum() == 45
+    assert read_parquet(tmp_path, columns=["idx"]).columns.tolist() == ["idx"]
+    
+    with pytest.raises(ValueError):
+        read_parquet(tmp_path.joinpath("missing"))
+
+
+def test_rebatch():
+    
+    frames = [pd.DataFrame({"a": range(n)}) for n in [3, 5, 1, 4]]
+    res = [len(df) for df in rebatch(frames, 4)]
+    assert res == [4, 4, 4, 1]
+
+
+def test_iter_parquet_batches(global_db, tmp_path):
+    """ ValueError is raised when no part files are found """
+    
+    engine = global_db["engine"]
+    
+    write_parquet(engine, "main.feature_table", tmp_path, n_partitions=3, partition_by="range")
+    res = list(iter_parquet_batches(tmp_path, 4))
+    assert [len(df) for df in res] == [4, 4, 2]
+    assert pd.concat(res)["idx"].tolist() == [f"a{i}" for i in range(10)]
+    
+    res_1 = pd.concat(iter_parquet_batches(tmp_path, 4, columns=["idx"], shuffle_seed=1))
+    res_2 = pd.concat(iter_parquet_batches(tmp_path, 4, columns=["idx"], shuffle_seed=1))
+    assert res_1.columns.tolist() == ["idx"]
+    assert res_1["idx"].tolist() == res_2["idx"].tolist()
+    assert sorted(res_1["idx"].tolist()) == sorted(f"a{i}" for i in range(10))
+    
+    with pytest.raises(ValueError):
+        iter_parquet_batches(tmp_path.joinpath("missing"), 4)
@@ -0,0 +1,45 @@
+# Copyright 2022 CVS Health and/or one of its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import json
+import subprocess
+from pathlib import Path
+
+
+HEAVY_MODULES = ["pandas", "numpy", "sqlalchemy", "tqdm", "pyarrow", "dask"]
+
+CATALOG_SCRIPT = """
+import sys, json
+import coldstart
+import coldstart.parse
+from coldstart import FeatureFactory
+ff = FeatureFactory()
+domains = ff.list_domains(dialect="bigquery", entity_id="team_id", query_dir=sys.argv[1])
+print(json.dumps([m for m in sys.argv[2:] if m in sys.modules]))
+"""
+
+
+def test_catalog_imports():
+    """ Catalog operations do not import pandas, NumPy, SQLAlchemy or tqdm """
+    
+    query_dir = Path(__file__).parent.joinpath("query_bank")
+    output = subprocess.run(
+        [sys.executable, "-c", CATALOG_SCRIPT, str(query_dir)] + HEAVY_MODULES,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    
+    assert json.loads(output.stdout.strip().splitlines()[-1]) == []
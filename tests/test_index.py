@@ -0,0 +1,59 @@
+# Copyright 2022 CVS Health and/or one of its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from coldstart.index import write_index, FeatureIndex
+
+
+def test_feature_index(tmp_path):
+    """ Rows are found by idx with typed, nullable and dictionary-encoded columns """
+    
+    df = pd.DataFrame({
+        "idx": ["c_1", "a_1", "b_1", "é_1"],
+        "y": [1, 0, 1, 0],
+        "f_float": [0.5, np.nan, 2.0, 3.0],
+        "f_int": pd.array([1, None, 3, 4], dtype="Int64"),
+        "f_str": ["x", None, "y", "x"],
+        "f_date": pd.to_datetime(["2020-01-01", None, "2020-01-03", "2020-01-04"]),
+    })
+    path = write_index(df, tmp_path.joinpath("features.idx"))
+    index = FeatureIndex(path)
+    
+    assert len(index) == 4
+    assert index.locate(["b_1", "z_1", "a_1_longer_than_any_key"]).tolist() == [1, -1, -1]
+    assert np.shares_memory(index.column("y"), index.column("y"))
+    assert index.column("y").flags.writeable is False
+    
+    row = index.get("é_1")
+    assert row["y"] == 0 and row["f_int"] == 4 and row["f_str"] == "x"
+    assert index.get("a_1")["f_int"] is None
+    assert index.get("missing") is None
+    
+    batch = index.get_many(["c_1", "missing", "a_1"], columns=["f_float", "f_str", "f_date"])
+    assert batch.index.tolist() == ["c_1", "missing", "a_1"]
+    assert batch["f_str"].iloc[0] == "x" and batch["f_str"].iloc[1:].isna().all()
+    assert np.isnan(batch["f_float"].iloc[1]) and np.isnan(batch["f_float"].iloc[2])
+    assert batch["f_date"].iloc[0] == pd.Timestamp("2020-01-01") and pd.isna(batch["f_date"].iloc[2])
+    assert sorted(index.dictionary("f_str")) == ["x", "y"]
+    index.close()
+    
+    with pytest.raises(ValueError):
+        write_index(pd.DataFrame({"idx": ["a", "a"]}), tmp_path.joinpath("dup.idx"))
+    
+    empty = FeatureIndex(write_index(df.iloc[:0], tmp_path.joinpath("empty.idx")))
+    assert empty.get("a_1") is None
+    assert len(empty.get_many(["a_1"])) == 1
@@ -22,6 +22,9 @@ from coldstart.parse import (
     list_queries,
     get_queries_from_domains,
     get_queries,
+    resolve_features,
+    load_manifest,
+    index_queries,
 )
 
 
@@ -52,14 +55,10 @@ def test_list_entities_2(global_query_bank):
     """ Dialect cannot be None, dialect not in list of valid dialects """
     
     query_bank = global_query_bank["query_folder"]
-    try:
+    with pytest.raises(ValueError):
         list_entities(dialect=None, query_dir=query_bank)
-    except ValueError:
-        assert True
-    try:
+    with pytest.raises(ValueError):
         list_entities(dialect="bigquery23", query_dir=query_bank)
-    except ValueError:
-        assert True
 
 
 def test_list_domains_1(global_query_bank):
@@ -73,22 +72,14 @@ def test_list_domains_2(global_query_bank):
     """ ValueError is raised when entity_id is None, when entity_id not in list of valid entities, when dialect is None, when dialect not in list of valid dialects"""
     
     query_bank = global_query_bank["query_folder"]
-    try:
+    with pytest.raises(ValueError):
         list_domains(entity_id=None, query_dir=query_bank)
-    except ValueError:
-        assert True
-    try:
+    with pytest.raises(ValueError):
         list_domains(entity_id="NCAA", query_dir=query_bank)
-    except ValueError:
-        assert True
-    try:
+    with pytest.raises(ValueError):
         list_domains(entity_id="team_id", dialect=None, query_dir=query_bank)
-    except ValueError:
-        assert True
-    try:
+    with pytest.raises(ValueError):
         list_domains(entity_id="team_id", dialect="bigquery23", query_dir=query_bank)
-    except ValueError:
-        assert True
         
         
 def test_list_queries_1(global_query_bank):
@@ -103,26 +94,16 @@ def test_list_queries_2(global_query_bank):
     """ ValueError is raised when dialect is None, dialect not in valid list, entity_id is None, entity not in valid list, domain not in valid list"""
     
     query_bank = global_query_bank["query_folder"]
-    try:
+    with pytest.raises(ValueError):
         list_queries(dialect=None, query_dir=query_bank)
-    except ValueError:
-        assert True
-    try:
+    with pytest.raises(ValueError):
         list_queries(dialect="bigquery23", query_dir=query_bank)
-    except ValueError:
-        assert True
-    try:
+    with pytest.raises(ValueError):
         list_queries(dialect="bigquery", entity_id=None, query_dir=query_bank)
-    except ValueError:
-        assert True
-    try:
+    with pytest.raises(ValueError):
         list_queries(dialect="bigquery", entity_id="NCAA", query_dir=query_bank)
-    except ValueError:
-        assert True
-    try:
+    with pytest.raises(ValueError):
         list_queries(dialect="bigquery", entity_id="team_id", domains=["NCAA"], query_dir=query_bank)
-    except ValueError:
-        assert True
         
 
 def test_get_queries_from_domains_1(global_query_bank):
@@ -143,26 +124,16 @@ def test_get_queries_from_domains_2(global_query_bank):
     domain not in list of valid domains"""
     
     query_bank = global_query_bank["query_folder"]
-    try:
+    with pytest.raises(ValueError):
         get_queries_from_domains(dialect=None, query_dir=query_bank)
-    except ValueError:
-        assert True
-    try:
+    with pytest.raises(ValueError):
         get_queries_from_domains(dialect="bigquery23", query_dir=query_bank)
-    except ValueError:
-        assert True
-    try:
+    with pytest.raises(ValueError):
         get_queries_from_domains(dialect="bigquery", entity_id=None, query_dir=query_bank)
-    except ValueError:
-        assert True
-    try:
+    with pytest.raises(ValueError):
         get_queries_from_domains(dialect="bigquery", entity_id="NCAA", query_dir=query_bank)
-    except ValueError:
-        assert True
-    try:
+    with pytest.raises(ValueError):
         get_queries_from_domains(dialect="bigquery", entity_id="team_id", domains=["NCAA"], query_dir=query_bank)
-    except ValueError:
-        assert True
     
     
 def test_get_queries_1(global_query_bank):
@@ -183,23 +154,63 @@ def test_get_queries_2(global_query_bank):
     query not in list of available queries"""
     
     query_bank = global_query_bank["query_folder"]
-    try:
+    with pytest.raises(ValueError):
         get_queries(dialect=None, query_dir=query_bank)
-    except ValueError:
-        assert True
-    try:
+    with pytest.raises(ValueError):
         get_queries(dialect="bigquery23", query_dir=query_bank)
-    except ValueError:
-        assert True
-    try:
+    with pytest.raises(ValueError):
         get_queries(dialect="bigquery", entity_id=None, query_dir=query_bank)
-    except ValueError:
-        assert True
-    try:
+    with pytest.raises(ValueError):
         get_queries(dialect="bigquery", entity_id="NCAA", query_dir=query_bank)
-    except ValueError:
-        assert True
-    try:
+    with pytest.raises(ValueError):
         get_queries(dialect="bigquery", entity_id="team_id", queries=["testQuerynotavailable"], query_dir=query_bank)
-    except ValueError:
-        assert True
\ No newline at end of file
+
+
+def test_resolve_features():
+    """ ValueError is raised when a feature does not match any query """
+    
+    queries = ["testQuery1", "testQuery2", "testQuery12"]
+    
+    res = resolve_features(["testQuery1_win_count", "testQuery12_*"], queries)
+    assert res == {"testQuery1": ["win_count"], "testQuery12": ["*"]}
+    
+    res = resolve_features(["testQuery?"], queries)
+    assert res == {"testQuery1": ["*"], "testQuery2": ["*"]}
+    
+    # Bare query names select every column
+    res = resolve_features(["testQuery2", "testQuery1_win_*"], queries)
+    assert res == {"testQuery2": ["*"], "testQuery1": ["win_*"]}
+    
+    with pytest.raises(ValueError):
+        resolve_features(["otherQuery_win_count"], queries)
+
+
+def test_load_manifest(tmp_path):
+    """ ValueError is raised when no manifest is found """
+    
+    tmp_path.joinpath("manifest.json").write_text('{"queries": ["testQuery1"], "features": ["testQuery1_*"]}')
+    
+    assert load_manifest(tmp_path)["queries"] == ["testQuery1"]
+    assert load_manifest(tmp_path.joinpath("manifest.json"))["features"] == ["testQuery1_*"]
+    
+    with pytest.raises(ValueError):
+        load_manifest(tmp_path.joinpath("missing"))
+
+
+def test_index_queries(tmp_path):
+    """ Only changed queries are re-read and the index is persisted to cache_path """
+    
+    query_dir = tmp_path.joinpath("bank")
+    query_dir.mkdir()
+    path = query_dir.joinpath("q1.sql")
+    path.write_text("-- DIALECT: sqlite\n-- ENTITY: team_id\n-- DOMAIN: wins\nSELECT 1")
+    cache_path = tmp_path.joinpath("cache", "catalog.json")
+    
+    index = index_queries(query_dir, cache_path=cache_path)
+    assert [(e["query_name"], e["dialect"], e["domain"]) for e in index] == [("q1", "sqlite", "wins")]
+    assert cache_path.is_file()
+    assert index_queries(query_dir)[0] is index[0]
+    
+    path.write_text("-- DIALECT: sqlite\n-- ENTITY: team_id\n-- DOMAIN: losses\nSELECT 1")
+    assert index_queries(query_dir, cache_path=cache_path)[0]["domain"] == "losses"
+    assert "losses" in cache_path.read_text()
@@ -14,9 +14,16 @@
 
 import pytest
 import os, shutil
+import json
+import threading
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 from pathlib import Path
-from sqlalchemy import create_engine 
+from decimal import Decimal
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
 
 from coldstart.query import (
     stage_leftmost_table, 
@@ -25,7 +32,28 @@ from coldstart.query import (
     name_table, 
     stage_leftmost_table,
     freeze_queries,
-    prep_join_query
+    prep_join_query,
+    prep_partition_queries,
+    lazy_dataframe,
+    iter_query,
+    prefetch,
+    count_unique,
+    downcast_dataframe,
+    arrow_type,
+    typed_frame,
+    prep_join_schema,
+    capture_schema,
+    collect_captured_metadata,
+    parse_table_time,
+    create_table_sql,
+    list_orphaned_tables,
+    sweep_tables,
+    SessionEngine,
+    template_queries,
+    multi_query,
+    default_workers,
+    results_frame,
+    most_expensive
 )
 
 
@@ -156,3 +184,380 @@ def test_prep_join_query():
     res = prep_join_query("my_schema", table_df, "my_schema.final_table")
     
     assert "CREATE OR REPLACE TABLE my_schema.final_table AS SELECT LMOST.idx, LMOST.y" in res[0]
+
+
+def test_prep_partition_queries():
+    """ ValueError is raised when n_partitions is invalid, row_count is missing for range partitions, partition_by is invalid """
+    
+    res = prep_partition_queries("my_schema.final_table", 4, partition_by="hash")
+    assert len(res) == 4
+    assert "MOD(MOD(FARM_FINGERPRINT(idx), 4) + 4, 4) = 3" in res[3]
+    
+    res = prep_partition_queries("my_schema.final_table", 4, partition_by="range", row_count=10)
+    assert len(res) == 4
+    assert "LIMIT 3 OFFSET 9" in res[3]
+    
+    with pytest.raises(ValueError):
+        prep_partition_queries("my_schema.final_table", 0)
+    with pytest.raises(ValueError):
+        prep_partition_queries("my_schema.final_table", 4, partition_by="range")
+    with pytest.raises(ValueError):
+        prep_partition_queries("my_schema.final_table", 4, partition_by="random")
+
+
+def test_lazy_dataframe(global_db):
+    
+    pytest.importorskip("dask")
+    engine = global_db["engine"]
+    
+    engine.execute("CREATE TABLE test_db.lazy_table AS SELECT team_id AS idx, y FROM test_db.left_table")
+    ddf = lazy_dataframe(engine, "test_db.lazy_table", 4, partition_by="range")
+    
+    assert ddf.npartitions == 3
+    assert list(ddf.columns) == ["idx", "y"]
+    assert len(ddf.compute(scheduler="synchronous")) == 6
+    
+    # Partitions share the dtypes of meta
+    column_types = {"idx": "STRING", "y": None}
+    ddf = lazy_dataframe(engine, "test_db.lazy_table", 2, partition_by="range", column_types=column_types)
+    df = ddf.compute(scheduler="synchronous")
+    assert df.dtypes.to_dict() == ddf.dtypes.to_dict()
+    assert sorted(df["y"].tolist()) == [0, 0, 1, 1, 1, 1]
+
+
+def test_iter_query(global_db):
+    
+    engine = global_db["engine"]
+    
+    sql = """
+    SELECT *
+    FROM test_db.left_table
+    """
+    
+    res = [len(df) for df in iter_query(engine, sql, 4)]
+    assert res == [4, 2]
+
+
+def test_prefetch():
+    """ Errors raised while prefetching are raised to the consumer """
+    
+    assert list(prefetch(iter(range(5)), depth=2)) == [0, 1, 2, 3, 4]
+    
+    def failing():
+        yield 1
+        raise KeyError("failed")
+    
+    with pytest.raises(KeyError):
+        list(prefetch(failing()))
+    
+    # Stopping early closes the iterable
+    class Chunks:
+        def __init__(self):
+            self.items = iter(range(100))
+            self.closed = threading.Event()
+        def __iter__(self):
+            return self
+        def __next__(self):
+            return next(self.items)
+        def close(self):
+            self.closed.set()
+    
+    chunks = Chunks()
+    items = prefetch(chunks)
+    assert next(items) == 0
+    items.close()
+    assert chunks.closed.wait(timeout=5)
+
+
+def test_count_unique():
+    
+    assert count_unique(pd.Series(["a", "b", "a", None, None])) == 3
+    assert count_unique(pd.Series([1, 2, 2])) == 2
+
+
+def test_downcast_dataframe():
+    
+    df = pd.DataFrame({
+        "a": np.arange(100, dtype=np.int64),
+        "b": pd.array([1, None] * 50, dtype="Int64"),
+        "c": ["x", "y"] * 50,
+        "d": np.linspace(0, 1, 100),
+        "e": pd.Series([70000, None] * 50, dtype=object),
+        "min_date": ["2020-01-01"] * 100,
+    })
+    
+    res, report = downcast_dataframe(df, float_tolerance=1e-6)
+    
+    assert res is df
+    assert res["a"].dtype == np.int8
+    assert str(res["b"].dtype) == "Int8"
+    assert str(res["c"].dtype) == "category"
+    assert res["d"].dtype == np.float32
+    assert str(res["e"].dtype) == "Int32"
+    assert str(res["min_date"].dtype) != "category"
+    assert report["column_name"].tolist() == df.columns.tolist()
+    assert (report["bytes_after"] <= report["bytes_before"]).all()
+    
+    res, report = downcast_dataframe(pd.DataFrame({"d": [0.1, 1e-12]}), float_tolerance=1e-12)
+    assert res["d"].dtype == np.float64
+
+
+def test_arrow_type():
+    
+    assert str(arrow_type("INT64")) == "int64"
+    assert str(arrow_type("string(10)")) == "string"
+    assert arrow_type("STRUCT<a INT64>") is None
+    assert arrow_type(None) is None
+    assert arrow_type("NUMERIC(10, 2)") == pa.decimal128(10, 2)
+    assert arrow_type("BIGNUMERIC(76,38)") == pa.decimal256(76, 38)
+    assert arrow_type("DECIMAL(18)") == pa.decimal128(18, 0)
+    assert arrow_type("NUMERIC") is None
+    
+    # Fixed-point values are kept exact
+    df = typed_frame([(Decimal("0.10"),), (Decimal("12345678901234567.89"),)], ["n"], {"n": "NUMERIC(19, 2)"})
+    assert df["n"].tolist() == [Decimal("0.10"), Decimal("12345678901234567.89")]
+
+
+def test_typed_frame():
+    
+    rows = [
+        ("a_2022", 1, True, "2022-01-01", "x", 1.5),
+        ("b_2022", None, None, "2022-01-02", "x", None),
+        ("c_2022", 3, False, None, "x", 2.5),
+    ]
+    columns = ["idx", "n", "flag", "dt", "cat", "f"]
+    column_types = {
+        "idx": "STRING",
+        "n": "INT64",
+        "flag": "BOOL",
+        "dt": "DATE",
+        "cat": "STRING",
+        "f": "FLOAT64",
+    }
+    
+    df = typed_frame(rows, columns, column_types)
+    
+    assert str(df["idx"].dtype) == "string"
+    assert str(df["n"].dtype) == "Int64"
+    assert str(df["flag"].dtype) == "boolean"
+    assert str(df["dt"].dtype).startswith("datetime64")
+    assert str(df["cat"].dtype) == "category"
+    assert df["f"].dtype == np.float64
+    assert len(typed_frame([], columns, column_types)) == 0
+
+
+def test_prep_join_schema():
+    
+    data = {}
+    data[0] = ["my_schema.coldstart_leftMostTable_2022_tmp", "idx", "STRING"]
+    data[1] = ["my_schema.coldstart_leftMostTable_2022_tmp", "team_id", "STRING"]
+    data[2] = ["my_schema.coldstart_leftMostTable_2022_tmp", "y", "INT64"]
+    data[3] = ["my_schema.coldstart_testQuery1_2022_tmp", "idx", "STRING"]
+    data[4] = ["my_schema.coldstart_testQuery1_2022_tmp", "win_count", "INT64"]
+    
+    table_df = pd.DataFrame.from_dict(
+        data,
+        orient="index",
+        columns=["table_name", "column_name", "data_type"]
+    )
+    
+    res = prep_join_schema(table_df)
+    assert res == {"idx": "STRING", "y": "INT64", "testQuery1_win_count": "INT64"}
+    
+    res = prep_join_schema(table_df[["table_name", "column_name"]])
+    assert res["testQuery1_win_count"] is None
+
+
+def test_capture_schema(global_db):
+    
+    engine = global_db["engine"]
+    
+    res = capture_schema(engine, "test_db.left_table")
+    assert [c["column_name"] for c in res] == ["team_id", "y"]
+    assert res[0]["is_nullable"] == "NO"
+    assert res[1]["data_type"] == "INTEGER"
+    
+    sql = """
+    CREATE TABLE test_db.captured_table AS
+    SELECT team_id AS idx, y AS win_count
+    FROM test_db.left_table
+    """
+    
+    test_query_tuple = ("testQuery0", engine, sql, False, "test_db.captured_table")
+    
+    result = run_threaded_query(test_query_tuple)
+    
+    assert result[1] == "SUCCESS"
+    assert result[3]["table_name"] == "test_db.captured_table"
+    assert [c["column_name"] for c in result[3]["columns"]] == ["idx", "win_count"]
+
+
+def test_collect_captured_metadata():
+    
+    columns = [{"column_name": "idx", "data_type": "STRING", "is_nullable": "YES"}]
+    results = [
+        ("testQuery1", "SUCCESS", 1, {"table_name": "s.t1", "columns": columns}),
+        ("testQuery2", "FAILURE", 0, {}),
+    ]
+    
+    res = collect_captured_metadata(results)
+    assert res.columns.tolist() == ["table_name", "column_name", "data_type", "is_nullable"]
+    assert res["table_name"].tolist() == ["s.t1"]
+    
+    results.append(("leftMostTable", "SUCCESS", 1))
+    assert collect_captured_metadata(results) is None
+
+
+def test_prep_join_query_features():
+    
+    data = {}
+    data[0] = ["my_schema.coldstart_leftMostTable_2022_tmp", "idx"]
+    data[1] = ["my_schema.coldstart_leftMostTable_2022_tmp", "y"]
+    data[2] = ["my_schema.coldstart_testQuery2_2022_tmp", "idx"]
+    data[3] = ["my_schema.coldstart_testQuery2_2022_tmp", "loss_count"]
+    data[4] = ["my_schema.coldstart_testQuery1_2022_tmp", "idx"]
+    data[5] = ["my_schema.coldstart_testQuery1_2022_tmp", "win_count"]
+    data[6] = ["my_schema.coldstart_testQuery1_2022_tmp", "game_count"]
+    
+    table_df = pd.DataFrame.from_dict(
+        data,
+        orient="index",
+        columns=["table_name", "column_name"]
+    )
+    res = prep_join_query("my_schema", table_df, "my_schema.final_table", features=["testQuery1_win*"])
+    
+    assert "testQuery1.win_count AS testQuery1_win_count" in res[0]
+    assert "game_count" not in res[0]
+    assert "testQuery2" not in res[0]
+    assert list(prep_join_schema(table_df, features=["testQuery1_win*"])) == ["idx", "y", "testQuery1_win_count"]
+
+
+def test_freeze_queries_manifest():
+    
+    query_dir = str(Path(__file__).parent/"query_bank")
+    export_dir = Path(__file__).parent/"test_export_manifest"
+    query_dict = {"testQuery1": "Select query"}
+    
+    freeze_queries(query_dir, export_dir, query_dict, features=["testQuery1_*"])
+    
+    manifest = json.loads((export_dir/"manifest.json").read_text())
+    assert manifest == {"queries": ["testQuery1"], "features": ["testQuery1_*"]}
+    
+    shutil.rmtree(export_dir)
+
+
+def test_parse_table_time():
+    
+    name = name_table("test_schema", "testQuery1")
+    assert (datetime.now() - parse_table_time(name)).total_seconds() < 60
+    assert parse_table_time("test_schema.coldstart_testQuery1_2022_tmp") is None
+    assert parse_table_time("test_schema.left_table") is None
+
+
+def test_create_table_sql():
+    
+    assert create_table_sql("s.t") == "CREATE TABLE s.t AS "
+    assert "OPTIONS(expiration_timestamp=TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL 6 HOUR))" in create_table_sql("s.t", 6)
+
+
+def test_sweep_tables(tmp_path):
+    
+    engine = create_engine(f"sqlite:///{tmp_path.joinpath('sweep.db')}")
+    engine.execute("CREATE TABLE coldstart_testQuery1_20200101000000000000_tmp (idx STRING)")
+    engine.execute("CREATE TABLE coldstart_testQuery2_20200101000000000000_tmp (idx STRING)")
+    engine.execute(f"CREATE TABLE {name_table('main', 'testQuery3').split('.')[1]} (idx STRING)")
+    engine.execute("CREATE TABLE coldstart_final_20200101000000000000_tmp (idx STRING)")
+    engine.execute("CREATE TABLE left_table (idx STRING)")
+    
+    res = list_orphaned_tables(engine, "main", timedelta(hours=24))
+    assert res == [
+        "main.coldstart_testQuery1_20200101000000000000_tmp",
+        "main.coldstart_testQuery2_20200101000000000000_tmp",
+    ]
+    
+    res = sweep_tables(engine, "main", timedelta(hours=24), dry_run=True)
+    assert [r[1] for r in res] == ["SKIPPED", "SKIPPED"]
+    
+    res = sweep_tables(engine, "main", timedelta(hours=24), batch_size=1)
+    assert [r[1] for r in res] == ["SUCCESS", "SUCCESS"]
+    assert list_orphaned_tables(engine, "main", timedelta(hours=24)) == []
+    assert len(list_orphaned_tables(engine, "main", timedelta(hours=0))) == 1
+
+
+def test_session_engine(tmp_path):
+    
+    engine = create_engine(
+        f"sqlite:///{tmp_path.joinpath('session.db')}",
+        connect_args={"check_same_thread": False}
+    )
+    engine.execute("CREATE TABLE left_table (idx STRING, y INTEGER)")
+    engine.execute("INSERT INTO left_table VALUES ('a', 1)")
+    session = SessionEngine(engine)
+    
+    staged_table = name_table("main", "leftMostTable", temporary=True)
+    assert staged_table.startswith("coldstart_leftMostTable_")
+    assert create_table_sql(staged_table, temporary=True).startswith("CREATE TEMP TABLE")
+    run_query(session, f"CREATE TEMP TABLE {staged_table} AS SELECT * FROM left_table", return_df=False)
+    
+    query_dict = {
+        "testQuery1": {"SQL": "SELECT idx, y AS win_count FROM {LEFTMOST_TABLE}"},
+        "testQuery2": {"SQL": "SELECT idx, y AS loss_count FROM {LEFTMOST_TABLE}"},
+    }
+    table_dict, query_tuples = template_queries(session, "main", staged_table, query_dict, temporary=True)
+    results = multi_query(query_tuples)
+    
+    assert [r[1] for r in results] == ["SUCCESS", "SUCCESS"]
+    assert [c["column_name"] for c in results[0][3]["columns"]] == ["idx", "win_count"]
+    
+    # Temporary tables are invisible to other connections and vanish with the session
+    with pytest.raises(Exception):
+        run_query(engine, f"SELECT * FROM {table_dict['testQuery1']}")
+    assert len(run_query(session, f"SELECT * FROM {table_dict['testQuery1']}")) == 1
+    session.close()
+    assert session.connection is None
+
+
+def test_multi_query_pool(tmp_path):
+    """ Each worker reuses one pooled connection and pool waits are reported """
+    
+    engine = create_engine(
+        f"sqlite:///{tmp_path.joinpath('pool.db')}",
+        connect_args={"check_same_thread": False},
+        poolclass=QueuePool,
+        pool_size=2,
+        max_overflow=0
+    )
+    engine.execute("CREATE TABLE left_table (idx STRING, y INTEGER)")
+    checkouts = []
+    event.listen(engine, "checkout", lambda *args: checkouts.append(1))
+    
+    query_tuples = [
+        (f"testQuery{i}", engine, f"CREATE TABLE t{i} AS SELECT * FROM left_table", False, f"t{i}")
+        for i in range(6)
+    ]
+    results = multi_query(query_tuples, max_workers=2)
+    
+    assert [r[1] for r in results] == ["SUCCESS"] * 6
+    assert [r[0] for r in results] == [f"testQuery{i}" for i in range(6)]
+    assert all(r[3]["pool_wait"] >= 0 for r in results)
+    assert [c["column_name"] for c in results[5][3]["columns"]] == ["idx", "y"]
+    assert len(checkouts) <= 2
+    assert engine.pool.checkedout() == 0
+    assert 1 <= default_workers() <= 32
+
+
+def test_most_expensive():
+    """ Queries rank by engine statistics, falling back to run time """
+    
+    results = [
+        ("testQuery1", "SUCCESS", 3, {"stats": {"bytes_billed": 10}}),
+        ("testQuery2", "SUCCESS", 1, {"stats": {"bytes_billed": 30}, "pool_wait": 0.5}),
+        ("testQuery3", "FAILURE", 0, {}),
+        ("leftMostTable", "SUCCESS", 2),
+    ]
+    
+    df = results_frame(results, {"testQuery1": "s.t1"})
+    assert df["table_name"].tolist()[:2] == ["s.t1", "testQuery2"]
+    assert df["pool_wait"].tolist()[1] == 0.5
+    assert most_expensive(df, n=1)["query_name"].tolist() == ["testQuery2"]
+    assert most_expensive(df, n=2, by="cpu_ms")["query_name"].tolist() == ["testQuery1", "leftMostTable"]
@@ -0,0 +1,146 @@
+# Copyright 2022 CVS Health and/or one of its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import pytest
+import threading
+import urllib.error
+import urllib.request
+
+from coldstart.simulate import Simulator
+from coldstart.service import FeatureService, SharedQueries, make_server
+
+
+SIM_QUERY = """-- DIALECT: sqlite
+-- ENTITY: team_id
+-- DOMAIN: wins
+SELECT
+    LMT.idx,
+    SUM(G.win) AS win_count
+FROM
+    {LEFTMOST_TABLE} AS LMT
+    LEFT JOIN games AS G
+        ON LMT.team_id = G.team_id
+GROUP BY
+    LMT.idx
+"""
+
+
+def make_service(tmp_path, profiles=None):
+    
+    query_dir = tmp_path.joinpath("bank")
+    query_dir.mkdir()
+    query_dir.joinpath("simQuery1.sql").write_text(SIM_QUERY)
+    query_dir.joinpath("simQuery2.sql").write_text(SIM_QUERY.replace("SUM", "MAX"))
+    
+    sim = Simulator(profiles=profiles)
+    sim.engine.execute("CREATE TABLE teams (team_id TEXT, y INTEGER)")
+    sim.engine.execute("INSERT INTO teams VALUES ('a', 1), ('b', 0)")
+    sim.engine.execute("CREATE TABLE games (team_id TEXT, win INTEGER)")
+    sim.engine.execute("INSERT INTO games VALUES ('a', 1), ('a', 1), ('b', 0)")
+    db_spec = {"dialect": "sqlite", "schema": "main", "engine": sim.engine}
+    return sim, FeatureService(db_spec, max_concurrency=4, query_dir=str(query_dir))
+
+
+RUN_KWARGS = {
+    "leftmost_table": "teams",
+    "entity_id": "team_id",
+    "domains": ["wins"],
+    "date_range": ["2020-01-01", "2020-12-31"],
+    "return_df": True,
+}
+
+
+def test_shared_queries():
+    """ Failed queries are forgotten and tables are released by the last holder """
+    
+    shared = SharedQueries(2)
+    a, b = [], []
+    ok = ("q1", "SUCCESS", 0, {"table_name": "main.t1"})
+    
+    assert shared.execute("k1", lambda: ok, a) == ok
+    assert shared.execute("k1", lambda: 1 / 0, b) == ok
+    assert shared.release(a) == []
+    assert shared.release(b) == ["main.t1"]
+    
+    shared.execute("k2", lambda: ("q2", "FAILURE", 0, {}), a)
+    assert shared.claim("k2")[1] is True
+
+
+def test_service_coalescing(tmp_path):
+    """ Identical concurrent runs execute each query once and drop shared tables afterwards """
+    
+    sim, service = make_service(tmp_path, profiles={"simQuery*": {"latency": 0.3}, "leftMostTable": {"latency": 0.3}})
+    
+    reports = [None, None]
+    def request(i):
+        reports[i] = service.run(**RUN_KWARGS)
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert [r["status"] for r in reports] == ["SUCCESS", "SUCCESS"]
+    assert reports[0]["data"] == reports[1]["data"]
+    assert sim.counts["leftMostTable"] == 1
+    assert sim.counts["simQuery1"] == 1 and sim.counts["simQuery2"] == 1
+    assert sim.engine.execute("SELECT COUNT(*) FROM sqlite_master WHERE name LIKE 'coldstart_%' AND name NOT LIKE 'coldstart_final_%'").scalar() == 0
+    assert service.status()["shared_queries"] == 0
+    service.stop()
+    sim.dispose()
+
+
+def test_service_http(tmp_path):
+    """ Runs are served over HTTP """
+    
+    sim, service = make_service(tmp_path)
+    server = make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    
+    status = json.loads(urllib.request.urlopen(f"{url}/status").read())
+    assert status["queries"] == 2
+    
+    request = urllib.request.Request(f"{url}/run", data=json.dumps(RUN_KWARGS).encode(), method="POST")
+    report = json.loads(urllib.request.urlopen(request).read())
+    assert report["status"] == "SUCCESS"
+    assert sorted(r["simQuery1_win_count"] for r in report["data"]) == [0, 2]
+    
+    # Server-side arguments are rejected
+    body = json.dumps(dict(RUN_KWARGS, query_dir="/", output_dir="/tmp")).encode()
+    request = urllib.request.Request(f"{url}/run", data=body, method="POST")
+    with pytest.raises(urllib.error.HTTPError) as e:
+        urllib.request.urlopen(request)
+    assert e.value.code == 400
+    assert "output_dir, query_dir" in json.loads(e.value.read())["error"]
+    
+    # Arguments interpolated into SQL are checked
+    for bad in [
+        {"feature_table": "main.teams"},
+        {"leftmost_table": "teams; DROP TABLE games"},
+        {"entity_id": "team_id FROM teams --"},
+        {"date_range": ["2020-01-01", "2020-12-31' OR '1'='1"]},
+    ]:
+        request = urllib.request.Request(f"{url}/run", data=json.dumps(dict(RUN_KWARGS, **bad)).encode(), method="POST")
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(request)
+        assert e.value.code == 400
+    assert sim.engine.execute("SELECT COUNT(*) FROM games").scalar() == 3
+    
+    server.shutdown()
+    server.server_close()
+    service.stop()
+    sim.dispose()
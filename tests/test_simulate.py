@@ -0,0 +1,172 @@
+# Copyright 2022 CVS Health and/or one of its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import pytest
+from pathlib import Path
+
+from coldstart.build import FeatureFactory
+from coldstart.query import multi_query
+from coldstart.simulate import Simulator, SimulatedError, ThrottlingError
+
+
+def make_tuples(sim, n):
+    
+    sim.engine.execute("CREATE TABLE left_table (idx TEXT, y INTEGER)")
+    sim.engine.execute("INSERT INTO left_table VALUES ('a', 1), ('b', 0)")
+    return [
+        (f"testQuery{i}", sim.engine, f"CREATE TABLE main.coldstart_testQuery{i}_20220101000000000000_tmp AS SELECT * FROM left_table", False)
+        for i in range(n)
+    ]
+
+
+def test_simulator_determinism():
+    """ Same seed gives the same latencies and failures regardless of scheduling """
+    
+    profiles = {"testQuery*": {"latency": (0.001, 0.01), "failure_rate": 0.5}}
+    
+    runs = []
+    for max_workers in [1, 4]:
+        sim = Simulator(profiles=profiles, seed=7)
+        results = multi_query(make_tuples(sim, 8), max_workers=max_workers)
+        runs.append([r[1] for r in results])
+        scratch_dir = Path(sim.scratch_dir)
+        sim.dispose()
+        assert not scratch_dir.exists()
+        
+    assert runs[0] == runs[1]
+    assert "FAILURE" in runs[0] and "SUCCESS" in runs[0]
+    assert Simulator(seed=1).draw("testQuery1", 0) == Simulator(seed=1).draw("testQuery1", 0)
+    assert Simulator().label("DROP TABLE IF EXISTS x") == "DROP"
+
+
+def test_simulator_concurrency():
+    """ Concurrency is recorded over time and capped by max_concurrency """
+    
+    sim = Simulator(profiles={"testQuery*": {"latency": 0.05}})
+    results = multi_query(make_tuples(sim, 6), max_workers=3)
+    
+    assert [r[1] for r in results] == ["SUCCESS"] * 6
+    assert 1 < sim.max_active() <= 3
+    assert set(sim.timeline()["event"]) == {"start", "end"}
+    sim.dispose()
+    
+    sim = Simulator(profiles={"testQuery*": {"latency": 0.05}}, max_concurrency=1)
+    results = multi_query(make_tuples(sim, 4), max_workers=4)
+    
+    assert "FAILURE" in [r[1] for r in results]
+    assert "throttled" in set(sim.timeline()["event"])
+    assert sim.max_active() == 1
+    assert issubclass(ThrottlingError, SimulatedError)
+    sim.dispose()
+
+
+def test_simulated_run(tmp_path):
+    """ FeatureFactory runs against an injected simulated engine """
+    
+    query_dir = tmp_path.joinpath("bank")
+    query_dir.mkdir()
+    for i, sql in enumerate(["SUM(y) AS y_sum", "MAX(y) AS y_max"]):
+        query_dir.joinpath(f"simQuery{i}.sql").write_text(
+            "-- DIALECT: sqlite\n-- ENTITY: team_id\n-- DOMAIN: wins\n"
+            f"SELECT idx, {sql} FROM {{LEFTMOST_TABLE}} GROUP BY idx\n"
+        )
+    
+    sim = Simulator(profiles={"simQuery1": {"failure_rate": 1.0}, "*": {"latency": 0.001}})
+    sim.engine.execute("CREATE TABLE teams (team_id TEXT, y INTEGER)")
+    sim.engine.execute("INSERT INTO teams VALUES ('a', 1), ('b', 0)")
+    
+    ff = FeatureFactory()
+    ff.start_engine({"dialect": "sqlite", "schema": "main", "engine": sim.engine})
+    ff.run(
+        leftmost_table="teams",
+        feature_table="main.features",
+        entity_id="team_id",
+        domains=["wins"],
+        date_range=["2020-01-01", "2020-12-31"],
+        query_dir=query_dir,
+    )
+    
+    assert ff.engine is sim.engine
+    assert "simQuery0_y_sum" in ff.df.columns
+    assert "simQuery1_y_max" not in ff.df.columns
+    assert "simQuery1" in set(sim.timeline()["label"])
+    
+    with pytest.raises(ValueError):
+        ff.run(
+            leftmost_table="teams",
+            feature_table="main.features",
+            entity_id="team_id",
+            domains=["wins"],
+            date_range=["2020-01-01", "2020-12-31"],
+            query_dir=query_dir,
+            stop_on_error=True,
+        )
+    ff.stop_engine()
+    sim.dispose()
+
+
+def test_run_async(tmp_path):
+    """ Overlapping async runs keep separate results and share one query worker limit """
+    
+    query_dir = tmp_path.joinpath("bank")
+    query_dir.mkdir()
+    for i in range(3):
+        query_dir.joinpath(f"simQuery{i}.sql").write_text(
+            "-- DIALECT: sqlite\n-- ENTITY: team_id\n-- DOMAIN: wins\n"
+            f"SELECT idx, SUM(y) + {i} AS y_sum FROM {{LEFTMOST_TABLE}} GROUP BY idx\n"
+        )
+    
+    sim = Simulator(profiles={"simQuery*": {"latency": 0.2}})
+    sim.engine.execute("CREATE TABLE teams (team_id TEXT, y INTEGER)")
+    sim.engine.execute("INSERT INTO teams VALUES ('a', 1), ('b', 0)")
+    sim.engine.execute("CREATE TABLE rookies (team_id TEXT, y INTEGER)")
+    sim.engine.execute("INSERT INTO rookies VALUES ('c', 1)")
+    
+    ff = FeatureFactory()
+    ff.start_engine({"dialect": "sqlite", "schema": "main", "engine": sim.engine, "max_workers": 2})
+    kwargs = {
+        "entity_id": "team_id",
+        "domains": ["wins"],
+        "date_range": ["2020-01-01", "2020-12-31"],
+        "query_dir": query_dir,
+    }
+    handles = [ff.run_async(leftmost_table=t, **kwargs) for t in ["teams", "rookies"]]
+    assert handles[0].progress()["status"] in ["PENDING", "RUNNING"]
+    
+    async def gather():
+        return await asyncio.gather(*handles)
+    results = asyncio.run(gather())
+    
+    assert [h.progress() for h in handles] == [{"status": "SUCCESS", "phase": "DROPPING", "percent": 100}] * 2
+    assert results[0] is handles[0].result() and results[0] is not ff
+    assert sorted(results[0].get_dataframe()["idx"].str[0]) == ["a", "b"]
+    assert sorted(results[1].get_dataframe()["idx"].str[0]) == ["c"]
+    assert results[0].table != results[1].table
+    assert getattr(ff, "df", None) is None
+    
+    # Feature queries of both runs never exceed max_workers
+    active, peak = 0, 0
+    for _, label, event, _ in sim.timeline().itertuples(index=False):
+        if label.startswith("simQuery"):
+            active += 1 if event == "start" else -1
+            peak = max(peak, active)
+    assert peak == 2
+    
+    with pytest.raises(ValueError):
+        ff.run_async(leftmost_table="teams", **dict(kwargs, entity_id="missing")).result()
+    with pytest.raises(ValueError):
+        FeatureFactory().run_async(leftmost_table="teams", **kwargs)
+    ff.stop_engine()
+    sim.dispose()
@@ -0,0 +1,86 @@
+# Copyright 2022 CVS Health and/or one of its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import pytest
+
+from coldstart.build import FeatureFactory
+from coldstart.trace import Tracer, JSONTracer
+
+
+def test_json_tracer(tmp_path):
+    """ Spans nest, record exceptions and are written as JSON lines """
+    
+    path = tmp_path.joinpath("spans.jsonl")
+    tracer = JSONTracer(path=path)
+    
+    with tracer.start_as_current_span("parent", attributes={"a": 1}) as parent:
+        with tracer.start_as_current_span("child") as child:
+            child.set_attribute("rows", 10)
+    with pytest.raises(ValueError):
+        with tracer.start_as_current_span("failing"):
+            raise ValueError("boom")
+    
+    child, parent, failing = tracer.spans
+    assert child["parent_id"] == parent["span_id"]
+    assert child["trace_id"] == parent["trace_id"]
+    assert child["attributes"] == {"rows": 10}
+    assert failing["status"] == "ERROR"
+    assert failing["events"][0]["attributes"]["exception.message"] == "boom"
+    assert [json.loads(l)["name"] for l in path.read_text().splitlines()] == ["child", "parent", "failing"]
+    
+    with Tracer().start_as_current_span("noop") as span:
+        span.set_attributes({"rows": 1})
+        assert span.is_recording() is False
+
+
+def test_traced_run(tmp_path):
+    """ run emits a span per phase and per query under one trace """
+    
+    query_dir = tmp_path.joinpath("bank")
+    query_dir.mkdir()
+    for i in range(2):
+        query_dir.joinpath(f"traceQuery{i}.sql").write_text(
+            "-- DIALECT: sqlite\n-- ENTITY: team_id\n-- DOMAIN: wins\n"
+            f"SELECT idx, SUM(y) + {i} AS y_sum FROM {{LEFTMOST_TABLE}} GROUP BY idx\n"
+        )
+    
+    tracer = JSONTracer()
+    ff = FeatureFactory(tracer=tracer)
+    ff.start_engine({"dialect": "sqlite", "database": str(tmp_path.joinpath("wh.db")), "schema": "main"})
+    ff.engine.execute("CREATE TABLE teams (team_id TEXT, y INTEGER)")
+    ff.engine.execute("INSERT INTO teams VALUES ('a', 1), ('b', 0)")
+    ff.run(
+        leftmost_table="teams",
+        entity_id="team_id",
+        domains=["wins"],
+        date_range=["2020-01-01", "2020-12-31"],
+        query_dir=query_dir,
+        downcast=True,
+    )
+    ff.stop_engine()
+    
+    spans = {s["name"]: s for s in tracer.spans}
+    assert set(spans) == {
+        "coldstart.run", "coldstart.staging", "coldstart.parsing", "coldstart.templating",
+        "coldstart.querying", "coldstart.query", "coldstart.metadata", "coldstart.merge",
+        "coldstart.fetch", "coldstart.downcast", "coldstart.drop",
+    }
+    assert len({s["trace_id"] for s in tracer.spans}) == 1
+    queries = [s for s in tracer.spans if s["name"] == "coldstart.query"]
+    assert sorted(s["attributes"]["coldstart.query_name"] for s in queries) == ["traceQuery0", "traceQuery1"]
+    assert all(s["parent_id"] == spans["coldstart.querying"]["span_id"] for s in queries)
+    assert spans["coldstart.fetch"]["attributes"]["coldstart.rows"] == 2
+    assert spans["coldstart.merge"]["attributes"]["coldstart.columns"] == len(ff.df.columns) == 4
+    assert spans["coldstart.run"]["status"] == "OK"